@@ -1,11 +1,90 @@
 from databases import Database
 import os
+import time
+import base64
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple, Union
+from app.events import job_events
+from app.job_cache import job_cache
+from app.metrics import Histogram
+from app.sqlite_db import SQLiteDatabase, sqlite_path
+from app.write_behind import WriteBehindBuffer
 
 load_dotenv()
 DB_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./jobs.db")
-db = Database(DB_URL)
+
+# SQLite keeps timestamps as text; other databases take and return datetimes
+TIMESTAMPS_AS_TEXT = DB_URL.startswith("sqlite")
+DBTimestamp = Union[str, datetime]
+
+# Query latency, labelled with the name its caller gives the query, e.g. get_job or claim_job
+db_query_seconds = Histogram("db_query_duration_seconds", "Database query latency by statement", ("statement",))
+
+class TimedDatabase:
+    """
+    Records the latency of every query on a database, waiting for a reader or
+    the write lock included. Callers name the query with statement=; unnamed
+    queries are labelled with the operation, e.g. execute_many.
+    """
+
+    def __init__(self, database):
+        self._database = database
+
+    def __getattr__(self, name):
+        return getattr(self._database, name)
+
+    async def fetch_one(self, query: str, values: dict = None, statement: str = "fetch_one"):
+        started_at = time.monotonic()
+        try:
+            return await self._database.fetch_one(query, values)
+        finally:
+            db_query_seconds.labels(statement).observe(time.monotonic() - started_at)
+
+    async def fetch_all(self, query: str, values: dict = None, statement: str = "fetch_all"):
+        started_at = time.monotonic()
+        try:
+            return await self._database.fetch_all(query, values)
+        finally:
+            db_query_seconds.labels(statement).observe(time.monotonic() - started_at)
+
+    async def execute(self, query: str, values: dict = None, statement: str = "execute"):
+        started_at = time.monotonic()
+        try:
+            return await self._database.execute(query, values)
+        finally:
+            db_query_seconds.labels(statement).observe(time.monotonic() - started_at)
+
+    async def execute_many(self, query: str, values: list, statement: str = "execute_many"):
+        started_at = time.monotonic()
+        try:
+            return await self._database.execute_many(query, values)
+        finally:
+            db_query_seconds.labels(statement).observe(time.monotonic() - started_at)
+
+def create_database(url: str):
+    """SQLite files get the tuned reader/writer setup, anything else goes through databases"""
+    path = sqlite_path(url)
+    if path is not None:
+        return TimedDatabase(SQLiteDatabase(path))
+    return TimedDatabase(Database(url))
+
+db = create_database(DB_URL)
+
+# Durability of job status updates: "immediate" commits every update on its own,
+# "batched" buffers them for JOB_STATUS_FLUSH_MS and commits them together
+JOB_STATUS_WRITE_MODE = os.getenv("JOB_STATUS_WRITE_MODE", "immediate").lower()
+JOB_STATUS_FLUSH_MS = float(os.getenv("JOB_STATUS_FLUSH_MS", "10"))
+JOB_STATUS_MAX_BATCH = int(os.getenv("JOB_STATUS_MAX_BATCH", "200"))
+
+UPDATE_JOB_STATUS_SQL = """
+UPDATE jobs 
+SET status = :status, result_url = :result_url, retryable = :retryable, updated_at = :updated_at
+WHERE id = :job_id
+"""
+
+# Write-behind buffer for status updates, only used in batched mode
+status_writes = WriteBehindBuffer(db, UPDATE_JOB_STATUS_SQL, JOB_STATUS_FLUSH_MS / 1000, JOB_STATUS_MAX_BATCH)
 
 # SQL to create jobs table
 CREATE_TABLE_SQL = """
@@ -20,44 +99,477 @@ CREATE TABLE IF NOT EXISTS jobs (
 );
 """
 
+# Columns added to the jobs table after it was first created. init_db adds
+# any that are missing so existing databases are upgraded in place.
+JOB_COLUMN_MIGRATIONS = [
+    ("input_bytes", "INTEGER"),
+    ("processed_bytes", "INTEGER"),
+    ("upstream_request_id", "TEXT"),
+    ("retryable", "INTEGER"),
+    ("input_object", "TEXT"),
+    ("lease_owner", "TEXT"),
+    ("lease_expires_at", "TIMESTAMP"),
+    ("attempts", "INTEGER"),
+    ("tenant", "TEXT"),
+    ("priority", "TEXT"),
+    ("timeline", "TEXT"),
+]
+
+# Every column of a jobs row, used to build the cached row of a new job
+JOB_COLUMNS = [
+    "id", "status", "prompt", "original_path", "result_url", "created_at", "updated_at"
+] + [name for name, _ in JOB_COLUMN_MIGRATIONS]
+
+# Indexes backing keyset pagination of the job listing, with and without a status filter
+CREATE_INDEXES_SQL = [
+    "CREATE INDEX IF NOT EXISTS idx_jobs_created_at_id ON jobs (created_at, id)",
+    "CREATE INDEX IF NOT EXISTS idx_jobs_status_created_at_id ON jobs (status, created_at, id)",
+    # Backs the change feed that follows jobs updated by external workers
+    "CREATE INDEX IF NOT EXISTS idx_jobs_updated_at ON jobs (updated_at)",
+]
+
+# SQL to create the persistent tier of the FalAI result cache
+CREATE_RESULT_CACHE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS result_cache (
+    key TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    result_url TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_hit_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
 async def init_db():
     """Initialize the database and create tables if they don't exist"""
-    await db.execute(CREATE_TABLE_SQL)
+    await db.execute(CREATE_TABLE_SQL, statement="init_db")
+    await add_missing_columns("jobs", JOB_COLUMN_MIGRATIONS)
+    for index_sql in CREATE_INDEXES_SQL:
+        await db.execute(index_sql, statement="init_db")
+    await db.execute(CREATE_RESULT_CACHE_TABLE_SQL, statement="init_db")
+
+async def add_missing_columns(table: str, columns):
+    """Add the given (name, type) columns to a table unless it already has them"""
+    if DB_URL.startswith("sqlite"):
+        existing = {row["name"] for row in await db.fetch_all(f"PRAGMA table_info({table})", statement="add_missing_columns")}
+    else:
+        query = "SELECT column_name FROM information_schema.columns WHERE table_schema = current_schema() AND table_name = :table"
+        existing = {row["column_name"] for row in await db.fetch_all(query, {"table": table}, statement="add_missing_columns")}
+    for name, column_type in columns:
+        if name not in existing:
+            await db.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}", statement="add_missing_columns")
+
+def current_timestamp() -> DBTimestamp:
+    """The current UTC time as a timestamp query parameter, see to_db_timestamp"""
+    return to_db_timestamp(datetime.now(timezone.utc))
 
-async def create_job(job_id: str, prompt: str, original_path: str):
-    """Create a new job in the database"""
+async def create_job(
+    job_id: str,
+    prompt: str,
+    original_path: str,
+    input_object: str = None,
+    tenant: str = None,
+    priority: str = None,
+    timeline: str = None,
+    lease_owner: str = None,
+    lease_seconds: float = 0
+):
+    """
+    Create a new job in the database. input_object names the stored copy of the
+    upload, if any; tenant and priority decide where the job is scheduled.
+    timeline is the JSON phase timeline so far, for a worker to carry on.
+    With lease_owner the job starts out claimed by that owner, e.g. the API
+    process that runs it, so no other process recovers it while the lease is renewed.
+    """
+    # Timestamps are set here rather than by the column default so the cached row matches the database
+    created_at = datetime.now(timezone.utc)
+    now = to_db_timestamp(created_at)
+    lease_expires_at = to_db_timestamp(created_at + timedelta(seconds=lease_seconds)) if lease_owner else None
+    attempts = 1 if lease_owner else None
     query = """
-    INSERT INTO jobs (id, status, prompt, original_path)
-    VALUES (:job_id, :status, :prompt, :original_path)
+    INSERT INTO jobs (
+        id, status, prompt, original_path, input_object, tenant, priority, timeline,
+        lease_owner, lease_expires_at, attempts, created_at, updated_at
+    )
+    VALUES (
+        :job_id, :status, :prompt, :original_path, :input_object, :tenant, :priority, :timeline,
+        :lease_owner, :lease_expires_at, :attempts, :created_at, :updated_at
+    )
     """
     values = {
         "job_id": job_id,
         "status": "pending",
         "prompt": prompt,
-        "original_path": original_path
+        "original_path": original_path,
+        "input_object": input_object,
+        "tenant": tenant,
+        "priority": priority,
+        "timeline": timeline,
+        "lease_owner": lease_owner,
+        "lease_expires_at": lease_expires_at,
+        "attempts": attempts,
+        "created_at": now,
+        "updated_at": now
     }
-    await db.execute(query, values)
+    await db.execute(query, values, statement="create_job")
+
+    row = dict.fromkeys(JOB_COLUMNS)
+    row.update({
+        "id": job_id,
+        "status": "pending",
+        "prompt": prompt,
+        "original_path": original_path,
+        "input_object": input_object,
+        "tenant": tenant,
+        "priority": priority,
+        "timeline": timeline,
+        "lease_owner": lease_owner,
+        "lease_expires_at": lease_expires_at,
+        "attempts": attempts,
+        "created_at": now,
+        "updated_at": now
+    })
+    job_cache.put(job_id, row)
 
 async def get_job(job_id: str):
-    """Get a job by its ID"""
+    """Get a job by its ID, served from the in-memory job cache when possible"""
+    job = job_cache.get(job_id)
+    if job is not None:
+        return job
     query = "SELECT * FROM jobs WHERE id = :job_id"
-    return await db.fetch_one(query, {"job_id": job_id})
-
-async def get_all_jobs():
-    """Get all jobs"""
-    query = "SELECT * FROM jobs ORDER BY created_at DESC"
-    return await db.fetch_all(query)
+    row = await db.fetch_one(query, {"job_id": job_id}, statement="get_job")
+    if row is None:
+        return None
+    job = dict(row)
+    # A batched status update may not have reached the database yet
+    pending = status_writes.pending(job_id)
+    if pending is not None:
+        job.update({key: pending[key] for key in ("status", "result_url", "retryable", "updated_at")})
+    job_cache.put(job_id, job)
+    return job
 
-async def update_job_status(job_id: str, status: str, result_url: str = None):
-    """Update the status of a job"""
+async def record_image_sizes(job_id: str, input_bytes: int, processed_bytes: int):
+    """Record the uploaded image size and the size actually sent to FalAI"""
     query = """
-    UPDATE jobs 
-    SET status = :status, result_url = :result_url, updated_at = CURRENT_TIMESTAMP
+    UPDATE jobs SET input_bytes = :input_bytes, processed_bytes = :processed_bytes
     WHERE id = :job_id
     """
     values = {
         "job_id": job_id,
+        "input_bytes": input_bytes,
+        "processed_bytes": processed_bytes
+    }
+    await db.execute(query, values, statement="record_image_sizes")
+    job_cache.update(job_id, {"input_bytes": input_bytes, "processed_bytes": processed_bytes})
+
+async def set_original_path(job_id: str, original_path: str):
+    """Point a job at the stored copy of its input image"""
+    query = "UPDATE jobs SET original_path = :original_path WHERE id = :job_id"
+    await db.execute(query, {"job_id": job_id, "original_path": original_path}, statement="set_original_path")
+    job_cache.update(job_id, {"original_path": original_path})
+
+async def set_upstream_request_id(job_id: str, request_id: str):
+    """Record the FalAI queue request a job is waiting on, so it can be resumed after a restart"""
+    query = "UPDATE jobs SET upstream_request_id = :request_id WHERE id = :job_id"
+    await db.execute(query, {"job_id": job_id, "request_id": request_id}, statement="set_upstream_request_id")
+    job_cache.update(job_id, {"upstream_request_id": request_id})
+
+async def set_job_timeline(job_id: str, timeline: str):
+    """Store the JSON phase timeline of a job"""
+    query = "UPDATE jobs SET timeline = :timeline WHERE id = :job_id"
+    await db.execute(query, {"job_id": job_id, "timeline": timeline}, statement="set_job_timeline")
+    job_cache.update(job_id, {"timeline": timeline})
+
+async def get_recent_timelines(limit: int):
+    """Phase timelines of the most recently finished jobs"""
+    query = """
+    SELECT timeline FROM jobs
+    WHERE status IN ('completed', 'failed') AND timeline IS NOT NULL
+    ORDER BY updated_at DESC LIMIT :limit
+    """
+    return [row["timeline"] for row in await db.fetch_all(query, {"limit": limit}, statement="get_recent_timelines")]
+
+async def get_unfinished_jobs():
+    """Jobs left pending or processing, oldest first, e.g. by a server that was restarted"""
+    query = """
+    SELECT id, status, prompt, original_path, input_object, upstream_request_id, tenant, priority, timeline FROM jobs
+    WHERE status IN ('pending', 'processing')
+    ORDER BY created_at, id
+    """
+    return await db.fetch_all(query, statement="get_unfinished_jobs")
+
+# A job can be claimed when it's unfinished and nobody holds an unexpired lease on it
+CLAIMABLE_JOB_SQL = """
+status IN ('pending', 'processing')
+AND (lease_expires_at IS NULL OR lease_expires_at < :now)
+AND COALESCE(attempts, 0) < :max_attempts
+"""
+
+# Claimable jobs in the order workers should take them: round-robin across
+# tenants, with each interactive round counting for :interactive_weight batch rounds
+CLAIM_CANDIDATES_SQL = f"""
+SELECT id, attempts FROM (
+    SELECT id, attempts, created_at, priority,
+        ROW_NUMBER() OVER (PARTITION BY COALESCE(priority, 'interactive'), tenant ORDER BY created_at, id) AS turn
+    FROM jobs WHERE {CLAIMABLE_JOB_SQL}
+) AS candidates
+ORDER BY CASE WHEN priority = 'batch' THEN turn ELSE turn / :interactive_weight END, created_at, id
+LIMIT :limit
+"""
+
+async def claim_jobs(owner: str, limit: int, lease_seconds: float, max_attempts: int, interactive_weight: float = 1.0):
+    """
+    Lease up to limit claimable jobs to owner, taking turns across tenants and
+    favouring interactive jobs by interactive_weight. Each claim is a
+    compare-and-set on the lease columns, read back to see whether this owner
+    won it, so workers in other processes or on other machines never both
+    claim a job. Returns the claimed rows.
+    """
+    now = datetime.now(timezone.utc)
+    values = {"now": to_db_timestamp(now), "max_attempts": max_attempts, "limit": limit, "interactive_weight": interactive_weight}
+    candidates = await db.fetch_all(CLAIM_CANDIDATES_SQL, values, statement="claim_candidates")
+    expires_at = to_db_timestamp(now + timedelta(seconds=lease_seconds))
+    claimed = []
+    for candidate in candidates:
+        attempts = (candidate["attempts"] or 0) + 1
+        await db.execute(
+            f"""
+            UPDATE jobs SET lease_owner = :owner, lease_expires_at = :expires_at, attempts = :attempts
+            WHERE id = :job_id AND COALESCE(attempts, 0) = :previous_attempts AND {CLAIMABLE_JOB_SQL}
+            """,
+            {
+                "now": values["now"],
+                "max_attempts": max_attempts,
+                "owner": owner,
+                "expires_at": expires_at,
+                "attempts": attempts,
+                "previous_attempts": attempts - 1,
+                "job_id": candidate["id"],
+            },
+            statement="claim_job"
+        )
+        row = await db.fetch_one(
+            "SELECT id, status, prompt, input_object, upstream_request_id, tenant, priority, timeline, lease_owner, attempts FROM jobs WHERE id = :job_id",
+            {"job_id": candidate["id"]},
+            statement="read_claim"
+        )
+        if row is not None and row["lease_owner"] == owner and row["attempts"] == attempts:
+            claimed.append(row)
+            job_cache.update(row["id"], {"lease_owner": owner, "lease_expires_at": expires_at, "attempts": attempts})
+    return claimed
+
+async def renew_leases(owner: str, lease_seconds: float):
+    """Extend every lease owner holds on unfinished jobs. Called by the owner's heartbeat."""
+    query = """
+    UPDATE jobs SET lease_expires_at = :expires_at
+    WHERE lease_owner = :owner AND status IN ('pending', 'processing')
+    """
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=lease_seconds)
+    await db.execute(query, {"owner": owner, "expires_at": to_db_timestamp(expires_at)}, statement="renew_leases")
+
+async def release_leases(owner: str):
+    """
+    Expire owner's leases on unfinished jobs so other workers reclaim them right
+    away. The claim is handed back rather than used up, so routine restarts
+    don't count toward JOB_MAX_ATTEMPTS; only crashes and expired leases do.
+    """
+    query = """
+    UPDATE jobs SET lease_expires_at = :now, attempts = CASE WHEN attempts > 0 THEN attempts - 1 ELSE 0 END
+    WHERE lease_owner = :owner AND status IN ('pending', 'processing')
+    """
+    await db.execute(query, {"owner": owner, "now": current_timestamp()}, statement="release_leases")
+
+async def get_exhausted_jobs(max_attempts: int):
+    """Unfinished jobs whose last lease expired after max_attempts claims, e.g. because they keep crashing workers"""
+    query = """
+    SELECT id FROM jobs
+    WHERE status IN ('pending', 'processing') AND lease_expires_at < :now AND COALESCE(attempts, 0) >= :max_attempts
+    """
+    return await db.fetch_all(query, {"now": current_timestamp(), "max_attempts": max_attempts}, statement="get_exhausted_jobs")
+
+async def count_unfinished_jobs() -> dict:
+    """Number of pending and processing jobs, by status"""
+    rows = await db.fetch_all(
+        "SELECT status, COUNT(*) AS count FROM jobs WHERE status IN ('pending', 'processing') GROUP BY status",
+        statement="count_unfinished_jobs"
+    )
+    counts = {"pending": 0, "processing": 0}
+    counts.update({row["status"]: row["count"] for row in rows})
+    return counts
+
+async def count_pending_jobs() -> int:
+    """Number of jobs waiting for a worker"""
+    row = await db.fetch_one("SELECT COUNT(*) AS count FROM jobs WHERE status = 'pending'", statement="count_pending_jobs")
+    return row["count"]
+
+async def get_jobs_updated_since(since: DBTimestamp, limit: int, after_id: Optional[str] = None):
+    """
+    Jobs updated at or after the since timestamp, oldest update first. With
+    after_id, jobs updated exactly at since are only those after it in id order,
+    to page through many jobs sharing one updated_at.
+    """
+    values = {"since": since, "limit": limit}
+    if after_id is None:
+        query = "SELECT * FROM jobs WHERE updated_at >= :since ORDER BY updated_at, id LIMIT :limit"
+    else:
+        query = """
+        SELECT * FROM jobs WHERE updated_at > :since OR (updated_at = :since AND id > :after_id)
+        ORDER BY updated_at, id LIMIT :limit
+        """
+        values["after_id"] = after_id
+    return await db.fetch_all(query, values, statement="get_jobs_updated_since")
+
+def to_db_timestamp(value: datetime) -> DBTimestamp:
+    """
+    A datetime as a timestamp query parameter, in UTC: formatted the way
+    SQLite's CURRENT_TIMESTAMP stores it ('YYYY-MM-DD HH:MM:SS') on SQLite, and
+    as a naive datetime on other databases, whose drivers (asyncpg) don't take text
+    """
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    if not TIMESTAMPS_AS_TEXT:
+        return value
+    return value.strftime("%Y-%m-%d %H:%M:%S")
+
+def parse_timestamp(value) -> datetime:
+    """A timestamp column as an aware UTC datetime, whether the driver returns it as text or as a datetime"""
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+def encode_cursor(created_at, job_id: str) -> str:
+    """
+    Opaque pagination cursor pointing at the (created_at, id) of the last job on
+    a page. Keeps created_at at full precision: truncating it would skip or
+    repeat rows at page boundaries on databases that store microseconds.
+    """
+    if isinstance(created_at, datetime):
+        created_at = parse_timestamp(created_at).isoformat()
+    raw = f"{created_at}|{job_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """Inverse of encode_cursor. Raises ValueError for malformed cursors."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+    except Exception:
+        raise ValueError("Invalid cursor")
+    created_at, sep, job_id = raw.partition("|")
+    if not sep or not created_at or not job_id:
+        raise ValueError("Invalid cursor")
+    try:
+        parse_timestamp(created_at)
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    return created_at, job_id
+
+async def list_jobs(
+    limit: int,
+    after: Optional[Tuple[str, str]] = None,
+    status: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None
+):
+    """
+    Get one page of jobs, newest first, using keyset pagination on (created_at, id).
+    'after' is the (created_at, id) of the last job on the previous page.
+    Fetches limit + 1 rows so the caller can tell whether another page exists.
+    """
+    conditions = []
+    values = {"limit": limit + 1}
+    if status:
+        conditions.append("status = :status")
+        values["status"] = status
+    if created_after:
+        conditions.append("created_at >= :created_after")
+        values["created_after"] = to_db_timestamp(created_after)
+    if created_before:
+        conditions.append("created_at < :created_before")
+        values["created_before"] = to_db_timestamp(created_before)
+    if after:
+        conditions.append("(created_at < :after_created_at OR (created_at = :after_created_at AND id < :after_id))")
+        values["after_created_at"] = to_db_timestamp(parse_timestamp(after[0]))
+        values["after_id"] = after[1]
+
+    query = "SELECT * FROM jobs"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY created_at DESC, id DESC LIMIT :limit"
+    return await db.fetch_all(query, values, statement="list_jobs")
+
+async def update_job_status(job_id: str, status: str, result_url: str = None, retryable: bool = False):
+    """
+    Update the status of a job. In batched mode the write is buffered and
+    committed with others shortly after; get_job sees the new state immediately.
+    retryable marks a failure the client may resubmit, e.g. while FalAI is degraded.
+    """
+    now = current_timestamp()
+    values = {
+        "job_id": job_id,
+        "status": status,
+        "result_url": result_url,
+        "retryable": int(retryable),
+        "updated_at": now
+    }
+    if JOB_STATUS_WRITE_MODE == "batched":
+        status_writes.add(job_id, values)
+    else:
+        await db.execute(UPDATE_JOB_STATUS_SQL, values, statement="update_job_status")
+    job_cache.update(job_id, {"status": status, "result_url": result_url, "retryable": int(retryable), "updated_at": now})
+    # Wake up anyone watching this job over SSE or WebSocket
+    job_events.publish(job_id, {"id": job_id, "status": status, "result_url": result_url})
+
+def cache_cutoff(max_age_seconds: int) -> DBTimestamp:
+    """Timestamp before which a cached result is older than max_age_seconds"""
+    return to_db_timestamp(datetime.now(timezone.utc) - timedelta(seconds=max_age_seconds))
+
+async def get_cached_result(key: str, max_age_seconds: int = 0):
+    """Get a cached FalAI result by cache key, ignoring entries older than max_age_seconds (0 = no limit)"""
+    query = "SELECT * FROM result_cache WHERE key = :key"
+    values = {"key": key}
+    if max_age_seconds:
+        query += " AND created_at >= :cutoff"
+        values["cutoff"] = cache_cutoff(max_age_seconds)
+    return await db.fetch_one(query, values, statement="get_cached_result")
+
+async def touch_cached_result(key: str):
+    """Record a hit on a cached FalAI result so it is kept when the table is pruned"""
+    query = "UPDATE result_cache SET last_hit_at = :now WHERE key = :key"
+    await db.execute(query, {"key": key, "now": current_timestamp()}, statement="touch_cached_result")
+
+async def put_cached_result(key: str, status: str, result_url: str = None):
+    """Store a FalAI result in the persistent cache, replacing any previous entry"""
+    query = """
+    INSERT INTO result_cache (key, status, result_url, created_at, last_hit_at)
+    VALUES (:key, :status, :result_url, :now, :now)
+    ON CONFLICT (key) DO UPDATE SET
+        status = excluded.status, result_url = excluded.result_url,
+        created_at = excluded.created_at, last_hit_at = excluded.last_hit_at
+    """
+    values = {
+        "key": key,
         "status": status,
-        "result_url": result_url
+        "result_url": result_url,
+        "now": current_timestamp()
     }
-    await db.execute(query, values)
\ No newline at end of file
+    await db.execute(query, values, statement="put_cached_result")
+
+async def prune_cached_results(max_rows: int, max_age_seconds: int = 0):
+    """Delete expired cache entries and keep only the max_rows most recently used ones"""
+    if max_age_seconds:
+        await db.execute(
+            "DELETE FROM result_cache WHERE created_at < :cutoff",
+            {"cutoff": cache_cutoff(max_age_seconds)},
+            statement="prune_cached_results"
+        )
+    query = """
+    DELETE FROM result_cache WHERE key NOT IN (
+        SELECT key FROM result_cache ORDER BY last_hit_at DESC LIMIT :max_rows
+    )
+    """
+    await db.execute(query, {"max_rows": max_rows}, statement="prune_cached_results")
+
+async def flush_job_status_writes():
+    """Commit every buffered status update. Called on shutdown before the database disconnects."""
+    await status_writes.close()
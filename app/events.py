@@ -0,0 +1,76 @@
+import asyncio
+import logging
+
+# Job statuses after which no further transitions happen
+TERMINAL_STATUSES = ("completed", "failed")
+
+# Events buffered per subscriber; a slow watcher only ever needs the latest status
+SUBSCRIBER_QUEUE_SIZE = 8
+
+
+class JobEventBus:
+    """
+    In-process pub/sub of job status transitions. Each watcher gets its own
+    small queue, so an idle watcher costs one queue and one waiting coroutine.
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.setdefault(job_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(job_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[job_id]
+
+    def publish(self, job_id: str, event: dict):
+        """Fan an event out to every watcher of job_id without blocking"""
+        queues = self._subscribers.get(job_id)
+        if not queues:
+            return
+        self.published += 1
+        for queue in queues:
+            if queue.full():
+                # Drop the oldest event rather than block the publisher
+                dropped = queue.get_nowait()
+                self.dropped += 1
+                logging.debug(f"Watcher of job {job_id} is behind, dropped its {dropped['status']} event")
+            queue.put_nowait(event)
+
+    def stats(self) -> dict:
+        return {
+            "watched_jobs": len(self._subscribers),
+            "subscribers": sum(len(queues) for queues in self._subscribers.values()),
+            "published": self.published,
+            "dropped": self.dropped,
+        }
+
+
+# Shared bus fed by update_job_status
+job_events = JobEventBus()
+
+
+def job_event(job) -> dict:
+    """Status event payload for a job row"""
+    return {
+        "id": job["id"],
+        "status": job["status"],
+        "result_url": job["result_url"],
+    }
+
+
+async def next_event(queue: asyncio.Queue, timeout: float):
+    """Wait up to timeout seconds for the next event, returning None on timeout"""
+    try:
+        return await asyncio.wait_for(queue.get(), timeout)
+    except asyncio.TimeoutError:
+        return None
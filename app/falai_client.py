@@ -1,11 +1,19 @@
 import os
 import httpx
-import base64
 from dotenv import load_dotenv
 import json
+import time
 import asyncio
+import hashlib
 import logging
-from typing import Optional
+import functools
+from typing import Dict, Optional
+from app.request_body import ImageJSONBody, JSONBody
+from app.metrics import Histogram, SLOW_BUCKETS
+from app.timeline import JobTimeline, ENCODE, SUBMIT, INFERENCE, RETRIES
+from app.resilience import (
+    RetryPolicy, RetryBudget, CircuitBreaker, NonRetryableError, RetryableError, CircuitOpenError, call_with_retries, RETRYABLE_STATUS_CODES
+)
 
 load_dotenv()
 FALAI_KEY = os.getenv("FALAI_API_KEY")
@@ -19,16 +27,316 @@ else:
     logging.info("FalAI API key not configured - will be required when processing images")
 
 # Using the Qwen Image Edit Plus LoRA model for better image editing capabilities
-FALAI_URL = "https://fal.run/fal-ai/qwen-image-edit-plus-lora"
+FALAI_URL = os.getenv("FALAI_URL", "https://fal.run/fal-ai/qwen-image-edit-plus-lora")
+
+# "sync" holds one request open against FALAI_URL for the whole inference;
+# "queue" submits to FALAI_QUEUE_URL and tracks the request from background pollers
+FALAI_MODE = os.getenv("FALAI_MODE", "sync").lower()
+FALAI_QUEUE_URL = os.getenv("FALAI_QUEUE_URL", "https://queue.fal.run/fal-ai/qwen-image-edit-plus-lora")
+
+# Queue statuses reported by FalAI's status endpoint
+QUEUE_COMPLETED = "COMPLETED"
+
+# Model parameters sent with every request according to the Qwen Image Edit Plus LoRA API specification
+FALAI_PARAMS = {
+    "num_inference_steps": 28,
+    "guidance_scale": 4,
+    "num_images": 1,
+    "enable_safety_checker": True,
+    "output_format": "png",
+    "negative_prompt": "",
+    "acceleration": "regular"
+}
+
+# Connection pool settings for the shared HTTP client
+FALAI_MAX_CONNECTIONS = int(os.getenv("FALAI_MAX_CONNECTIONS", "20"))
+FALAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("FALAI_MAX_KEEPALIVE_CONNECTIONS", "10"))
+FALAI_KEEPALIVE_EXPIRY = float(os.getenv("FALAI_KEEPALIVE_EXPIRY", "60"))
+FALAI_CONNECT_TIMEOUT = float(os.getenv("FALAI_CONNECT_TIMEOUT", "10"))
+# Set timeout to 300 seconds (5 minutes) for inference requests
+FALAI_TIMEOUT = float(os.getenv("FALAI_TIMEOUT", "300"))
+# HTTP/2 needs the optional 'h2' package (pip install httpx[http2])
+FALAI_HTTP2 = os.getenv("FALAI_HTTP2", "false").lower() in ("1", "true", "yes")
+
+# Retries: attempts per request and the exponential backoff with full jitter between them, in seconds
+FALAI_MAX_ATTEMPTS = int(os.getenv("FALAI_MAX_ATTEMPTS", "3"))
+FALAI_RETRY_BASE_DELAY = float(os.getenv("FALAI_RETRY_BASE_DELAY", "1.0"))
+FALAI_RETRY_MAX_DELAY = float(os.getenv("FALAI_RETRY_MAX_DELAY", "30"))
+# Process-wide retry budget: retries may add at most this fraction of the requests
+# made over the window, plus a few retries that are always allowed
+FALAI_RETRY_BUDGET_RATIO = float(os.getenv("FALAI_RETRY_BUDGET_RATIO", "0.2"))
+FALAI_RETRY_BUDGET_WINDOW = float(os.getenv("FALAI_RETRY_BUDGET_WINDOW", "60"))
+FALAI_RETRY_BUDGET_MIN = int(os.getenv("FALAI_RETRY_BUDGET_MIN", "3"))
+# Circuit breaker: opens when at least this failure rate is seen over the window
+# (with a minimum number of requests), stays open for a while, then probes
+FALAI_BREAKER_FAILURE_RATE = float(os.getenv("FALAI_BREAKER_FAILURE_RATE", "0.5"))
+FALAI_BREAKER_MIN_REQUESTS = int(os.getenv("FALAI_BREAKER_MIN_REQUESTS", "10"))
+FALAI_BREAKER_WINDOW = float(os.getenv("FALAI_BREAKER_WINDOW", "60"))
+FALAI_BREAKER_OPEN_SECONDS = float(os.getenv("FALAI_BREAKER_OPEN_SECONDS", "30"))
+FALAI_BREAKER_HALF_OPEN_PROBES = int(os.getenv("FALAI_BREAKER_HALF_OPEN_PROBES", "2"))
+
+# Shared by every FalAI call in the process
+retry_policy = RetryPolicy(FALAI_MAX_ATTEMPTS, FALAI_RETRY_BASE_DELAY, FALAI_RETRY_MAX_DELAY)
+retry_budget = RetryBudget(FALAI_RETRY_BUDGET_RATIO, FALAI_RETRY_BUDGET_WINDOW, FALAI_RETRY_BUDGET_MIN)
+circuit_breaker = CircuitBreaker(
+    FALAI_BREAKER_FAILURE_RATE,
+    FALAI_BREAKER_MIN_REQUESTS,
+    FALAI_BREAKER_WINDOW,
+    FALAI_BREAKER_OPEN_SECONDS,
+    FALAI_BREAKER_HALF_OPEN_PROBES
+)
+
+# How requests authenticate: "auto" probes once per API key for the scheme FalAI
+# accepts, or one of "key", "bearer", "x-api-key" to skip the probe
+FALAI_AUTH_SCHEME = os.getenv("FALAI_AUTH_SCHEME", "auto").lower()
+# Cheap authenticated request used for the probe: the status of a request that
+# doesn't exist answers 404 when the credentials are accepted and 401 when not
+FALAI_AUTH_PROBE_URL = os.getenv(
+    "FALAI_AUTH_PROBE_URL",
+    f"{FALAI_QUEUE_URL}/requests/00000000-0000-0000-0000-000000000000/status"
+)
+
+AUTH_SCHEMES = {
+    "key": lambda api_key: {"Authorization": f"Key {api_key}"},
+    "bearer": lambda api_key: {"Authorization": f"Bearer {api_key}"},
+    "x-api-key": lambda api_key: {"X-API-Key": api_key},
+}
+
+# One long-lived client per process so connections to fal.run are reused across jobs
+_http_client: Optional[httpx.AsyncClient] = None
+_requests_sent = 0
+_connections_opened = 0
+
+
+async def _trace(event_name: str, info: dict):
+    global _connections_opened
+    if event_name == "connection.connect_tcp.complete":
+        _connections_opened += 1
+
+
+async def _on_request(request: httpx.Request):
+    global _requests_sent
+    _requests_sent += 1
+    request.extensions["trace"] = _trace
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+async def start_http_client() -> httpx.AsyncClient:
+    """Create the shared HTTP client. Called from the FastAPI startup hook."""
+    global _http_client
+    if _http_client is not None:
+        return _http_client
+
+    http2 = FALAI_HTTP2
+    if http2 and not _http2_available():
+        logging.warning("FALAI_HTTP2 is enabled but the 'h2' package is not installed - falling back to HTTP/1.1")
+        http2 = False
+
+    limits = httpx.Limits(
+        max_connections=FALAI_MAX_CONNECTIONS,
+        max_keepalive_connections=FALAI_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=FALAI_KEEPALIVE_EXPIRY
+    )
+    _http_client = httpx.AsyncClient(
+        timeout=httpx.Timeout(FALAI_TIMEOUT, connect=FALAI_CONNECT_TIMEOUT),
+        limits=limits,
+        http2=http2,
+        event_hooks={"request": [_on_request]}
+    )
+    logging.info(
+        f"Shared FalAI HTTP client started (max connections {FALAI_MAX_CONNECTIONS}, "
+        f"keep-alive {FALAI_MAX_KEEPALIVE_CONNECTIONS} for {FALAI_KEEPALIVE_EXPIRY}s, http2={http2})"
+    )
+    return _http_client
+
+
+async def close_http_client():
+    """Close the shared HTTP client. Called from the FastAPI shutdown hook."""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+        logging.info("Shared FalAI HTTP client closed")
+
+
+async def get_http_client() -> httpx.AsyncClient:
+    """Return the shared HTTP client, creating it on first use outside the app lifecycle"""
+    if _http_client is None:
+        return await start_http_client()
+    return _http_client
+
+
+def http_pool_stats() -> dict:
+    """Connection pool usage of the shared client, to check that keep-alive reuse is happening"""
+    stats = {
+        "requests_sent": _requests_sent,
+        "connections_opened": _connections_opened,
+        "connections": 0,
+        "in_use": 0,
+        "idle": 0,
+        "waiting": 0,
+        "max_connections": FALAI_MAX_CONNECTIONS,
+    }
+    if _http_client is None:
+        return stats
+
+    # httpx doesn't expose its pool directly; fall back to zeros if the internals change
+    pool = getattr(_http_client._transport, "_pool", None)
+    if pool is None:
+        return stats
+    connections = list(getattr(pool, "connections", []))
+    idle = sum(1 for connection in connections if connection.is_idle())
+    stats["connections"] = len(connections)
+    stats["idle"] = idle
+    stats["in_use"] = len(connections) - idle
+    stats["waiting"] = sum(1 for request in getattr(pool, "_requests", []) if request.is_queued())
+    return stats
+
+# Discovered auth scheme per API key fingerprint; None when FalAI rejected every scheme
+_auth_schemes: Dict[str, Optional[str]] = {}
+_auth_lock = asyncio.Lock()
+_auth_probes = 0
+
+
+def _key_fingerprint(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+class AuthProbeInconclusive(Exception):
+    """The probe got an answer that neither accepts nor rejects a scheme, e.g. 429 or 5xx"""
+    pass
+
+
+async def _probe_auth_scheme(api_key: str) -> Optional[str]:
+    """
+    Try each scheme against the probe URL and return the first one FalAI
+    accepts: a 2xx or the 404 of the missing request. Raises
+    AuthProbeInconclusive on any answer other than that or 401/403.
+    """
+    global _auth_probes
+    client = await get_http_client()
+    for scheme, make_headers in AUTH_SCHEMES.items():
+        _auth_probes += 1
+        resp = await client.get(FALAI_AUTH_PROBE_URL, headers=make_headers(api_key))
+        if resp.is_success or resp.status_code == 404:
+            logging.info(f"FalAI accepted '{scheme}' authentication (probe answered {resp.status_code})")
+            return scheme
+        if resp.status_code not in (401, 403):
+            raise AuthProbeInconclusive(f"probe answered {resp.status_code} for '{scheme}' authentication")
+        logging.info(f"FalAI rejected '{scheme}' authentication (probe answered {resp.status_code})")
+    return None
+
+
+async def get_auth_scheme(api_key: str) -> str:
+    """
+    The auth scheme for api_key, probed on first use and then cached for the
+    process. Raises NonRetryableError if FalAI rejects the key with every scheme.
+    """
+    if FALAI_AUTH_SCHEME != "auto":
+        return FALAI_AUTH_SCHEME
+    fingerprint = _key_fingerprint(api_key)
+    async with _auth_lock:
+        if fingerprint not in _auth_schemes:
+            try:
+                _auth_schemes[fingerprint] = await _probe_auth_scheme(api_key)
+            except (httpx.TransportError, AuthProbeInconclusive) as e:
+                # Don't cache anything; the next call probes again
+                logging.warning(f"FalAI auth probe failed, using 'key' authentication for now: {e}")
+                return "key"
+        scheme = _auth_schemes[fingerprint]
+    if scheme is None:
+        raise NonRetryableError("FalAI rejected the API key with every supported authentication scheme. Please check your FALAI_API_KEY.", 401)
+    return scheme
+
+
+def forget_auth_scheme(api_key: str):
+    """Drop the cached scheme after FalAI rejected a request, so the next call probes again"""
+    _auth_schemes.pop(_key_fingerprint(api_key), None)
+
+
+def auth_stats() -> dict:
+    schemes = set(_auth_schemes.values())
+    return {
+        "mode": FALAI_AUTH_SCHEME,
+        "schemes": sorted(scheme or "rejected" for scheme in schemes),
+        "probes": _auth_probes,
+    }
+
+
+def resilience_stats() -> dict:
+    return {
+        "circuit_breaker": circuit_breaker.stats(),
+        "retry_budget": retry_budget.stats(),
+    }
 
 class FalAIResult:
     def __init__(self, url: Optional[str] = None):
         self.url = url
 
+class SafetyCheckerError(NonRetryableError):
+    """Raised when FalAI's safety checker blocks the generated content"""
+    pass
+
+class FalAIRequestError(NonRetryableError):
+    """Raised when FalAI answered without a usable result"""
+    pass
+
+class FalAIRequestNotFound(RetryableError):
+    """Raised when FalAI no longer knows a queued request, e.g. one that expired upstream"""
+    pass
+
+# Latency of FalAI calls, retries included, by operation and outcome
+falai_request_seconds = Histogram(
+    "falai_request_duration_seconds", "FalAI call latency including retries, by operation and outcome",
+    ("operation", "outcome"), buckets=SLOW_BUCKETS
+)
+
+def falai_outcome(error: Optional[Exception]) -> str:
+    """Outcome label of a FalAI call: success, nsfw_blocked, timeout, circuit_open, 4xx, 5xx or error"""
+    if error is None:
+        return "success"
+    if isinstance(error, SafetyCheckerError):
+        return "nsfw_blocked"
+    if isinstance(error, CircuitOpenError):
+        return "circuit_open"
+    if isinstance(error, httpx.TimeoutException) or isinstance(error.__cause__, httpx.TimeoutException):
+        return "timeout"
+    status_code = getattr(error, "status_code", None)
+    if isinstance(error, httpx.HTTPStatusError):
+        status_code = error.response.status_code
+    if status_code:
+        return "4xx" if status_code < 500 else "5xx"
+    return "error"
+
+def observed(operation: str):
+    """Record the latency and outcome of a FalAIClient call"""
+    def decorate(method):
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            started_at = time.monotonic()
+            try:
+                result = await method(*args, **kwargs)
+            except Exception as e:
+                falai_request_seconds.labels(operation, falai_outcome(e)).observe(time.monotonic() - started_at)
+                raise
+            falai_request_seconds.labels(operation, "success").observe(time.monotonic() - started_at)
+            return result
+        return wrapper
+    return decorate
+
 class FalAIClient:
     def __init__(self):
         self.api_key = FALAI_KEY
         self.url = FALAI_URL
+        self.queue_url = FALAI_QUEUE_URL
+        self.params = dict(FALAI_PARAMS)
         
         if not self.api_key:
             logging.error("FalAI API key is not configured. Please set FALAI_API_KEY environment variable.")
@@ -39,164 +347,182 @@ class FalAIClient:
             logging.error(f"FalAI API key appears to be a placeholder: {self.api_key}")
             raise ValueError("FalAI API key is set to a placeholder value. Please set a real FALAI_API_KEY environment variable.")
     
-    async def process(self, prompt: str, image_data: bytes, max_retries=3):
+    async def _headers(self) -> dict:
+        scheme = await get_auth_scheme(self.api_key)
+        return {
+            **AUTH_SCHEMES[scheme](self.api_key),
+            "Content-Type": "application/json"
+        }
+    
+    def _body(self, prompt: str, image_data, content_type: str, image_url: Optional[str] = None):
+        # Payload according to Qwen Image Edit Plus LoRA API specification, with the image
+        # given by URL or base64-encoded into a data URL while the request is being sent
+        fields = {"prompt": prompt, **self.params}
+        if image_url is not None:
+            return JSONBody({"image_urls": [image_url], **fields})
+        return ImageJSONBody(image_data, content_type, fields)
+    
+    def _parse_result(self, result: dict) -> FalAIResult:
+        """Turn a FalAI response body into a FalAIResult, raising if it holds no usable image"""
+        # Check if the response contains error information
+        if "error" in result:
+            logging.error(f"API returned error: {result['error']}")
+            raise FalAIRequestError(f"API error: {result['error']}")
+        
+        # Check if the response has the expected structure
+        if "images" not in result:
+            logging.error(f"Unexpected response structure. Missing 'images' key. Full response: {result}")
+            raise FalAIRequestError(f"Unexpected response structure: {result}")
+        
+        # Check if safety checker blocked the content
+        if "has_nsfw_concepts" in result and result["has_nsfw_concepts"]:
+            if any(result["has_nsfw_concepts"]):
+                logging.warning(f"Safety checker blocked content: {result['has_nsfw_concepts']}")
+                # Don't retry if safety checker blocked - it's unlikely to succeed on retry
+                raise SafetyCheckerError(f"Safety checker blocked content: {result['has_nsfw_concepts']}")
+        
+        # Extract URL from the images array
+        if result["images"] and len(result["images"]) > 0:
+            return FalAIResult(url=result["images"][0]["url"])
+        raise FalAIRequestError("No images returned from FalAI")
+    
+    @observed("process")
+    async def process(
+        self,
+        prompt: str,
+        image_data: Optional[bytes] = None,
+        max_retries: Optional[int] = None,
+        content_type: str = "image/jpeg",
+        image_url: Optional[str] = None,
+        timeline: Optional[JobTimeline] = None
+    ):
         """
         Process image directly with FalAI API using base64 encoded data
         This eliminates the need for local file storage and avoids Render's ephemeral storage issues
+        image_data may be any bytes-like object; content_type labels the data URL.
+        When image_url is given FalAI fetches the image from there instead.
+        The inference, retries and encoding are recorded on timeline, if given.
         """
-        # Try different authentication methods
-        headers = {
-            "Authorization": f"Key {self.api_key}",
-            "Content-Type": "application/json"
-        }
+        # Authentication scheme discovered once per API key, never by re-sending the payload
+        headers = await self._headers()
         
-        # Log the headers for debugging (without exposing the full API key)
-        logging.debug(f"Request headers: Authorization: Key {self.api_key[:10]}...")
+        body = self._body(prompt, image_data, content_type, image_url)
+        headers.update(body.headers())
         
-        # Encode the image data as base64
-        image_base64 = base64.b64encode(image_data).decode('utf-8')
-        image_url = f"data:image/jpeg;base64,{image_base64}"
+        client = await get_http_client()
+        attempts = []
         
-        # Prepare the payload according to Qwen Image Edit Plus LoRA API specification
-        payload = {
-            "image_urls": [image_url],
-            "prompt": prompt,
-            "num_inference_steps": 28,
-            "guidance_scale": 4,
-            "num_images": 1,
-            "enable_safety_checker": True,
-            "output_format": "png",
-            "negative_prompt": "",
-            "acceleration": "regular"
-        }
+        async def send() -> httpx.Response:
+            attempts.append(time.monotonic())
+            logging.info(f"Sending request to {self.url} ({body.content_length} bytes)")
+            resp = await client.post(self.url, headers=headers, content=body)
+            logging.info(f"Response status: {resp.status_code}")
+            logging.debug(f"Response headers: {resp.headers}")
+            return resp
+        
+        try:
+            resp = await self._send_with_retries(send, max_retries, "FalAI request")
+        finally:
+            self._record_attempts(timeline, INFERENCE, attempts, body)
+        
+        try:
+            result = resp.json()
+            logging.debug(f"Response JSON: {json.dumps(result, indent=2)}")
+        except json.JSONDecodeError as e:
+            logging.error(f"Failed to decode JSON response: {e}")
+            raise FalAIRequestError(f"Invalid JSON response: {resp.text}")
+        return self._parse_result(result)
+    
+    async def _send_with_retries(self, send, max_retries: Optional[int], description: str) -> httpx.Response:
+        """Run send() with the shared backoff policy, retry budget and circuit breaker"""
+        policy = retry_policy
+        if max_retries is not None:
+            policy = RetryPolicy(max_retries, FALAI_RETRY_BASE_DELAY, FALAI_RETRY_MAX_DELAY)
+        try:
+            return await call_with_retries(send, policy, retry_budget, circuit_breaker, description)
+        except NonRetryableError as e:
+            # Handle specific authentication errors
+            if e.status_code == 401:
+                logging.error("Authentication failed. Please check your FALAI_API_KEY.")
+                forget_auth_scheme(self.api_key)
+            elif e.status_code == 403:
+                logging.error("Access forbidden. The API key may not have permission to access this endpoint.")
+            raise
+    
+    def _record_attempts(self, timeline: Optional[JobTimeline], name: str, attempts: list, body):
+        """Record the last attempt as phase name, and earlier attempts with their backoff as retries"""
+        if timeline is None or not attempts:
+            return
+        if len(attempts) > 1:
+            timeline.record(RETRIES, attempts[0], attempts[-1])
+        timeline.record(name, attempts[-1])
+        if body.encode_seconds:
+            timeline.add(ENCODE, attempts[0], body.encode_seconds)
+    
+    def _check_auth(self, resp: httpx.Response):
+        if resp.status_code in (401, 403):
+            forget_auth_scheme(self.api_key)
+            raise FalAIRequestError(f"Authentication failed: {resp.text}", resp.status_code)
+    
+    @observed("submit")
+    async def submit(
+        self,
+        prompt: str,
+        image_data: Optional[bytes] = None,
+        max_retries: Optional[int] = None,
+        content_type: str = "image/jpeg",
+        image_url: Optional[str] = None,
+        timeline: Optional[JobTimeline] = None
+    ) -> str:
+        """
+        Submit a request to FalAI's queue and return its request ID without waiting
+        for the inference. Track it with status() and fetch it with result().
+        """
+        headers = await self._headers()
+        body = self._body(prompt, image_data, content_type, image_url)
+        headers.update(body.headers())
+        client = await get_http_client()
+        attempts = []
+        
+        async def send() -> httpx.Response:
+            attempts.append(time.monotonic())
+            logging.info(f"Submitting request to {self.queue_url} ({body.content_length} bytes)")
+            return await client.post(self.queue_url, headers=headers, content=body)
         
-        # Set timeout to 300 seconds (5 minutes) as requested
-        async with httpx.AsyncClient(timeout=300.0) as client:
-            for attempt in range(max_retries):
-                try:
-                    logging.info(f"Sending request to {self.url} (attempt {attempt + 1}/{max_retries})")
-                    logging.debug(f"Headers: {headers}")
-                    # Only log payload details on first attempt to avoid log spam
-                    if attempt == 0:
-                        logging.debug(f"Payload: {json.dumps(payload, indent=2)}")
-                    
-                    resp = await client.post(self.url, headers=headers, json=payload)
-                    
-                    # If authentication fails, try alternative authentication methods
-                    if resp.status_code == 401 and attempt == 0:
-                        logging.warning("Authentication failed with 'Key' format, trying alternative methods...")
-                        
-                        # Try with Bearer format
-                        alt_headers = {
-                            "Authorization": f"Bearer {self.api_key}",
-                            "Content-Type": "application/json"
-                        }
-                        logging.info("Trying Bearer authentication...")
-                        resp = await client.post(self.url, headers=alt_headers, json=payload)
-                        
-                        if resp.status_code == 401:
-                            # Try with X-API-Key header
-                            alt_headers = {
-                                "X-API-Key": self.api_key,
-                                "Content-Type": "application/json"
-                            }
-                            logging.info("Trying X-API-Key authentication...")
-                            resp = await client.post(self.url, headers=alt_headers, json=payload)
-                    logging.info(f"Response status: {resp.status_code}")
-                    logging.debug(f"Response headers: {resp.headers}")
-                    
-                    # Check if the response is successful
-                    if resp.status_code != 200:
-                        logging.warning(f"Non-success status code: {resp.status_code}")
-                        logging.debug(f"Response content: {resp.text}")
-                        
-                        # Handle specific authentication errors
-                        if resp.status_code == 401:
-                            logging.error("Authentication failed. Please check your FALAI_API_KEY.")
-                            if "Authentication is required" in resp.text:
-                                logging.error("The API key may be invalid or the authentication format may be incorrect.")
-                            raise Exception(f"Authentication failed: {resp.text}")
-                        elif resp.status_code == 403:
-                            logging.error("Access forbidden. The API key may not have permission to access this endpoint.")
-                            raise Exception(f"Access forbidden: {resp.text}")
-                        
-                        if attempt < max_retries - 1:
-                            logging.info(f"Retrying in 2 seconds...")
-                            await asyncio.sleep(2)
-                            continue
-                        resp.raise_for_status()
-                    
-                    try:
-                        result = resp.json()
-                        logging.debug(f"Response JSON: {json.dumps(result, indent=2)}")
-                    except json.JSONDecodeError as e:
-                        logging.error(f"Failed to decode JSON response: {e}")
-                        logging.debug(f"Response content: {resp.text}")
-                        if attempt < max_retries - 1:
-                            logging.info(f"Retrying in 2 seconds...")
-                            await asyncio.sleep(2)
-                            continue
-                        raise Exception(f"Invalid JSON response: {resp.text}")
-                    
-                    # Check if the response contains error information
-                    if "error" in result:
-                        logging.error(f"API returned error: {result['error']}")
-                        if attempt < max_retries - 1:
-                            logging.info(f"Retrying in 2 seconds...")
-                            await asyncio.sleep(2)
-                            continue
-                        raise Exception(f"API error: {result['error']}")
-                    
-                    # Check if the response has the expected structure
-                    if "images" not in result:
-                        logging.error(f"Unexpected response structure. Missing 'images' key. Full response: {result}")
-                        if attempt < max_retries - 1:
-                            logging.info(f"Retrying in 2 seconds...")
-                            await asyncio.sleep(2)
-                            continue
-                        raise Exception(f"Unexpected response structure: {result}")
-                    
-                    # Check if safety checker blocked the content
-                    if "has_nsfw_concepts" in result and result["has_nsfw_concepts"]:
-                        if any(result["has_nsfw_concepts"]):
-                            logging.warning(f"Safety checker blocked content: {result['has_nsfw_concepts']}")
-                            # Don't retry if safety checker blocked - it's unlikely to succeed on retry
-                            raise Exception(f"Safety checker blocked content: {result['has_nsfw_concepts']}")
-                    
-                    # Extract URL from the images array
-                    if result["images"] and len(result["images"]) > 0:
-                        image_url = result["images"][0]["url"]
-                        return FalAIResult(url=image_url)
-                    else:
-                        raise Exception("No images returned from FalAI")
-                    
-                except httpx.TimeoutException as e:
-                    logging.error(f"Timeout error occurred: {e}")
-                    if attempt < max_retries - 1:
-                        logging.info(f"Retrying in 2 seconds...")
-                        await asyncio.sleep(2)
-                        continue
-                    raise Exception(f"Timeout after {max_retries} attempts: {e}")
-                    
-                except httpx.HTTPStatusError as e:
-                    logging.error(f"HTTP error occurred: {e}")
-                    logging.debug(f"Response content: {e.response.text}")
-                    if attempt < max_retries - 1:
-                        logging.info(f"Retrying in 2 seconds...")
-                        await asyncio.sleep(2)
-                        continue
-                    raise
-                    
-                except Exception as e:
-                    logging.error(f"An error occurred: {e}")
-                    if attempt < max_retries - 1:
-                        logging.info(f"Retrying in 2 seconds...")
-                        await asyncio.sleep(2)
-                        continue
-                    raise
-            
-            # If we get here, all retries have been exhausted
-            raise Exception(f"Failed after {max_retries} attempts")
+        try:
+            resp = await self._send_with_retries(send, max_retries, "FalAI queue submission")
+        finally:
+            self._record_attempts(timeline, SUBMIT, attempts, body)
+        try:
+            request_id = resp.json()["request_id"]
+        except (json.JSONDecodeError, KeyError):
+            raise FalAIRequestError(f"Unexpected queue submission response: {resp.text}")
+        logging.info(f"FalAI request queued: {request_id}")
+        return request_id
+    
+    @observed("status")
+    async def status(self, request_id: str) -> str:
+        """Queue status of a submitted request: IN_QUEUE, IN_PROGRESS or COMPLETED"""
+        client = await get_http_client()
+        resp = await client.get(f"{self.queue_url}/requests/{request_id}/status", headers=await self._headers())
+        self._check_auth(resp)
+        if resp.status_code == 404:
+            raise FalAIRequestNotFound(f"FalAI doesn't know request {request_id}")
+        resp.raise_for_status()
+        return resp.json()["status"]
+    
+    @observed("result")
+    async def result(self, request_id: str) -> FalAIResult:
+        """Fetch the result of a completed request. Raises if the request failed upstream."""
+        client = await get_http_client()
+        resp = await client.get(f"{self.queue_url}/requests/{request_id}", headers=await self._headers())
+        self._check_auth(resp)
+        if resp.status_code in RETRYABLE_STATUS_CODES:
+            # Transient trouble fetching the result; the poller tries again
+            resp.raise_for_status()
+        if resp.status_code != 200:
+            raise FalAIRequestError(f"FalAI request {request_id} failed with {resp.status_code}: {resp.text}")
+        return self._parse_result(resp.json())
 
 # Also keep the original function for backward compatibility
 async def edit_image_with_falai(image_data: bytes, prompt: str, max_retries=3):
@@ -0,0 +1,148 @@
+import os
+import time
+import asyncio
+import logging
+import httpx
+from typing import Awaitable, Callable, Optional
+from dotenv import load_dotenv
+
+from app.falai_client import FalAIResult, QUEUE_COMPLETED
+from app.resilience import RetryableError
+
+load_dotenv()
+
+# Seconds between status checks of the requests each loop tracks
+FALAI_POLL_INTERVAL = float(os.getenv("FALAI_POLL_INTERVAL", "1.0"))
+# Number of background loops sharing the tracked requests
+FALAI_POLL_LOOPS = int(os.getenv("FALAI_POLL_LOOPS", "2"))
+# Status requests a single loop keeps in flight at once
+FALAI_POLL_CONCURRENCY = int(os.getenv("FALAI_POLL_CONCURRENCY", "10"))
+# Seconds after which a request that hasn't completed is given up on
+FALAI_QUEUE_TIMEOUT = float(os.getenv("FALAI_QUEUE_TIMEOUT", "900"))
+
+# Called once per request with either the result or the error it ended with
+DoneCallback = Callable[[Optional[FalAIResult], Optional[Exception]], Awaitable[None]]
+
+
+class FalAIQueueTimeout(RetryableError):
+    """Raised for a queued request that didn't complete within FALAI_QUEUE_TIMEOUT"""
+    pass
+
+
+class TrackedRequest:
+    def __init__(self, request_id: str, job_id: str, on_done: DoneCallback):
+        self.request_id = request_id
+        self.job_id = job_id
+        self.on_done = on_done
+        self.tracked_at = time.monotonic()
+        self.status = None
+
+
+class FalAIQueuePoller:
+    """
+    Tracks submitted FalAI queue requests from a few shared background loops.
+    Each loop checks the status of its requests every poll interval, fetches
+    the result of the ones that completed and hands it to their callback, so
+    an in-flight inference costs a dict entry instead of a worker and a socket.
+    """
+
+    def __init__(
+        self,
+        get_client: Callable,
+        loops: int = FALAI_POLL_LOOPS,
+        interval: float = FALAI_POLL_INTERVAL,
+        concurrency: int = FALAI_POLL_CONCURRENCY,
+        timeout: float = FALAI_QUEUE_TIMEOUT
+    ):
+        self.get_client = get_client
+        self.interval = interval
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        # One dict of request_id -> TrackedRequest per loop
+        self._shards = [{} for _ in range(max(1, loops))]
+        self._tasks = []
+        self.polls = 0
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.errors = 0
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._run(shard)) for shard in self._shards]
+        logging.info(f"FalAI queue poller started ({len(self._shards)} loops, every {self.interval}s)")
+
+    async def stop(self):
+        """Stop polling. Requests still tracked stay recorded on their jobs and can be resumed."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def track(self, request_id: str, job_id: str, on_done: DoneCallback):
+        shard = min(self._shards, key=len)
+        shard[request_id] = TrackedRequest(request_id, job_id, on_done)
+
+    def tracked(self) -> int:
+        return sum(len(shard) for shard in self._shards)
+
+    async def _run(self, shard: dict):
+        while True:
+            await asyncio.sleep(self.interval)
+            if not shard:
+                continue
+            try:
+                client = self.get_client()
+            except Exception as e:
+                logging.error(f"FalAI queue poller has no client, {len(shard)} requests waiting: {e}")
+                continue
+            semaphore = asyncio.Semaphore(self.concurrency)
+            await asyncio.gather(*(self._poll(client, shard, tracked, semaphore) for tracked in list(shard.values())))
+
+    async def _poll(self, client, shard: dict, tracked: TrackedRequest, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            if time.monotonic() - tracked.tracked_at > self.timeout:
+                self.timed_out += 1
+                await self._finish(shard, tracked, None, FalAIQueueTimeout(
+                    f"FalAI request {tracked.request_id} not completed after {self.timeout:.0f}s"
+                ))
+                return
+            self.polls += 1
+            try:
+                tracked.status = await client.status(tracked.request_id)
+                if tracked.status != QUEUE_COMPLETED:
+                    return
+                result = await client.result(tracked.request_id)
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                # Network trouble or a failing status endpoint; the request itself may be fine
+                self.errors += 1
+                logging.warning(f"Polling FalAI request {tracked.request_id} for job {tracked.job_id} failed: {e}")
+                return
+            except Exception as e:
+                self.failed += 1
+                await self._finish(shard, tracked, None, e)
+                return
+            self.completed += 1
+            await self._finish(shard, tracked, result, None)
+
+    async def _finish(self, shard: dict, tracked: TrackedRequest, result: Optional[FalAIResult], error: Optional[Exception]):
+        shard.pop(tracked.request_id, None)
+        try:
+            await tracked.on_done(result, error)
+        except Exception as e:
+            logging.error(f"Completing job {tracked.job_id} from FalAI request {tracked.request_id} failed: {e}", exc_info=True)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        ages = [now - tracked.tracked_at for shard in self._shards for tracked in shard.values()]
+        return {
+            "loops": len(self._shards),
+            "tracked": len(ages),
+            "oldest_seconds": round(max(ages), 1) if ages else 0.0,
+            "polls": self.polls,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timed_out": self.timed_out,
+            "errors": self.errors,
+        }
@@ -0,0 +1,173 @@
+import io
+import os
+import asyncio
+import logging
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Optional
+from dotenv import load_dotenv
+from PIL import Image, ImageOps
+
+load_dotenv()
+
+# Normalize uploads before sending them to FalAI
+IMAGE_NORMALIZE_ENABLED = os.getenv("IMAGE_NORMALIZE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Longest side, in pixels, of the image sent to FalAI
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", "2048"))
+# Re-encoding format: "jpeg" or "webp"
+IMAGE_OUTPUT_FORMAT = os.getenv("IMAGE_OUTPUT_FORMAT", "jpeg").lower()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+# Where normalization runs: "thread" or "process" pool, and how many workers it has
+IMAGE_EXECUTOR = os.getenv("IMAGE_EXECUTOR", "thread").lower()
+IMAGE_EXECUTOR_WORKERS = int(os.getenv("IMAGE_EXECUTOR_WORKERS", "2"))
+
+OUTPUT_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+}
+
+# Source formats that may be forwarded unchanged
+PASSTHROUGH_FORMATS = ("JPEG", "PNG", "WEBP")
+
+_executor: Optional[Executor] = None
+_stats = {
+    "normalized": 0,
+    "passthrough": 0,
+    "errors": 0,
+    "bytes_in": 0,
+    "bytes_out": 0,
+}
+
+
+class NormalizedImage:
+    def __init__(self, data, mime_type: str, original_size: int, width: int = None, height: int = None):
+        self.data = data
+        self.mime_type = mime_type
+        self.size = len(data)
+        self.original_size = original_size
+        self.width = width
+        self.height = height
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_size - self.size
+
+
+def normalize_image_bytes(data, max_dimension: int, output_format: str, quality: int):
+    """
+    Apply the EXIF orientation, downscale to max_dimension, drop metadata and
+    re-encode. Runs in an executor, so it only takes and returns picklable values.
+    Returns (encoded bytes or None to keep the original, mime type, width, height).
+    """
+    pil_format, mime_type = OUTPUT_FORMATS[output_format]
+
+    with Image.open(io.BytesIO(data)) as img:
+        source_format = img.format
+        has_exif = bool(img.info.get("exif")) or bool(img.getexif())
+        # Let the JPEG decoder downscale while decoding when the image is much larger than needed
+        img.draft("RGB", (max_dimension, max_dimension))
+        transposed = ImageOps.exif_transpose(img)
+        needs_resize = max(transposed.size) > max_dimension
+        if needs_resize:
+            transposed.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+
+        if transposed.mode not in ("RGB", "L"):
+            if pil_format == "WEBP" and transposed.mode in ("RGBA", "LA", "P"):
+                transposed = transposed.convert("RGBA")
+            else:
+                # JPEG has no alpha channel; flatten transparent images onto white
+                rgba = transposed.convert("RGBA")
+                flattened = Image.new("RGB", rgba.size, (255, 255, 255))
+                flattened.paste(rgba, mask=rgba.getchannel("A"))
+                transposed = flattened
+
+        out = io.BytesIO()
+        # Only the colour profile is carried over; EXIF, XMP and other metadata are dropped
+        save_args = {"quality": quality, "optimize": True}
+        icc_profile = img.info.get("icc_profile")
+        if icc_profile:
+            save_args["icc_profile"] = icc_profile
+        transposed.save(out, format=pil_format, **save_args)
+        width, height = transposed.size
+
+    encoded = out.getvalue()
+    # A metadata-free image in a format FalAI accepts that didn't need resizing
+    # is sent as is when re-encoding would only make it bigger
+    if not needs_resize and not has_exif and source_format in PASSTHROUGH_FORMATS and len(encoded) >= len(data):
+        return None, Image.MIME[source_format], width, height
+    return encoded, mime_type, width, height
+
+
+def start_image_executor():
+    """Create the executor used for normalization. Called from the FastAPI startup hook."""
+    global _executor
+    if _executor is not None or not IMAGE_NORMALIZE_ENABLED:
+        return
+    if IMAGE_OUTPUT_FORMAT not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported IMAGE_OUTPUT_FORMAT: {IMAGE_OUTPUT_FORMAT}")
+    if IMAGE_EXECUTOR == "process":
+        _executor = ProcessPoolExecutor(max_workers=IMAGE_EXECUTOR_WORKERS)
+    else:
+        _executor = ThreadPoolExecutor(max_workers=IMAGE_EXECUTOR_WORKERS, thread_name_prefix="image-normalize")
+    logging.info(
+        f"Image normalization enabled ({IMAGE_OUTPUT_FORMAT}, quality {IMAGE_QUALITY}, "
+        f"max {IMAGE_MAX_DIMENSION}px, {IMAGE_EXECUTOR_WORKERS} {IMAGE_EXECUTOR} workers)"
+    )
+
+
+def shutdown_image_executor():
+    """Shut down the normalization executor. Called from the FastAPI shutdown hook."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def normalize_image(data, mime_type: str) -> NormalizedImage:
+    """
+    Normalize an image off the event loop. Falls back to the original bytes
+    (with their sniffed MIME type) when normalization is disabled or the image
+    can't be decoded, e.g. HEIC without a decoder plugin.
+    """
+    original_size = len(data)
+    if not IMAGE_NORMALIZE_ENABLED:
+        return NormalizedImage(data, mime_type, original_size)
+
+    if _executor is None:
+        start_image_executor()
+
+    # Process pools need a picklable copy; threads can read the shared buffer directly
+    payload = bytes(data) if isinstance(_executor, ProcessPoolExecutor) else data
+    loop = asyncio.get_running_loop()
+    try:
+        encoded, out_mime_type, width, height = await loop.run_in_executor(
+            _executor, normalize_image_bytes, payload, IMAGE_MAX_DIMENSION, IMAGE_OUTPUT_FORMAT, IMAGE_QUALITY
+        )
+    except Exception as e:
+        _stats["errors"] += 1
+        logging.warning(f"Image normalization failed, sending the original image: {e}")
+        return NormalizedImage(data, mime_type, original_size)
+
+    _stats["bytes_in"] += original_size
+    if encoded is None:
+        _stats["passthrough"] += 1
+        _stats["bytes_out"] += original_size
+        return NormalizedImage(data, out_mime_type, original_size, width, height)
+
+    _stats["normalized"] += 1
+    _stats["bytes_out"] += len(encoded)
+    return NormalizedImage(encoded, out_mime_type, original_size, width, height)
+
+
+def normalization_settings() -> Optional[dict]:
+    """The settings that decide what normalization makes of an upload, None when it is disabled"""
+    if not IMAGE_NORMALIZE_ENABLED:
+        return None
+    return {"max_dimension": IMAGE_MAX_DIMENSION, "format": IMAGE_OUTPUT_FORMAT, "quality": IMAGE_QUALITY}
+
+
+def image_processing_stats() -> dict:
+    return {
+        "enabled": IMAGE_NORMALIZE_ENABLED,
+        **_stats,
+        "bytes_saved": _stats["bytes_in"] - _stats["bytes_out"],
+    }
@@ -0,0 +1,221 @@
+import os
+import mmap
+import hashlib
+import logging
+import tempfile
+from typing import Optional
+from fastapi import UploadFile
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Largest image accepted, in bytes
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+# Uploads larger than this are spooled to a temporary file and memory mapped instead of kept on the heap
+INGEST_SPOOL_THRESHOLD = int(os.getenv("INGEST_SPOOL_THRESHOLD", str(2 * 1024 * 1024)))
+# Size of the chunks read from the multipart upload
+INGEST_CHUNK_SIZE = 64 * 1024
+# Allowance for the prompt field and multipart boundaries on top of the image itself
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+class UploadTooLargeError(Exception):
+    pass
+
+
+class UnsupportedImageError(Exception):
+    pass
+
+
+def sniff_image_type(header: bytes) -> Optional[str]:
+    """Detect the image MIME type from its magic bytes"""
+    if header.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if header[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    if header[4:8] == b"ftyp" and header[8:12] in (b"heic", b"heix", b"hevc", b"heim", b"heis", b"mif1", b"msf1"):
+        return "image/heic"
+    if header[4:8] == b"ftyp" and header[8:12] in (b"avif", b"avis"):
+        return "image/avif"
+    if header.startswith(b"BM"):
+        return "image/bmp"
+    return None
+
+
+class IngestedImage:
+    """
+    Immutable handle to an uploaded image. Small images live in memory, large
+    ones in a memory-mapped temporary file; either way 'data' is a read-only
+    memoryview over the single copy of the bytes.
+    """
+
+    def __init__(self, data: memoryview, digest: str, mime_type: str, spool_file=None, mapping=None):
+        self.data = data
+        self.digest = digest
+        self.mime_type = mime_type
+        self.size = len(data)
+        self.spooled = spool_file is not None
+        self._spool_file = spool_file
+        self._mapping = mapping
+        # Memory budget reservation covering this image, released on close
+        self.reservation = None
+
+    def close(self):
+        """Release the buffer. Safe to call more than once."""
+        if self.reservation is not None:
+            self.reservation.release()
+            self.reservation = None
+        if self.data is None:
+            return
+        try:
+            self.data.release()
+            if self._mapping is not None:
+                self._mapping.close()
+        except BufferError:
+            # Someone still holds a view of the buffer; it is freed when they let go of it
+            logging.warning("Image buffer still in use at close; leaving it to the garbage collector")
+        if self._spool_file is not None:
+            self._spool_file.close()
+        self.data = None
+        self._mapping = None
+        self._spool_file = None
+
+
+async def ingest_upload(upload: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> IngestedImage:
+    """
+    Read an upload in chunks, enforcing the size limit, hashing and sniffing
+    the image type as the bytes arrive. Uploads over INGEST_SPOOL_THRESHOLD
+    are spooled to a temporary file and memory mapped.
+    """
+    hasher = hashlib.sha256()
+    buffer = bytearray()
+    spool_file = None
+    mime_type = None
+    size = 0
+
+    try:
+        while True:
+            chunk = await upload.read(INGEST_CHUNK_SIZE)
+            if not chunk:
+                break
+
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLargeError(f"Image exceeds the maximum size of {max_bytes} bytes")
+
+            if mime_type is None:
+                # The magic bytes of every supported format fit in the first chunk
+                mime_type = sniff_image_type(chunk[:16])
+                if mime_type is None:
+                    raise UnsupportedImageError("Uploaded file is not a supported image")
+
+            hasher.update(chunk)
+            if spool_file is not None:
+                spool_file.write(chunk)
+            elif size > INGEST_SPOOL_THRESHOLD:
+                spool_file = tempfile.TemporaryFile(prefix="haybi-upload-")
+                spool_file.write(buffer)
+                spool_file.write(chunk)
+                buffer = bytearray()
+            else:
+                buffer += chunk
+
+        if size == 0:
+            raise UnsupportedImageError("Uploaded file is empty")
+
+        if spool_file is not None:
+            spool_file.flush()
+            mapping = mmap.mmap(spool_file.fileno(), 0, access=mmap.ACCESS_READ)
+            logging.info(f"Upload spooled to disk ({size} bytes)")
+            return IngestedImage(memoryview(mapping), hasher.hexdigest(), mime_type, spool_file, mapping)
+
+        return IngestedImage(memoryview(buffer).toreadonly(), hasher.hexdigest(), mime_type)
+
+    except Exception:
+        if spool_file is not None:
+            spool_file.close()
+        raise
+
+
+def open_stored_image(path: str, digest: str, mime_type: str) -> IngestedImage:
+    """Memory map an image kept on disk, e.g. an upload stored for recovery after a restart"""
+    stored_file = open(path, "rb")
+    try:
+        mapping = mmap.mmap(stored_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except Exception:
+        stored_file.close()
+        raise
+    return IngestedImage(memoryview(mapping), digest, mime_type, stored_file, mapping)
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Rejects oversized uploads with 413 before they are buffered. Requests that
+    declare a Content-Length over the limit are refused without reading the
+    body; chunked requests are cut off as soon as the limit is crossed.
+    """
+
+    def __init__(self, app, paths, max_bytes: int = MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES):
+        self.app = app
+        self.paths = set(paths)
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_bytes:
+            logging.warning(f"Rejecting upload to {scope['path']}: Content-Length {int(content_length)} exceeds {self.max_bytes}")
+            await self._send_413(send)
+            return
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    exceeded = True
+                    raise UploadTooLargeError("Request body too large")
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            # Whatever the app made of the aborted body, the client gets a 413
+            if exceeded:
+                if message["type"] == "http.response.start" and not response_started:
+                    response_started = True
+                    await self._send_413(send)
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except UploadTooLargeError:
+            if not response_started:
+                await self._send_413(send)
+
+    async def _send_413(self, send):
+        body = b'{"detail":"Uploaded image is too large"}'
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,92 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+from dotenv import load_dotenv
+
+from app.events import TERMINAL_STATUSES
+
+load_dotenv()
+
+# Maximum number of job rows kept in memory
+JOB_CACHE_MAX_ENTRIES = int(os.getenv("JOB_CACHE_MAX_ENTRIES", "5000"))
+# Seconds a cached row stays valid while the job is pending/processing
+JOB_CACHE_ACTIVE_TTL = float(os.getenv("JOB_CACHE_ACTIVE_TTL", "60"))
+# Seconds a cached row stays valid once the job completed or failed
+JOB_CACHE_TERMINAL_TTL = float(os.getenv("JOB_CACHE_TERMINAL_TTL", "3600"))
+
+
+class JobCache:
+    """
+    Bounded LRU cache of job rows, kept up to date write-through by the db
+    module. Entries expire after a TTL that depends on the job's status.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = JOB_CACHE_MAX_ENTRIES,
+        active_ttl: float = JOB_CACHE_ACTIVE_TTL,
+        terminal_ttl: float = JOB_CACHE_TERMINAL_TTL
+    ):
+        self.max_entries = max(1, max_entries)
+        self.active_ttl = active_ttl
+        self.terminal_ttl = terminal_ttl
+        # job_id -> (row, expires_at)
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _ttl(self, row: dict) -> float:
+        return self.terminal_ttl if row.get("status") in TERMINAL_STATUSES else self.active_ttl
+
+    def get(self, job_id: str) -> Optional[dict]:
+        entry = self._entries.get(job_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        row, expires_at = entry
+        if time.monotonic() > expires_at:
+            del self._entries[job_id]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(job_id)
+        self.hits += 1
+        return dict(row)
+
+    def put(self, job_id: str, row: dict):
+        self._entries[job_id] = (dict(row), time.monotonic() + self._ttl(row))
+        self._entries.move_to_end(job_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def update(self, job_id: str, fields: dict):
+        """Apply a write to the cached row, if the job is cached"""
+        entry = self._entries.get(job_id)
+        if entry is None:
+            return
+        row = dict(entry[0])
+        row.update(fields)
+        self.put(job_id, row)
+
+    def invalidate(self, job_id: str):
+        self._entries.pop(job_id, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+# Shared cache used by get_job, create_job and update_job_status
+job_cache = JobCache()
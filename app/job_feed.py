@@ -0,0 +1,110 @@
+import os
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+
+from app.db import get_jobs_updated_since, to_db_timestamp, parse_timestamp, status_writes
+from app.events import job_events, job_event
+from app.job_cache import job_cache
+
+load_dotenv()
+
+# Seconds between reads of recently updated jobs
+JOB_FEED_INTERVAL = float(os.getenv("JOB_FEED_INTERVAL", "1.0"))
+# Seconds each read reaches back before the newest update already seen. Covers
+# the one-second resolution of updated_at and clock skew between machines.
+JOB_FEED_OVERLAP_SECONDS = float(os.getenv("JOB_FEED_OVERLAP_SECONDS", "5"))
+# Most rows read per query
+JOB_FEED_BATCH_SIZE = 1000
+
+# Number of jobs whose last seen state is remembered to skip repeated rows
+SEEN_MAX_ENTRIES = 10000
+
+
+class JobChangeFeed:
+    """
+    Follows job updates made by other processes, i.e. external workers, by
+    reading rows whose updated_at moved since the last poll. Changes are
+    applied to the job cache and published on the job event bus, so SSE,
+    WebSocket and long-poll watchers in the API process see them.
+    """
+
+    def __init__(self, interval: float = JOB_FEED_INTERVAL, overlap: float = JOB_FEED_OVERLAP_SECONDS):
+        self.interval = interval
+        self.overlap = timedelta(seconds=overlap)
+        self._watermark = None
+        # job_id -> (status, result_url, updated_at) last applied
+        self._seen = OrderedDict()
+        self._task = None
+        self.polls = 0
+        self.changes = 0
+        self.errors = 0
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._watermark = datetime.now(timezone.utc)
+        self._task = asyncio.create_task(self._run())
+        logging.info(f"Job change feed started (every {self.interval}s)")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.poll()
+            except Exception as e:
+                self.errors += 1
+                logging.error(f"Reading job updates failed: {e}")
+
+    async def poll(self):
+        self.polls += 1
+        since, after_id = to_db_timestamp(self._watermark - self.overlap), None
+        while True:
+            rows = await get_jobs_updated_since(since, JOB_FEED_BATCH_SIZE, after_id)
+            self._apply(rows)
+            if len(rows) < JOB_FEED_BATCH_SIZE:
+                return
+            # A burst of updates: page on from the last row, by (updated_at, id) so
+            # rows sharing one updated_at beyond a batch aren't skipped
+            since, after_id = rows[-1]["updated_at"], rows[-1]["id"]
+
+    def _apply(self, rows):
+        for row in rows:
+            job = dict(row)
+            if status_writes.pending(job["id"]) is not None:
+                # This process has a newer status for the job that isn't committed yet
+                continue
+            state = (job["status"], job["result_url"], job["updated_at"])
+            previous = self._seen.get(job["id"])
+            if previous == state:
+                continue
+            self._seen[job["id"]] = state
+            self._seen.move_to_end(job["id"])
+            while len(self._seen) > SEEN_MAX_ENTRIES:
+                self._seen.popitem(last=False)
+            job_cache.update(job["id"], job)
+            if previous is None or previous[:2] != state[:2]:
+                self.changes += 1
+                job_events.publish(job["id"], job_event(job))
+            self._watermark = max(self._watermark, parse_timestamp(job["updated_at"]))
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None,
+            "polls": self.polls,
+            "changes": self.changes,
+            "errors": self.errors,
+        }
+
+
+# Feed used by the API process when jobs run on external workers (JOB_DISPATCH=external)
+job_feed = JobChangeFeed()
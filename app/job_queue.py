@@ -0,0 +1,310 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Callable, Dict, Optional
+from dotenv import load_dotenv
+from app.metrics import Histogram, SLOW_BUCKETS
+from app.stats import percentile
+
+load_dotenv()
+
+
+def parse_mapping(value: str, cast=float) -> Dict[str, float]:
+    """Parse "name:value,name:value" settings, e.g. per-tenant weights"""
+    mapping = {}
+    for entry in value.split(","):
+        name, sep, number = entry.strip().rpartition(":")
+        if sep and name:
+            mapping[name.strip()] = cast(number)
+    return mapping
+
+
+# Number of worker coroutines pulling jobs off the queue. Size this to the
+# number of concurrent FalAI requests our quota allows.
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# Maximum number of jobs waiting for a worker before new submissions are rejected
+JOB_QUEUE_MAX_SIZE = int(os.getenv("JOB_QUEUE_MAX_SIZE", "100"))
+# Seconds clients are told to wait (Retry-After) when the queue is full
+JOB_QUEUE_RETRY_AFTER = int(os.getenv("JOB_QUEUE_RETRY_AFTER", "30"))
+
+# Priority classes. Interactive edits get most of the workers; batch jobs keep a share so they still progress.
+INTERACTIVE = "interactive"
+BATCH = "batch"
+JOB_PRIORITIES = (INTERACTIVE, BATCH)
+JOB_PRIORITY_WEIGHTS = {INTERACTIVE: 4.0, BATCH: 1.0, **parse_mapping(os.getenv("JOB_PRIORITY_WEIGHTS", ""))}
+# Share of workers each tenant gets relative to others within a priority class, "tenant:weight,..." (default 1)
+JOB_TENANT_WEIGHTS = parse_mapping(os.getenv("JOB_TENANT_WEIGHTS", ""))
+# Jobs a single tenant may have running at once (0 = no limit), and per-tenant overrides as "tenant:limit,..."
+JOB_TENANT_MAX_CONCURRENCY = int(os.getenv("JOB_TENANT_MAX_CONCURRENCY", "0"))
+JOB_TENANT_CONCURRENCY = parse_mapping(os.getenv("JOB_TENANT_CONCURRENCY", ""), int)
+
+# Tenant of jobs submitted without an identity
+ANONYMOUS_TENANT = "anonymous"
+
+# Number of recent jobs used to compute wait/processing time statistics
+STATS_WINDOW = 500
+
+job_wait_seconds = Histogram(
+    "job_queue_wait_seconds", "Time jobs wait in the queue for a worker, by priority", ("priority",), buckets=SLOW_BUCKETS
+)
+job_run_seconds = Histogram(
+    "job_worker_seconds", "Time a worker spends on a job, by priority", ("priority",), buckets=SLOW_BUCKETS
+)
+
+
+class QueueFullError(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__("Job queue is full")
+        self.retry_after = retry_after
+
+
+class QueuedJob:
+    def __init__(self, job_id: str, args: tuple, tenant: str, priority: str):
+        self.job_id = job_id
+        self.args = args
+        self.tenant = tenant
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+
+
+class FairQueue:
+    """
+    Weighted fair queuing of unit-cost items across flows (start-time fair
+    queuing). Each flow carries a virtual time tag that advances by 1/weight
+    per item served, and the flow with the lowest tag goes next, so backlogged
+    flows are served in proportion to their weights however many items each
+    has queued. A flow that was idle restarts at the current virtual time
+    instead of catching up.
+    """
+
+    def __init__(self, weight_of: Callable[[str], float]):
+        self.weight_of = weight_of
+        # flow key -> [tag, deque of items]; only flows with queued items are kept
+        self._flows = {}
+        self._vtime = 0.0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def push(self, key: str, item):
+        flow = self._flows.get(key)
+        if flow is None:
+            flow = self._flows[key] = [self._vtime, deque()]
+        flow[1].append(item)
+        self._size += 1
+
+    def candidates(self):
+        """Flow keys with queued items, in the order they should be served"""
+        return [key for key, _ in sorted(self._flows.items(), key=lambda entry: entry[1][0])]
+
+    def pop(self, key: str):
+        flow = self._flows[key]
+        item = flow[1].popleft()
+        self._size -= 1
+        self._vtime = flow[0]
+        flow[0] += 1.0 / max(self.weight_of(key), 0.001)
+        if not flow[1]:
+            del self._flows[key]
+        return item
+
+    def depths(self) -> Dict[str, int]:
+        return {key: len(flow[1]) for key, flow in self._flows.items()}
+
+
+class JobQueue:
+    """
+    Bounded job queue served by a fixed number of worker coroutines.
+    The handler is called as handler(job_id, *args) for every submitted job.
+    Jobs are picked by priority class first and then fairly across tenants
+    within the class, skipping tenants at their concurrency limit, so one
+    tenant's large batch can't hold up everyone else's edits.
+    """
+
+    def __init__(
+        self,
+        handler,
+        workers: int = JOB_WORKERS,
+        max_size: int = JOB_QUEUE_MAX_SIZE,
+        priority_weights: Dict[str, float] = JOB_PRIORITY_WEIGHTS,
+        tenant_weights: Dict[str, float] = JOB_TENANT_WEIGHTS,
+        tenant_max_concurrency: int = JOB_TENANT_MAX_CONCURRENCY,
+        tenant_concurrency: Dict[str, int] = JOB_TENANT_CONCURRENCY
+    ):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_size = max(1, max_size)
+        self.tenant_weights = tenant_weights
+        self.tenant_max_concurrency = tenant_max_concurrency
+        self.tenant_concurrency = tenant_concurrency
+        self.priority_weights = priority_weights
+        self._priorities = FairQueue(self._priority_weight)
+        self._tenants = {priority: FairQueue(self._tenant_weight) for priority in JOB_PRIORITIES}
+        self._running = {}
+        # Set when a job may have become runnable, and when room was made in the queue
+        self._runnable = None
+        self._room = None
+        self._tasks = []
+        self._busy = 0
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._throttled = 0
+        self._wait_times = {priority: deque(maxlen=STATS_WINDOW) for priority in JOB_PRIORITIES}
+        self._run_times = deque(maxlen=STATS_WINDOW)
+
+    def _priority_weight(self, priority: str) -> float:
+        return self.priority_weights.get(priority, 1.0)
+
+    def _tenant_weight(self, tenant: str) -> float:
+        return self.tenant_weights.get(tenant, 1.0)
+
+    def tenant_limit(self, tenant: str) -> int:
+        """Jobs tenant may have running at once, 0 for no limit"""
+        return self.tenant_concurrency.get(tenant, self.tenant_max_concurrency)
+
+    def _may_run(self, tenant: str) -> bool:
+        limit = self.tenant_limit(tenant)
+        return not limit or self._running.get(tenant, 0) < limit
+
+    async def start(self):
+        """Start the worker coroutines"""
+        if self._tasks:
+            return
+        self._priorities = FairQueue(self._priority_weight)
+        self._tenants = {priority: FairQueue(self._tenant_weight) for priority in JOB_PRIORITIES}
+        self._running = {}
+        self._runnable = asyncio.Event()
+        self._room = asyncio.Event()
+        self._tasks = [
+            asyncio.create_task(self._worker(i), name=f"job-worker-{i}")
+            for i in range(self.workers)
+        ]
+        logging.info(f"Job queue started with {self.workers} workers (max queue size {self.max_size})")
+
+    async def stop(self):
+        """Stop the workers. Jobs still waiting in the queue stay 'pending' in the database."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if len(self._priorities):
+            logging.warning(f"Job queue stopped with {len(self._priorities)} jobs still waiting")
+
+    def full(self) -> bool:
+        return len(self._priorities) >= self.max_size
+
+    def free_slots(self) -> int:
+        """Workers that would pick up a job right away, i.e. idle workers minus jobs already waiting"""
+        return max(0, self.workers - self._busy - len(self._priorities))
+
+    def _enqueue(self, job_id: str, args: tuple, tenant: str, priority: str):
+        if priority not in self._tenants:
+            priority = INTERACTIVE
+        job = QueuedJob(job_id, args, tenant, priority)
+        self._tenants[priority].push(tenant, job)
+        self._priorities.push(priority, None)
+        self._submitted += 1
+        self._runnable.set()
+        logging.info(f"Job {job_id} queued ({priority}, tenant {tenant}). Queue depth: {len(self._priorities)}")
+
+    def submit(self, job_id: str, *args, tenant: str = ANONYMOUS_TENANT, priority: str = INTERACTIVE):
+        """Enqueue a job without blocking. Raises QueueFullError when the queue is at capacity."""
+        if not self._tasks:
+            raise RuntimeError("Job queue is not running")
+        if self.full():
+            self._rejected += 1
+            raise QueueFullError(JOB_QUEUE_RETRY_AFTER)
+        self._enqueue(job_id, args, tenant, priority)
+
+    async def put(self, job_id: str, *args, tenant: str = ANONYMOUS_TENANT, priority: str = INTERACTIVE):
+        """Enqueue a job, waiting for room if the queue is full. Used to re-enqueue recovered jobs."""
+        if not self._tasks:
+            raise RuntimeError("Job queue is not running")
+        while self.full():
+            self._room.clear()
+            await self._room.wait()
+        self._enqueue(job_id, args, tenant, priority)
+
+    def _next(self) -> Optional[QueuedJob]:
+        """Take the next job to run, or None if every queued job's tenant is at its limit"""
+        throttled = False
+        for priority in self._priorities.candidates():
+            tenants = self._tenants[priority]
+            for tenant in tenants.candidates():
+                if self._may_run(tenant):
+                    self._priorities.pop(priority)
+                    self._room.set()
+                    return tenants.pop(tenant)
+                throttled = True
+        if throttled:
+            self._throttled += 1
+        return None
+
+    async def _worker(self, index: int):
+        while True:
+            job = self._next()
+            if job is None:
+                self._runnable.clear()
+                await self._runnable.wait()
+                continue
+            started_at = time.monotonic()
+            self._wait_times[job.priority].append(started_at - job.enqueued_at)
+            job_wait_seconds.labels(job.priority).observe(started_at - job.enqueued_at)
+            self._busy += 1
+            self._running[job.tenant] = self._running.get(job.tenant, 0) + 1
+            try:
+                await self.handler(job.job_id, *job.args)
+                self._completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._failed += 1
+                logging.error(f"Worker {index} failed on job {job.job_id}: {e}", exc_info=True)
+            finally:
+                self._busy -= 1
+                self._running[job.tenant] -= 1
+                if not self._running[job.tenant]:
+                    del self._running[job.tenant]
+                self._run_times.append(time.monotonic() - started_at)
+                job_run_seconds.labels(job.priority).observe(self._run_times[-1])
+                # A tenant dropping below its limit may unblock its queued jobs
+                self._runnable.set()
+
+    def stats(self) -> dict:
+        """Queue depth, worker utilisation, recent wait/processing times and per-tenant load"""
+        waits = sorted(wait for lane in self._wait_times.values() for wait in lane)
+        runs = self._run_times
+        tenants = {}
+        for priority, queue in self._tenants.items():
+            for tenant, depth in queue.depths().items():
+                tenants.setdefault(tenant, {"queued": 0, "running": 0})["queued"] += depth
+        for tenant, running in self._running.items():
+            tenants.setdefault(tenant, {"queued": 0, "running": 0})["running"] = running
+        return {
+            "depth": len(self._priorities),
+            "max_size": self.max_size,
+            "workers": self.workers,
+            "busy_workers": self._busy,
+            "submitted": self._submitted,
+            "completed": self._completed,
+            "failed": self._failed,
+            "rejected": self._rejected,
+            "throttled": self._throttled,
+            "wait_avg_ms": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+            "wait_p95_ms": round(percentile(waits, 0.95) * 1000, 1),
+            "wait_max_ms": round(waits[-1] * 1000, 1) if waits else 0.0,
+            "processing_avg_ms": round(sum(runs) / len(runs) * 1000, 1) if runs else 0.0,
+            "priorities": {
+                priority: {
+                    "depth": len(self._tenants[priority]),
+                    "wait_p95_ms": round(percentile(sorted(self._wait_times[priority]), 0.95) * 1000, 1),
+                    "wait_p99_ms": round(percentile(sorted(self._wait_times[priority]), 0.99) * 1000, 1),
+                }
+                for priority in JOB_PRIORITIES
+            },
+            "tenants": tenants,
+        }
@@ -0,0 +1,307 @@
+import os
+import time
+import asyncio
+import logging
+import functools
+from typing import Optional
+from dotenv import load_dotenv
+
+from app.falai_client import FalAIClient, FalAIResult, SafetyCheckerError, FALAI_URL, FALAI_PARAMS, FALAI_MODE
+from app.resilience import RetryableError
+from app.falai_queue import FalAIQueuePoller
+from app.db import (
+    update_job_status, record_image_sizes, set_original_path, set_upstream_request_id, get_unfinished_jobs,
+    count_unfinished_jobs, set_job_timeline
+)
+from app.job_queue import JobQueue, ANONYMOUS_TENANT, INTERACTIVE
+from app.result_cache import create_result_cache, cache_key, COMPLETED, BLOCKED
+from app.singleflight import SingleFlight
+from app.ingest import IngestedImage, open_stored_image
+from app.image_processing import normalize_image, normalization_settings
+from app.memory_budget import memory_budget
+from app.metrics import Histogram, Gauge, SLOW_BUCKETS
+from app.timeline import active_timelines, phase, resume_timeline, QUEUE, NORMALIZE, STORE, DB, INFERENCE
+from app.storage import (
+    create_input_storage, content_type_of, upload_store, LocalInputStorage,
+    UPLOAD_STORE_RETENTION_HOURS, INPUT_STORAGE_RETENTION_HOURS
+)
+
+load_dotenv()
+
+# Where jobs run: "local" processes them in the API process's worker pool,
+# "external" only records them for `python -m app.worker` processes to claim
+JOB_DISPATCH = os.getenv("JOB_DISPATCH", "local").lower()
+
+# Seconds between sweeps of stored uploads and local inputs that are past their retention
+STORE_SWEEP_INTERVAL = 3600
+
+# FalAI client initialization disabled - will be initialized on demand
+# This prevents the backend from requiring FALAI_API_KEY at startup
+falai_client = None
+logging.info("FalAI client initialization deferred - will be created when needed")
+
+# Cache of FalAI results keyed on image digest + prompt + model parameters (None when disabled)
+result_cache = create_result_cache()
+
+# Identical jobs in flight at the same time share one FalAI call
+single_flight = SingleFlight()
+
+# Where images are uploaded once before FalAI is given their URL (None sends them inline)
+input_storage = create_input_storage()
+
+# Time from a worker starting a job to its final status, including any wait on FalAI's queue
+job_processing_seconds = Histogram(
+    "job_processing_seconds", "Time from a worker starting a job to its final status, by status", ("status",),
+    buckets=SLOW_BUCKETS
+)
+jobs_in_flight = Gauge("jobs_in_flight", "Unfinished jobs in the database, by status", ("status",))
+
+# job_id -> monotonic time a worker started the job, until it reaches a final status
+processing_started = {}
+
+async def set_group_status(job_id: str, key: Optional[str], status: str, result_url: Optional[str] = None, retryable: bool = False):
+    """Update the job and every identical job attached to it, closing the group on terminal states"""
+    if key and status in ("completed", "failed"):
+        job_ids = single_flight.release(key) or [job_id]
+    elif key:
+        job_ids = single_flight.members(key) or [job_id]
+    else:
+        job_ids = [job_id]
+    with phase(active_timelines.get(job_id), DB):
+        for member_id in job_ids:
+            await update_job_status(member_id, status, result_url, retryable)
+    if status in ("completed", "failed"):
+        started_at = processing_started.pop(job_id, None)
+        if started_at is not None:
+            job_processing_seconds.labels(status).observe(time.monotonic() - started_at)
+        for member_id in job_ids:
+            await save_timeline(member_id)
+    if len(job_ids) > 1:
+        logging.info(f"Job {job_id} status '{status}' applied to {len(job_ids)} coalesced jobs")
+
+async def save_timeline(job_id: str):
+    """Store the phase timeline of a finished job with it, and stop tracking it here"""
+    timeline = active_timelines.pop(job_id)
+    if timeline is None:
+        return
+    try:
+        await set_job_timeline(job_id, timeline.to_json())
+    except Exception as e:
+        logging.error(f"Storing the timeline of job {job_id} failed: {e}")
+
+def get_falai_client() -> FalAIClient:
+    """Return the FalAI client, creating it on first use. Raises ValueError if the API key is missing."""
+    global falai_client
+    if falai_client is None:
+        logging.info("Initializing FalAI client for job processing...")
+        falai_client = FalAIClient()
+        logging.info("FalAI client initialized successfully")
+    return falai_client
+
+async def finish_job(job_id: str, key: Optional[str], result: Optional[FalAIResult] = None, error: Optional[Exception] = None):
+    """Record the outcome of a FalAI call on the job, its coalesced jobs and the result cache"""
+    active_timelines.finish(job_id, INFERENCE)
+    if isinstance(error, SafetyCheckerError):
+        # Remember the refusal so resubmissions don't pay for it again
+        logging.warning(f"Job {job_id} blocked by safety checker: {error}")
+        if result_cache is not None and key:
+            await result_cache.put(key, BLOCKED)
+        await set_group_status(job_id, key, "failed")
+        return
+    if error is not None:
+        retryable = isinstance(error, RetryableError)
+        logging.error(f"Job {job_id} failed{' (retryable)' if retryable else ''}: {error}")
+        await set_group_status(job_id, key, "failed", retryable=retryable)
+        return
+    logging.info(f"FalAI processing result: {result}")
+    
+    # Update job with result
+    if result and result.url:
+        # Store in the cache first so identical jobs arriving now hit it instead of starting a new call
+        if result_cache is not None and key:
+            await result_cache.put(key, COMPLETED, result.url)
+        await set_group_status(job_id, key, "completed", result.url)
+        logging.info(f"Job {job_id} completed successfully. Result URL: {result.url}")
+    else:
+        await set_group_status(job_id, key, "failed")
+        logging.error(f"Job {job_id} failed. No result URL returned from FalAI.")
+
+async def restart_job(row) -> str:
+    """
+    Run an unfinished job again from its row: track its FalAI queue request if it
+    has one, otherwise enqueue it from its stored upload, or fail it as retryable
+    if the upload wasn't kept. Used by workers, external ones and the one in each
+    API process, for the jobs they claim. Returns "resumed", "requeued" or "lost".
+    """
+    job_id, prompt, input_object = row["id"], row["prompt"], row["input_object"]
+    key = None
+    if input_object:
+        digest = input_object.split(".", 1)[0]
+        key = cache_key(digest, prompt, FALAI_PARAMS, FALAI_URL, normalization_settings())
+
+    timeline = resume_timeline(row["timeline"])
+    if FALAI_MODE == "queue" and row["upstream_request_id"]:
+        if key:
+            single_flight.join(key, job_id)
+        active_timelines.put(job_id, timeline)
+        active_timelines.start(job_id, INFERENCE)
+        falai_poller.track(row["upstream_request_id"], job_id, functools.partial(finish_job, job_id, key))
+        return "resumed"
+
+    image = None
+    if upload_store is not None and input_object:
+        try:
+            image = await asyncio.to_thread(
+                open_stored_image, upload_store.path(input_object), digest, content_type_of(input_object)
+            )
+        except (OSError, ValueError) as e:
+            logging.warning(f"Stored upload of job {job_id} can't be read: {e}")
+    if image is None:
+        await update_job_status(job_id, "failed", retryable=True)
+        return "lost"
+
+    if row["status"] != "pending":
+        with phase(timeline, DB):
+            await update_job_status(job_id, "pending")
+    active_timelines.put(job_id, timeline)
+    if not single_flight.join(key, job_id):
+        image.close()
+        return "requeued"
+    try:
+        # Recovered and claimed jobs wait for room in the memory budget like new uploads, just without a timeout
+        image.reservation = await memory_budget.reserve(image.size)
+        active_timelines.start(job_id, QUEUE)
+        await job_queue.put(
+            job_id, prompt, image, key,
+            tenant=row["tenant"] or ANONYMOUS_TENANT, priority=row["priority"] or INTERACTIVE
+        )
+    except BaseException:
+        image.close()
+        raise
+    return "requeued"
+
+async def sweep_stored_files():
+    """
+    Periodically delete stored uploads and locally stored inputs past their
+    retention that no unfinished job needs
+    """
+    local_inputs = input_storage if isinstance(input_storage, LocalInputStorage) else None
+    if upload_store is None and local_inputs is None:
+        return
+    while True:
+        try:
+            unfinished = await get_unfinished_jobs()
+            if upload_store is not None:
+                keep = {row["input_object"] for row in unfinished if row["input_object"]}
+                deleted = await asyncio.to_thread(upload_store.sweep, UPLOAD_STORE_RETENTION_HOURS * 3600, keep)
+                if deleted:
+                    logging.info(f"Deleted {deleted} stored uploads past their retention")
+            if local_inputs is not None:
+                keep = {local_inputs.name_of(row["original_path"]) for row in unfinished}
+                deleted = await asyncio.to_thread(local_inputs.content.sweep, INPUT_STORAGE_RETENTION_HOURS * 3600, keep)
+                if deleted:
+                    logging.info(f"Deleted {deleted} stored inputs past their retention")
+        except Exception as e:
+            logging.error(f"Sweeping stored files failed: {e}")
+        await asyncio.sleep(STORE_SWEEP_INTERVAL)
+
+# Worker handler that processes a queued image job
+async def process_image_job(job_id: str, prompt: str, image: IngestedImage, key: Optional[str] = None):
+    try:
+        await run_image_job(job_id, prompt, image, key)
+    finally:
+        image.close()
+
+async def run_image_job(job_id: str, prompt: str, image: IngestedImage, key: Optional[str] = None):
+    normalized_hold = None
+    processing_started[job_id] = time.monotonic()
+    timeline = active_timelines.get(job_id)
+    active_timelines.finish(job_id, QUEUE)
+    try:
+        logging.info(f"Starting image processing for job {job_id}")
+        # Update job status to processing
+        await set_group_status(job_id, key, "processing")
+        logging.info(f"Image data size: {image.size} bytes")
+        
+        # Process with FalAI
+        logging.info(f"Processing job {job_id} with prompt: {prompt}")
+        
+        # Initialize FalAI client on demand
+        try:
+            client = get_falai_client()
+        except ValueError as e:
+            logging.error(f"Failed to initialize FalAI client: {e}")
+            await set_group_status(job_id, key, "failed")
+            return
+            
+        # Resize, re-encode and strip metadata off the event loop before uploading to FalAI
+        with phase(timeline, NORMALIZE):
+            normalized = await normalize_image(image.data, image.mime_type)
+        if normalized.data is not image.data:
+            # The re-encoded copy lives until FalAI has it, next to the upload
+            normalized_hold = memory_budget.hold(normalized.size)
+        logging.info(
+            f"Job {job_id} image normalized: {normalized.original_size} -> {normalized.size} bytes "
+            f"({normalized.bytes_saved} saved, {normalized.mime_type})"
+        )
+        with phase(timeline, DB):
+            await record_image_sizes(job_id, normalized.original_size, normalized.size)
+        
+        image_url = None
+        if input_storage is not None:
+            # Upload once; every FalAI attempt and resubmission then only sends the URL
+            with phase(timeline, STORE):
+                image_url = await input_storage.put(normalized.data, normalized.mime_type)
+            with phase(timeline, DB):
+                for member_id in (single_flight.members(key) if key else None) or [job_id]:
+                    await set_original_path(member_id, image_url)
+            logging.info(f"Job {job_id} input stored at {image_url}")
+        
+        if FALAI_MODE == "queue":
+            # Hand the request over to the shared pollers and free this worker right away
+            request_id = await client.submit(
+                prompt, normalized.data, content_type=normalized.mime_type, image_url=image_url, timeline=timeline
+            )
+            with phase(timeline, DB):
+                await set_upstream_request_id(job_id, request_id)
+            active_timelines.start(job_id, INFERENCE)
+            falai_poller.track(request_id, job_id, functools.partial(finish_job, job_id, key))
+            return
+        
+        try:
+            result = await client.process(
+                prompt, normalized.data, content_type=normalized.mime_type, image_url=image_url, timeline=timeline
+            )
+        except (SafetyCheckerError, RetryableError) as e:
+            await finish_job(job_id, key, error=e)
+            return
+        await finish_job(job_id, key, result)
+            
+    except Exception as e:
+        logging.error(f"Error processing job {job_id}: {str(e)}", exc_info=True)
+        await set_group_status(job_id, key, "failed", retryable=isinstance(e, RetryableError))
+    finally:
+        if normalized_hold is not None:
+            normalized_hold.release()
+
+# Bounded worker pool that runs process_image_job for queued jobs
+job_queue = JobQueue(process_image_job)
+
+# Background loops completing jobs whose FalAI requests run on the queue API (FALAI_MODE=queue)
+falai_poller = FalAIQueuePoller(get_falai_client)
+
+# Load of this process's job pipeline, read when /metrics is scraped
+Gauge(
+    "job_queue_depth", "Jobs waiting for a worker in this process, by priority", ("priority",),
+    collect=lambda: {(priority,): lane["depth"] for priority, lane in job_queue.stats()["priorities"].items()}
+)
+Gauge("job_workers_busy", "Workers running a job in this process", collect=lambda: {(): job_queue.stats()["busy_workers"]})
+Gauge(
+    "falai_requests_tracked", "FalAI queue requests being polled by this process",
+    collect=lambda: {(): falai_poller.stats()["tracked"]}
+)
+
+async def refresh_job_metrics():
+    """Read the unfinished job counts from the database, before /metrics renders them"""
+    for status, count in (await count_unfinished_jobs()).items():
+        jobs_in_flight.labels(status).set(count)
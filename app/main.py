@@ -1,31 +1,53 @@
 import os
 from dotenv import load_dotenv
 
-from fastapi import FastAPI, Request, UploadFile, File, HTTPException, Form, Depends, Header
+from fastapi import FastAPI, Request, UploadFile, File, HTTPException, Form, Depends, Header, Query, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse, FileResponse, Response
 import logging
-import base64
+import json
 import uuid
 import asyncio
-from typing import Optional, List
-from app.falai_client import FalAIClient
-from app.schemas import JobCreateResponse, Job
-from app.db import db, init_db, create_job, get_job, get_all_jobs, update_job_status
+from datetime import datetime
+from typing import Optional
+from app.falai_client import FALAI_URL, FALAI_PARAMS, FALAI_MODE, start_http_client, close_http_client, http_pool_stats, circuit_breaker, resilience_stats, auth_stats
+from app.schemas import JobCreateResponse, Job, JobListResponse
+from app.db import db, init_db, create_job, get_job, list_jobs, update_job_status, count_pending_jobs, get_recent_timelines, release_leases, encode_cursor, decode_cursor, flush_job_status_writes, status_writes, JOB_STATUS_WRITE_MODE
+from app.job_queue import QueueFullError, JOB_QUEUE_MAX_SIZE, JOB_QUEUE_RETRY_AFTER, JOB_PRIORITIES, INTERACTIVE, ANONYMOUS_TENANT
+from app.result_cache import cache_key, COMPLETED
+from app.ingest import IngestedImage, ingest_upload, UploadTooLargeError, UnsupportedImageError, UploadSizeLimitMiddleware, MAX_UPLOAD_BYTES
+from app.memory_budget import memory_budget, MemoryBudgetExhausted, MEMORY_BUDGET_WAIT_SECONDS
+from app.events import job_events, job_event, next_event, TERMINAL_STATUSES
+from app.job_cache import job_cache
+from app.job_feed import job_feed
+from app.rate_limit import RateLimitMiddleware, create_rate_limiter
+from app.metrics import HTTPMetricsMiddleware, render as render_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from app.timeline import JobTimeline, active_timelines, new_timeline, phase, phase_percentiles, UPLOAD, STORE, DB, QUEUE
+from app.image_processing import start_image_executor, shutdown_image_executor, image_processing_stats, normalization_settings
+from app.storage import LocalInputStorage, content_type_of, object_name, upload_store, INPUTS_ROUTE
+from app.jobs import (
+    JOB_DISPATCH, result_cache, single_flight, input_storage, job_queue, falai_poller,
+    sweep_stored_files, refresh_job_metrics, save_timeline
+)
+from app.worker import Worker, JOB_HEARTBEAT_SECONDS
 
 # Load environment variables from .env file
 load_dotenv()
 
 app = FastAPI()
 
-# FalAI client initialization disabled - will be initialized on demand
-# This prevents the backend from requiring FALAI_API_KEY at startup
-falai_client = None
-logging.info("FalAI client initialization deferred - will be created when needed")
-
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
+# Reject oversized uploads before their body is buffered. Added before CORS so
+# that CORS stays the outermost middleware and 413 responses carry CORS headers.
+app.add_middleware(UploadSizeLimitMiddleware, paths=["/edit-image/", "/api/jobs"])
+
+# Per-caller and global request rate limits, also applied before any body is read.
+# Callers are identified by the tenant of their API key, or by address.
+rate_limiter = create_rate_limiter()
+app.add_middleware(RateLimitMiddleware, limiter=rate_limiter, identify=lambda authorization: tenant_of(authorization))
+
 # Configure CORS to allow all origins, specific methods and all headers as required
 # Use ALLOWED_ORIGINS environment variable if set, otherwise use default origins
 allowed_origins = os.getenv("ALLOWED_ORIGINS", "*")
@@ -43,21 +65,58 @@ app.add_middleware(
     expose_headers=["*"],
 )
 
+# Request latency and status codes for /metrics. Added last so it is the outermost
+# middleware and also counts the 413 and 429 responses of the ones above.
+app.add_middleware(HTTPMetricsMiddleware, router=app.router)
+
+# Seconds between keep-alive messages on idle SSE streams, so proxies don't close them
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+
+# Longest a status request may block with ?wait=, kept under typical proxy timeouts
+LONG_POLL_MAX_SECONDS = int(os.getenv("LONG_POLL_MAX_SECONDS", "60"))
+
+# Background tasks started on startup: recovery of unfinished jobs and the stored file sweep
+background_tasks = set()
+
+# Holds the leases of the jobs this process runs in local mode and claims jobs
+# whose lease ran out, e.g. those of a crashed or stopped instance. Expired
+# leases are rare, so it looks for them only once per heartbeat.
+lease_worker = Worker(claim_interval=JOB_HEARTBEAT_SECONDS)
+
 # Required API key for authentication (loaded from environment variable)
 REQUIRED_API_KEY = os.getenv("API_KEY")
 
+# Per-tenant API keys as "tenant:key,tenant:key". Jobs are scheduled fairly across
+# tenants; API_KEY, if set, belongs to the "default" tenant.
+TENANT_API_KEYS = {}
+for entry in os.getenv("API_KEYS", "").split(","):
+    tenant, sep, key = entry.strip().partition(":")
+    if sep and tenant and key:
+        TENANT_API_KEYS[key] = tenant
+if REQUIRED_API_KEY:
+    TENANT_API_KEYS.setdefault(REQUIRED_API_KEY, "default")
+
 # Log API key status for debugging
 if REQUIRED_API_KEY:
     logging.info(f"API key loaded successfully: {REQUIRED_API_KEY[:10]}...")
+elif TENANT_API_KEYS:
+    logging.info(f"Tenant API keys loaded for {len(set(TENANT_API_KEYS.values()))} tenants")
 else:
     logging.warning("API key not found in environment variables")
 
-# Authentication dependency - Modified to handle cases where API key is not configured
-def verify_auth(authorization: str = Header(None)):
+def tenant_of(authorization: Optional[str]) -> Optional[str]:
+    """The tenant whose API key is in a "Bearer <key>" header, or None"""
+    if not authorization or not authorization.startswith("Bearer "):
+        return None
+    return TENANT_API_KEYS.get(authorization[len("Bearer "):])
+
+# Authentication dependency - Modified to handle cases where API key is not configured.
+# Returns the identity (tenant) of the caller.
+def verify_auth(authorization: str = Header(None)) -> str:
     # If no API key is configured on the server, skip authentication
-    if not REQUIRED_API_KEY or REQUIRED_API_KEY == "":
+    if not TENANT_API_KEYS:
         logging.warning("API key not configured on server - skipping authentication")
-        return True
+        return ANONYMOUS_TENANT
     
     # If no authorization header is provided, reject the request
     if not authorization:
@@ -66,22 +125,213 @@ def verify_auth(authorization: str = Header(None)):
     if not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Invalid authorization header format")
     
-    token = authorization[len("Bearer "):]
+    tenant = tenant_of(authorization)
     
-    if token != REQUIRED_API_KEY:
+    if tenant is None:
         raise HTTPException(status_code=401, detail="Invalid API key")
     
-    return True
+    return tenant
+
+# Identity for endpoints that don't require authentication: the key's tenant when one is sent
+def identify(authorization: str = Header(None)) -> str:
+    return tenant_of(authorization) or ANONYMOUS_TENANT
+
+def check_priority(priority: str) -> str:
+    if priority not in JOB_PRIORITIES:
+        raise HTTPException(status_code=422, detail=f"priority must be one of: {', '.join(JOB_PRIORITIES)}")
+    return priority
 
 @app.on_event("startup")
 async def startup():
     await db.connect()
     await init_db()
+    await start_http_client()
+    start_image_executor()
+    if JOB_DISPATCH == "external":
+        # Jobs run on `python -m app.worker` processes, which load their images from the upload store
+        if upload_store is None:
+            raise RuntimeError("JOB_DISPATCH=external needs UPLOAD_STORE_ENABLED so workers can read the uploads")
+        await job_feed.start()
+        background = [sweep_stored_files()]
+    else:
+        await job_queue.start()
+        if FALAI_MODE == "queue":
+            await falai_poller.start()
+        # Recovery runs in the background so a large backlog doesn't hold up startup
+        background = [lease_worker.run(), sweep_stored_files()]
+    for coro in background:
+        task = asyncio.create_task(coro)
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
 
 @app.on_event("shutdown")
 async def shutdown():
+    for task in list(background_tasks):
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await job_feed.stop()
+    await job_queue.stop()
+    await falai_poller.stop()
+    shutdown_image_executor()
+    await close_http_client()
+    await flush_job_status_writes()
+    if JOB_DISPATCH != "external":
+        # Hand unfinished jobs straight to the next instance instead of making it wait out the lease
+        await release_leases(lease_worker.owner)
     await db.disconnect()
 
+def queue_full_exception(retry_after: int) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Server is busy processing other jobs. Please try again later.",
+        headers={"Retry-After": str(retry_after)}
+    )
+
+def upstream_unavailable_exception(retry_after: int) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Image processing is temporarily unavailable. Please try again later.",
+        headers={"Retry-After": str(retry_after)}
+    )
+
+def memory_budget_exception(retry_after: int) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Server is handling too many images right now. Please try again later.",
+        headers={"Retry-After": str(retry_after)}
+    )
+
+def start_timeline(request: Request) -> Optional[JobTimeline]:
+    """A new job timeline starting when the request arrived, or None when timelines are disabled"""
+    return new_timeline(getattr(request.state, "request_started_at", None))
+
+async def read_upload(image: UploadFile) -> IngestedImage:
+    """
+    Stream the upload into an immutable buffer, mapping ingestion errors to HTTP errors.
+    Room for the image is reserved in the memory budget first, waiting briefly if
+    it's used up; the reservation stays with the image until it's closed.
+    """
+    try:
+        reservation = await memory_budget.reserve(image.size or MAX_UPLOAD_BYTES, MEMORY_BUDGET_WAIT_SECONDS)
+    except MemoryBudgetExhausted as e:
+        logging.warning(f"Memory budget exhausted, rejecting upload of {image.size} bytes")
+        raise memory_budget_exception(e.retry_after)
+    try:
+        ingested = await ingest_upload(image)
+    except UploadTooLargeError as e:
+        reservation.release()
+        raise HTTPException(status_code=413, detail=str(e))
+    except UnsupportedImageError as e:
+        reservation.release()
+        raise HTTPException(status_code=415, detail=str(e))
+    except BaseException:
+        reservation.release()
+        raise
+    reservation.resize(ingested.size)
+    ingested.reservation = reservation
+    logging.info(f"Image ingested. Size: {ingested.size} bytes, type: {ingested.mime_type}, sha256: {ingested.digest[:12]}...")
+    return ingested
+
+async def enqueue_job(
+    job_id: str,
+    prompt: str,
+    image: IngestedImage,
+    tenant: str = ANONYMOUS_TENANT,
+    priority: str = INTERACTIVE,
+    timeline: Optional[JobTimeline] = None
+):
+    """
+    Create the job row and hand it to the worker pool, which then owns the image buffer.
+    Jobs are completed straight from the result cache on a hit, or attached to an
+    identical job already in flight; in those cases the buffer is released here.
+    tenant and priority decide when the worker pool gets to the job. The job's
+    phases are recorded on timeline until it is stored with the finished job.
+    """
+    submitted = False
+    active_timelines.put(job_id, timeline)
+    try:
+        submitted = await _enqueue_job(job_id, prompt, image, tenant, priority)
+    except BaseException:
+        active_timelines.pop(job_id)
+        raise
+    finally:
+        if not submitted:
+            image.close()
+
+async def _enqueue_job(job_id: str, prompt: str, image: IngestedImage, tenant: str, priority: str) -> bool:
+    key = cache_key(image.digest, prompt, FALAI_PARAMS, FALAI_URL, normalization_settings())
+    timeline = active_timelines.get(job_id)
+    if result_cache is not None:
+        cached = await result_cache.get(key)
+        if cached is not None:
+            logging.info(f"Result cache hit for job {job_id} ({cached.status})")
+            with phase(timeline, DB):
+                await create_job(job_id, prompt, f"memory://{job_id}", tenant=tenant, priority=priority)
+                if cached.status == COMPLETED:
+                    await update_job_status(job_id, "completed", cached.result_url)
+                else:
+                    await update_job_status(job_id, "failed")
+            await save_timeline(job_id)
+            return False
+
+    if JOB_DISPATCH == "external":
+        return await _record_external_job(job_id, prompt, image, tenant, priority)
+
+    # Reject before touching the database when there's no room in the queue or
+    # FalAI is failing. Jobs that can attach to an identical in-flight job don't need a queue slot.
+    if not single_flight.members(key):
+        if circuit_breaker.rejecting():
+            logging.warning(f"FalAI circuit breaker open, rejecting job {job_id}")
+            raise upstream_unavailable_exception(circuit_breaker.retry_after())
+        if job_queue.full():
+            logging.warning(f"Job queue full, rejecting job {job_id}")
+            raise queue_full_exception(JOB_QUEUE_RETRY_AFTER)
+
+    # Keep the upload on disk until the job is done so it can be re-enqueued after a restart
+    input_object = None
+    if upload_store is not None:
+        input_object = object_name(image.digest, image.mime_type)
+        with phase(timeline, STORE):
+            await asyncio.to_thread(upload_store.write, input_object, image.data)
+
+    with phase(timeline, DB):
+        await create_job(
+            job_id, prompt, f"memory://{job_id}", input_object, tenant, priority,
+            lease_owner=lease_worker.owner, lease_seconds=lease_worker.lease_seconds
+        )
+
+    if not single_flight.join(key, job_id):
+        logging.info(f"Job {job_id} attached to identical in-flight job {single_flight.members(key)[0]}")
+        return False
+
+    try:
+        active_timelines.start(job_id, QUEUE)
+        job_queue.submit(job_id, prompt, image, key, tenant=tenant, priority=priority)
+    except QueueFullError as e:
+        # Fail the leader and anything that attached to it
+        for member_id in single_flight.release(key):
+            await update_job_status(member_id, "failed")
+            await save_timeline(member_id)
+        raise queue_full_exception(e.retry_after)
+    return True
+
+async def _record_external_job(job_id: str, prompt: str, image: IngestedImage, tenant: str, priority: str) -> bool:
+    """Store the upload and create the pending job for an external worker to claim"""
+    # The backlog in the database plays the part of the in-process queue's bound
+    if await count_pending_jobs() >= JOB_QUEUE_MAX_SIZE:
+        logging.warning(f"Job backlog full, rejecting job {job_id}")
+        raise queue_full_exception(JOB_QUEUE_RETRY_AFTER)
+    input_object = object_name(image.digest, image.mime_type)
+    # The timeline so far goes into the row, and the worker that claims the job carries on with it
+    timeline = active_timelines.pop(job_id)
+    with phase(timeline, STORE):
+        await asyncio.to_thread(upload_store.write, input_object, image.data)
+    await create_job(
+        job_id, prompt, f"memory://{job_id}", input_object, tenant, priority,
+        timeline.to_json() if timeline is not None else None
+    )
+    return False
+
 # Root endpoint for API discoverability
 @app.get("/")
 @app.head("/")
@@ -94,7 +344,13 @@ async def root():
             "image_edit": "/edit-image/",
             "job_create": "/api/jobs",
             "job_status": "/api/jobs/{job_id}",
+            "job_list": "/api/jobs",
+            "job_events": "/api/jobs/{job_id}/events",
+            "job_websocket": "/api/jobs/{job_id}/ws",
             "health": "/health",
+            "stats": "/api/stats",
+            "timeline_stats": "/api/stats/timeline",
+            "metrics": "/metrics",
             "api_info": "/api/info"
         }
     }
@@ -117,23 +373,43 @@ async def api_info():
             "image_edit": {
                 "method": "POST",
                 "path": "/edit-image/",
-                "description": "Edit images using AI"
+                "description": "Edit images using AI; send priority=batch for bulk jobs so interactive edits go first"
             },
             "job_create": {
                 "method": "POST",
                 "path": "/api/jobs",
-                "description": "Create a new image editing job"
+                "description": "Create a new image editing job; send priority=batch for bulk jobs so interactive edits go first"
             },
             "job_status": {
                 "method": "GET",
                 "path": "/api/jobs/{job_id}",
-                "description": "Get the status of an image editing job"
+                "description": "Get the status of an image editing job; add ?wait=N to block up to N seconds for the next status change (optionally ?since=<last seen status>)"
+            },
+            "job_events": {
+                "method": "GET",
+                "path": "/api/jobs/{job_id}/events",
+                "description": "Server-Sent Events stream of a job's status changes, ending when the job completes or fails"
+            },
+            "job_websocket": {
+                "method": "WEBSOCKET",
+                "path": "/api/jobs/{job_id}/ws",
+                "description": "WebSocket that pushes a job's status changes and closes when the job completes or fails"
+            },
+            "job_list": {
+                "method": "GET",
+                "path": "/api/jobs",
+                "description": "List jobs newest first; paginate with limit and the returned next_cursor (after), filter with status, created_after and created_before"
             },
             "health": {
                 "method": "GET",
                 "path": "/health",
                 "description": "Health check endpoint"
             },
+            "stats": {
+                "method": "GET",
+                "path": "/api/stats",
+                "description": "Job queue, FalAI connection pool, caches, coalescing, image normalization, event and database statistics"
+            },
             "api_info": {
                 "method": "GET",
                 "path": "/api/info",
@@ -144,11 +420,14 @@ async def api_info():
 
 @app.post("/edit-image/")
 async def edit_image(
+    request: Request,
     image: UploadFile = File(...),
     prompt: str = Form(...),
-    auth: bool = Depends(verify_auth)
+    priority: str = Form(INTERACTIVE),
+    tenant: str = Depends(verify_auth)
 ):
     logging.info(f"Received image edit request with prompt: {prompt}")
+    check_priority(priority)
     
     try:
         # Validate image
@@ -162,15 +441,14 @@ async def edit_image(
         job_id = str(uuid.uuid4())
         logging.info(f"Generated job ID: {job_id}")
         
-        # Save job to database
-        await create_job(job_id, prompt, f"memory://{job_id}")
-        
-        # Read image data
-        image_data = await image.read()
-        logging.info(f"Image data read. Size: {len(image_data)} bytes")
+        # Stream the upload into a buffer the worker can use without reading it again
+        timeline = start_timeline(request)
+        ingested = await read_upload(image)
+        if timeline is not None:
+            timeline.record(UPLOAD, timeline.origin)
         
-        # Start processing the image in the background
-        asyncio.create_task(process_image_job(job_id, prompt, image))
+        # Save job to database and queue it for processing
+        await enqueue_job(job_id, prompt, ingested, tenant, priority, timeline)
         
         # Return job ID immediately
         return {"job_id": job_id}
@@ -184,7 +462,14 @@ async def edit_image(
 
 # Create a new job for image editing (no authentication required)
 @app.post("/api/jobs", response_model=JobCreateResponse)
-async def create_job_endpoint(request: Request, prompt: str = Form(...), image: UploadFile = File(...)):
+async def create_job_endpoint(
+    request: Request,
+    prompt: str = Form(...),
+    image: UploadFile = File(...),
+    priority: str = Form(INTERACTIVE),
+    tenant: str = Depends(identify)
+):
+    check_priority(priority)
     origin = request.headers.get("origin")
     logging.info(f"Incoming Origin: {origin}")
     logging.info(f"Job creation request received. Prompt: {prompt}, Image filename: {image.filename}, Content type: {image.content_type}")
@@ -200,11 +485,14 @@ async def create_job_endpoint(request: Request, prompt: str = Form(...), image:
     job_id = str(uuid.uuid4())
     logging.info(f"Generated job ID: {job_id}")
     
-    # Save job to database
-    await create_job(job_id, prompt, f"memory://{job_id}")
+    # Stream the upload into a buffer the worker can use without reading it again
+    timeline = start_timeline(request)
+    ingested = await read_upload(image)
+    if timeline is not None:
+        timeline.record(UPLOAD, timeline.origin)
     
-    # Start processing the image in the background
-    asyncio.create_task(process_image_job(job_id, prompt, image))
+    # Save job to database and queue it for processing
+    await enqueue_job(job_id, prompt, ingested, tenant, priority, timeline)
     
     return JobCreateResponse(job_id=job_id)
 
@@ -213,28 +501,83 @@ async def create_job_endpoint(request: Request, prompt: str = Form(...), image:
 async def options_jobs():
     return {}
 
+async def get_job_or_wait(job_id: str, wait: float = 0, since: Optional[str] = None):
+    """
+    Get a job, optionally long-polling: when wait > 0 and the job is still in
+    its current status (or in 'since', the status the client last saw), block
+    until update_job_status reports a transition or wait seconds pass.
+    """
+    if wait <= 0:
+        return await get_job(job_id)
+    
+    # Subscribe before reading so a transition between the read and the wait isn't missed
+    queue = job_events.subscribe(job_id)
+    try:
+        job = await get_job(job_id)
+        if not job or job["status"] in TERMINAL_STATUSES:
+            return job
+        current = since or job["status"]
+        if job["status"] != current:
+            return job
+        
+        deadline = asyncio.get_running_loop().time() + wait
+        while True:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                return job
+            event = await next_event(queue, remaining)
+            if event is None:
+                return job
+            if event["status"] != current:
+                return await get_job(job_id)
+    finally:
+        job_events.unsubscribe(job_id, queue)
+
+def job_model(job, include_timeline: bool = False) -> Job:
+    """
+    The API view of a job row. The phase timeline is only included on request:
+    live for a job this process is running, otherwise as stored with the job.
+    """
+    fields = dict(job)
+    stored = fields.pop("timeline", None)
+    timeline = None
+    if include_timeline:
+        live = active_timelines.get(fields["id"])
+        if live is not None:
+            timeline = live.to_dict()
+        elif stored:
+            timeline = json.loads(stored)
+    return Job(**fields, timeline=timeline)
+
 # Get the status of a job
 @app.get("/api/jobs/{job_id}", response_model=Job)
-async def get_job_endpoint(job_id: str):
+async def get_job_endpoint(
+    job_id: str,
+    wait: float = Query(0, ge=0, le=LONG_POLL_MAX_SECONDS),
+    since: Optional[str] = None,
+    include: Optional[str] = Query(None, description="Comma-separated extra fields: timeline")
+):
     logging.info(f"Job status request received. Job ID: {job_id}")
     
-    job = await get_job(job_id)
+    job = await get_job_or_wait(job_id, wait, since)
     if not job:
         logging.error(f"Job not found: {job_id}")
         raise HTTPException(status_code=404, detail="Job not found")
     
     logging.info(f"Job status: {dict(job)}")
-    return Job(**dict(job))
+    return job_model(job, include_timeline="timeline" in (include or "").split(","))
 
 # Get the status of an image edit job
 @app.get("/edit-image/{job_id}")
 async def get_edit_image_job_status(
     job_id: str,
-    auth: bool = Depends(verify_auth)
+    wait: float = Query(0, ge=0, le=LONG_POLL_MAX_SECONDS),
+    since: Optional[str] = None,
+    tenant: str = Depends(verify_auth)
 ):
     logging.info(f"Image edit job status request received. Job ID: {job_id}")
     
-    job = await get_job(job_id)
+    job = await get_job_or_wait(job_id, wait, since)
     if not job:
         logging.error(f"Job not found: {job_id}")
         raise HTTPException(status_code=404, detail="Job not found")
@@ -248,52 +591,172 @@ async def get_edit_image_job_status(
         "result_url": job["result_url"]
     }
 
-# List all jobs
-@app.get("/api/jobs", response_model=List[Job])
-async def list_jobs():
-    logging.info("Listing all jobs")
-    jobs = await get_all_jobs()
-    return [Job(**dict(job)) for job in jobs]
+def format_sse(event: dict) -> str:
+    return f"event: status\ndata: {json.dumps(event)}\n\n"
 
-# Background task to process the image
-async def process_image_job(job_id: str, prompt: str, image: UploadFile):
+# Stream status transitions of a job as Server-Sent Events
+@app.get("/api/jobs/{job_id}/events")
+async def job_events_endpoint(job_id: str):
+    # Subscribe before reading the current state so no transition is missed in between
+    queue = job_events.subscribe(job_id)
+    job = await get_job(job_id)
+    if not job:
+        job_events.unsubscribe(job_id, queue)
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    async def stream():
+        try:
+            event = job_event(job)
+            yield format_sse(event)
+            while event["status"] not in TERMINAL_STATUSES:
+                next_status = await next_event(queue, SSE_HEARTBEAT_SECONDS)
+                if next_status is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                # The transition may already be reflected in the initial state
+                if next_status == event:
+                    continue
+                event = next_status
+                yield format_sse(event)
+        finally:
+            job_events.unsubscribe(job_id, queue)
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Push status transitions of a job over a WebSocket
+@app.websocket("/api/jobs/{job_id}/ws")
+async def job_websocket(websocket: WebSocket, job_id: str):
+    queue = job_events.subscribe(job_id)
     try:
-        logging.info(f"Starting image processing for job {job_id}")
-        # Update job status to processing
-        await update_job_status(job_id, "processing")
-        
-        # Read image data
-        image_data = await image.read()
-        logging.info(f"Image data read. Size: {len(image_data)} bytes")
+        job = await get_job(job_id)
+        if not job:
+            await websocket.close(code=4404, reason="Job not found")
+            return
         
-        # Process with FalAI
-        logging.info(f"Processing job {job_id} with prompt: {prompt}")
+        await websocket.accept()
+        event = job_event(job)
+        await websocket.send_json(event)
         
-        # Initialize FalAI client on demand
+        # Also watch the socket so a client that goes away frees its subscription
+        receive_task = asyncio.create_task(websocket.receive())
         try:
-            if falai_client is None:
-                logging.info("Initializing FalAI client for job processing...")
-                falai_client = FalAIClient()
-                logging.info("FalAI client initialized successfully")
-        except ValueError as e:
-            logging.error(f"Failed to initialize FalAI client: {e}")
-            await update_job_status(job_id, "failed")
-            return
-            
-        result = await falai_client.process(prompt, image_data)
-        logging.info(f"FalAI processing result: {result}")
-        
-        # Update job with result
-        if result and result.url:
-            await update_job_status(job_id, "completed", result.url)
-            logging.info(f"Job {job_id} completed successfully. Result URL: {result.url}")
-        else:
-            await update_job_status(job_id, "failed")
-            logging.error(f"Job {job_id} failed. No result URL returned from FalAI.")
-            
+            while event["status"] not in TERMINAL_STATUSES:
+                event_task = asyncio.create_task(queue.get())
+                done, _ = await asyncio.wait({event_task, receive_task}, return_when=asyncio.FIRST_COMPLETED)
+                if event_task in done:
+                    next_status = event_task.result()
+                    # The transition may already be reflected in the initial state
+                    if next_status != event:
+                        event = next_status
+                        await websocket.send_json(event)
+                else:
+                    event_task.cancel()
+                if receive_task in done:
+                    if receive_task.result()["type"] == "websocket.disconnect":
+                        return
+                    # Messages from the client are ignored
+                    receive_task = asyncio.create_task(websocket.receive())
+        finally:
+            receive_task.cancel()
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        job_events.unsubscribe(job_id, queue)
+
+# List jobs, newest first, one page at a time
+@app.get("/api/jobs", response_model=JobListResponse)
+async def list_jobs_endpoint(
+    limit: int = Query(50, ge=1, le=200),
+    after: Optional[str] = None,
+    status: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None
+):
+    logging.info(f"Listing jobs (limit={limit}, status={status}, after={after})")
+    
+    try:
+        after_key = decode_cursor(after) if after else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    rows = await list_jobs(limit, after_key, status, created_after, created_before)
+    
+    # One extra row is fetched to detect whether there is another page
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+    
+    return JobListResponse(jobs=[job_model(job) for job in rows], next_cursor=next_cursor)
+
+# Input images stored by the local storage backend, fetched by FalAI.
+# Names are content hashes, so they can't be guessed or enumerated.
+@app.get(INPUTS_ROUTE + "/{name}")
+@app.head(INPUTS_ROUTE + "/{name}")
+async def get_input_image(name: str):
+    if not isinstance(input_storage, LocalInputStorage):
+        raise HTTPException(status_code=404, detail="Not found")
+    try:
+        path = input_storage.content.path(name)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Not found")
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Not found")
+    # Content-addressed, so the file behind a name never changes
+    return FileResponse(path, media_type=content_type_of(name), headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+# Queue and connection pool statistics for sizing JOB_WORKERS against the FalAI quota
+@app.get("/api/stats")
+async def stats():
+    return {
+        "dispatch": JOB_DISPATCH,
+        "queue": job_queue.stats(),
+        "http_pool": http_pool_stats(),
+        "result_cache": result_cache.stats() if result_cache is not None else {"enabled": False},
+        "single_flight": single_flight.stats(),
+        "image_processing": image_processing_stats(),
+        "job_events": job_events.stats(),
+        "job_cache": job_cache.stats(),
+        "job_feed": job_feed.stats(),
+        "memory_budget": memory_budget.stats(),
+        "rate_limit": rate_limiter.stats() if rate_limiter is not None else {"enabled": False},
+        "falai_queue": {"mode": FALAI_MODE, **falai_poller.stats()},
+        "falai_resilience": resilience_stats(),
+        "falai_auth": auth_stats(),
+        "input_storage": input_storage.stats() if input_storage is not None else {"backend": "inline"},
+        "database": db.stats() if hasattr(db, "stats") else {"backend": "databases"},
+        "status_writes": {"mode": JOB_STATUS_WRITE_MODE, **status_writes.stats()}
+    }
+
+# Where recently finished jobs spent their time: p50/p95/p99 per phase
+@app.get("/api/stats/timeline")
+async def timeline_stats(limit: int = Query(500, ge=1, le=5000)):
+    timelines = []
+    for value in await get_recent_timelines(limit):
+        try:
+            timelines.append(json.loads(value))
+        except ValueError:
+            continue
+    return {
+        "jobs": len(timelines),
+        "phases": phase_percentiles(timelines),
+        "active": len(active_timelines),
+    }
+
+# Prometheus metrics: HTTP, job queue, FalAI and database latencies, and jobs in flight
+@app.get("/metrics")
+async def metrics():
+    try:
+        await refresh_job_metrics()
     except Exception as e:
-        logging.error(f"Error processing job {job_id}: {str(e)}", exc_info=True)
-        await update_job_status(job_id, "failed")
+        # Still serve the in-process metrics when the database is unavailable
+        logging.error(f"Counting unfinished jobs for metrics failed: {e}")
+    return Response(render_metrics(), media_type=METRICS_CONTENT_TYPE)
 
 """ from fastapi import FastAPI, UploadFile, File, HTTPException, Form
 from fastapi.middleware.cors import CORSMiddleware
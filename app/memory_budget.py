@@ -0,0 +1,145 @@
+import os
+import time
+import asyncio
+from collections import deque
+from typing import Optional
+from dotenv import load_dotenv
+from app.metrics import Gauge
+
+load_dotenv()
+
+# Image bytes pending and running jobs may hold in this process, in MiB (0 = no limit, usage is still tracked).
+# Keep it well under the instance's memory, e.g. 192 on a 512 MB instance.
+MEMORY_BUDGET_MB = float(os.getenv("MEMORY_BUDGET_MB", "192"))
+# Seconds a new upload waits for room in the budget before it is rejected with 503
+MEMORY_BUDGET_WAIT_SECONDS = float(os.getenv("MEMORY_BUDGET_WAIT_SECONDS", "5"))
+# Seconds clients are told to wait (Retry-After) after such a rejection
+MEMORY_BUDGET_RETRY_AFTER = int(os.getenv("MEMORY_BUDGET_RETRY_AFTER", "10"))
+
+
+class MemoryBudgetExhausted(Exception):
+    def __init__(self, retry_after: int = MEMORY_BUDGET_RETRY_AFTER):
+        super().__init__("Memory budget exhausted")
+        self.retry_after = retry_after
+
+
+class Reservation:
+    """Bytes held against the budget until released. Releasing twice is a no-op."""
+
+    def __init__(self, budget: "MemoryBudget", size: int):
+        self.budget = budget
+        self.size = size
+
+    def resize(self, size: int):
+        """Adjust the reservation to the bytes actually held, e.g. once an upload is read"""
+        self.budget._adjust(size - self.size)
+        self.size = size
+
+    def release(self):
+        if self.size:
+            self.budget._adjust(-self.size)
+            self.size = 0
+
+
+class MemoryBudget:
+    """
+    Process-wide budget of image bytes held by jobs. Uploads reserve their size
+    before they are read and keep the reservation until the job releases its
+    image; when the budget is used up they wait, first come first served, and
+    are turned away after a timeout. Memory held by jobs is then bounded by
+    configuration instead of by traffic.
+    """
+
+    def __init__(self, limit_bytes: int = int(MEMORY_BUDGET_MB * 1024 * 1024)):
+        self.limit = limit_bytes if limit_bytes > 0 else None
+        self.used = 0
+        self.high_water = 0
+        # Waiting reservations in arrival order: (size, future)
+        self._waiters = deque()
+        self.reserved = 0
+        self.waited = 0
+        self.rejected = 0
+        self.wait_seconds_total = 0.0
+
+    def _fits(self, size: int) -> bool:
+        # A request larger than the whole budget still gets through once nothing else is held
+        return self.limit is None or self.used + size <= self.limit or self.used == 0
+
+    def _adjust(self, delta: int):
+        self.used += delta
+        self.high_water = max(self.high_water, self.used)
+        if delta < 0:
+            self._wake()
+
+    def _wake(self):
+        while self._waiters:
+            size, future = self._waiters[0]
+            if future.done():
+                self._waiters.popleft()
+                continue
+            if not self._fits(size):
+                return
+            self._waiters.popleft()
+            self._adjust(size)
+            future.set_result(None)
+
+    async def reserve(self, size: int, timeout: Optional[float] = None) -> Reservation:
+        """
+        Reserve size bytes, waiting up to timeout seconds (forever when None) for
+        room. Raises MemoryBudgetExhausted when the wait times out.
+        """
+        while self._waiters and self._waiters[0][1].done():
+            self._waiters.popleft()
+        if not self._waiters and self._fits(size):
+            self._adjust(size)
+            self.reserved += 1
+            return Reservation(self, size)
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((size, future))
+        self.waited += 1
+        started_at = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            if not future.done():
+                future.cancel()
+                self.rejected += 1
+                # Smaller requests queued behind this one may fit now
+                self._wake()
+                raise MemoryBudgetExhausted()
+        except asyncio.CancelledError:
+            # Hand back bytes granted just as the waiter went away
+            if future.done() and not future.cancelled():
+                self._adjust(-size)
+            else:
+                future.cancel()
+                self._wake()
+            raise
+        finally:
+            self.wait_seconds_total += time.monotonic() - started_at
+        self.reserved += 1
+        return Reservation(self, size)
+
+    def hold(self, size: int) -> Reservation:
+        """Account for bytes that are already held, without waiting, e.g. a job's normalized image"""
+        self._adjust(size)
+        return Reservation(self, size)
+
+    def stats(self) -> dict:
+        return {
+            "limit_bytes": self.limit,
+            "used_bytes": self.used,
+            "high_water_bytes": self.high_water,
+            "utilization": round(self.used / self.limit, 3) if self.limit else None,
+            "waiting": sum(1 for _, future in self._waiters if not future.done()),
+            "reserved": self.reserved,
+            "waited": self.waited,
+            "rejected": self.rejected,
+            "wait_seconds_total": round(self.wait_seconds_total, 3),
+        }
+
+
+# Shared budget of the image bytes held by jobs in this process
+memory_budget = MemoryBudget()
+Gauge("memory_budget_used_bytes", "Image bytes held by jobs in this process", collect=lambda: {(): memory_budget.used})
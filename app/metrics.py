@@ -0,0 +1,242 @@
+"""
+Prometheus metrics in the text exposition format, without a client library.
+
+Recording is a dict lookup plus an integer or float add on the event loop
+thread, so there are no locks on the request and job paths. Histograms keep
+a count per bucket and only compute the cumulative counts Prometheus expects
+when /metrics is scraped.
+"""
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, Optional, Tuple
+from starlette.routing import Match
+
+# Latency buckets in seconds, for fast calls (HTTP handlers, DB queries) and slow ones (jobs, FalAI)
+FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        registry.register(self)
+
+    def labels(self, *values):
+        """The child for a set of label values, created on first use"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}, got {values}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self):
+        """(suffix, label values, extra label, value) for every sample of the metric"""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for suffix, values, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, values, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            yield "", values, "", child.value
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down. With collect, the values are read when the
+    metrics are rendered instead of being set: collect returns a dict of
+    label value tuples to values.
+    """
+
+    type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        collect: Optional[Callable[[], Dict[tuple, float]]] = None
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def samples(self):
+        if self.collect is not None:
+            for values, value in self.collect().items():
+                yield "", values, "", value
+            return
+        for values, child in list(self._children.items()):
+            yield "", values, "", child.value
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # One count per bucket plus +Inf, not cumulative
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = FAST_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), list(child.counts)):
+                cumulative += count
+                yield "_bucket", values, f'le="{_format_value(float(bound))}"', cumulative
+            yield "_count", values, "", cumulative
+            yield "_sum", values, "", child.sum
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric: Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+registry = Registry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def render() -> str:
+    """Every registered metric in the Prometheus text format"""
+    return registry.render()
+
+
+# HTTP requests, labelled with the route template so job IDs don't create new series
+http_requests = Counter("http_requests_total", "HTTP requests by route and status code", ("method", "route", "status"))
+http_request_seconds = Histogram(
+    "http_request_duration_seconds", "Time to the end of the HTTP response by route", ("method", "route")
+)
+
+
+def _route_of(app, scope) -> str:
+    route = scope.get("route")
+    if route is not None:
+        return getattr(route, "path", "unmatched")
+    # Answered before routing, e.g. by the rate limiter: find the route it was meant for
+    for candidate in getattr(app, "routes", ()):
+        match, _ = candidate.matches(scope)
+        if match == Match.FULL:
+            return getattr(candidate, "path", "unmatched")
+    return "unmatched"
+
+
+class HTTPMetricsMiddleware:
+    """
+    Records the latency and status code of every HTTP request. Added last so it
+    is the outermost middleware and sees responses of the other middlewares,
+    e.g. 413 and 429, too. Streaming responses (SSE) count until the stream ends.
+    """
+
+    def __init__(self, app, router=None):
+        self.app = app
+        self.router = router
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started_at = time.monotonic()
+        status = 500
+        # Handlers read it as request.state.request_started_at, e.g. to start a job's timeline
+        scope.setdefault("state", {})["request_started_at"] = started_at
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = _route_of(self.router, scope)
+            http_requests.labels(scope["method"], route, str(status)).inc()
+            http_request_seconds.labels(scope["method"], route).observe(time.monotonic() - started_at)
@@ -0,0 +1,254 @@
+import os
+import math
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Off by default: behind a proxy (e.g. on Render) every caller without an API key
+# shares the proxy's address, and so one bucket, unless RATE_LIMIT_TRUST_FORWARDED is set
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "false").lower() in ("1", "true", "yes")
+# Job creation (POST /edit-image/, POST /api/jobs): requests per minute and burst,
+# for each caller and for all callers together
+RATE_LIMIT_CREATE_PER_MINUTE = float(os.getenv("RATE_LIMIT_CREATE_PER_MINUTE", "30"))
+RATE_LIMIT_CREATE_BURST = int(os.getenv("RATE_LIMIT_CREATE_BURST", "10"))
+RATE_LIMIT_GLOBAL_CREATE_PER_MINUTE = float(os.getenv("RATE_LIMIT_GLOBAL_CREATE_PER_MINUTE", "600"))
+RATE_LIMIT_GLOBAL_CREATE_BURST = int(os.getenv("RATE_LIMIT_GLOBAL_CREATE_BURST", "100"))
+# Status reads (GET /api/jobs..., GET /edit-image/{job_id}), per caller and for all callers together
+RATE_LIMIT_READ_PER_MINUTE = float(os.getenv("RATE_LIMIT_READ_PER_MINUTE", "600"))
+RATE_LIMIT_READ_BURST = int(os.getenv("RATE_LIMIT_READ_BURST", "60"))
+RATE_LIMIT_GLOBAL_READ_PER_MINUTE = float(os.getenv("RATE_LIMIT_GLOBAL_READ_PER_MINUTE", "12000"))
+RATE_LIMIT_GLOBAL_READ_BURST = int(os.getenv("RATE_LIMIT_GLOBAL_READ_BURST", "1000"))
+# Most per-caller buckets kept in memory; the least recently used are evicted first
+RATE_LIMIT_MAX_BUCKETS = int(os.getenv("RATE_LIMIT_MAX_BUCKETS", "10000"))
+# Identify callers without an API key by the first X-Forwarded-For address, behind a trusted proxy
+RATE_LIMIT_TRUST_FORWARDED = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "false").lower() in ("1", "true", "yes")
+
+CREATE = "create"
+READ = "read"
+
+
+class TokenBucket:
+    """Holds up to burst tokens, refilled continuously at rate tokens per second"""
+
+    __slots__ = ("rate", "burst", "tokens", "updated_at")
+
+    def __init__(self, rate: float, burst: int, now: float):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated_at = now
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self) -> float:
+        """Seconds until a token is available"""
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else math.inf
+
+    def reset_time(self) -> float:
+        """Seconds until the bucket is full again"""
+        return (self.burst - self.tokens) / self.rate if self.rate > 0 else math.inf
+
+    def full(self) -> bool:
+        return self.tokens >= self.burst
+
+
+class Limit:
+    def __init__(self, per_minute: float, burst: int):
+        self.rate = per_minute / 60
+        self.burst = max(1, burst)
+        self.per_minute = per_minute
+
+
+class Decision:
+    def __init__(self, allowed: bool, limit: int, remaining: int, reset: float, retry_after: float, policy: str):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        self.reset = reset
+        self.retry_after = retry_after
+        self.policy = policy
+
+    def headers(self) -> list:
+        headers = [
+            (b"ratelimit-limit", str(self.limit).encode()),
+            (b"ratelimit-remaining", str(self.remaining).encode()),
+            (b"ratelimit-reset", str(math.ceil(self.reset)).encode()),
+            (b"ratelimit-policy", self.policy.encode()),
+        ]
+        if not self.allowed:
+            headers.append((b"retry-after", str(max(1, math.ceil(self.retry_after))).encode()))
+        return headers
+
+
+class RateLimiter:
+    """
+    Per-caller and global token buckets for each request class. A request needs
+    a token from both its caller's bucket and the global one. Per-caller buckets
+    live in an LRU dict, so a lookup is O(1) and memory stays bounded. The least
+    recently used bucket is evicted first; by then it has usually refilled, so
+    a new bucket for the same caller is no different.
+    """
+
+    def __init__(self, limits: dict, global_limits: dict, max_buckets: int = RATE_LIMIT_MAX_BUCKETS):
+        self.limits = limits
+        self.max_buckets = max(1, max_buckets)
+        now = time.monotonic()
+        self._global = {name: TokenBucket(limit.rate, limit.burst, now) for name, limit in global_limits.items()}
+        self._global_limits = global_limits
+        # (request class, caller) -> TokenBucket
+        self._buckets = OrderedDict()
+        self.allowed = {name: 0 for name in limits}
+        self.rejected = {name: 0 for name in limits}
+        self.global_rejected = {name: 0 for name in limits}
+        self.evicted = 0
+
+    def _bucket(self, name: str, caller: str, now: float) -> TokenBucket:
+        key = (name, caller)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            limit = self.limits[name]
+            bucket = self._buckets[key] = TokenBucket(limit.rate, limit.burst, now)
+            self._evict()
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def _evict(self):
+        while len(self._buckets) > self.max_buckets:
+            self._buckets.popitem(last=False)
+            self.evicted += 1
+
+    def check(self, name: str, caller: str) -> Decision:
+        """Take a token for a request of class name from caller, if both buckets have one"""
+        now = time.monotonic()
+        bucket = self._bucket(name, caller, now)
+        bucket.refill(now)
+        global_bucket = self._global.get(name)
+        if global_bucket is not None:
+            global_bucket.refill(now)
+
+        limit = self.limits[name]
+        policy = f"{limit.burst};w={math.ceil(limit.burst / limit.rate) if limit.rate > 0 else 0}"
+        if bucket.tokens < 1:
+            self.rejected[name] += 1
+            return Decision(False, limit.burst, 0, bucket.reset_time(), bucket.wait_time(), policy)
+        if global_bucket is not None and global_bucket.tokens < 1:
+            self.global_rejected[name] += 1
+            return Decision(False, limit.burst, int(bucket.tokens), bucket.reset_time(), global_bucket.wait_time(), policy)
+
+        bucket.tokens -= 1
+        if global_bucket is not None:
+            global_bucket.tokens -= 1
+        self.allowed[name] += 1
+        return Decision(True, limit.burst, int(bucket.tokens), bucket.reset_time(), 0.0, policy)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": True,
+            "buckets": len(self._buckets),
+            "max_buckets": self.max_buckets,
+            "evicted": self.evicted,
+            "classes": {
+                name: {
+                    "per_minute": limit.per_minute,
+                    "burst": limit.burst,
+                    "global_per_minute": self._global_limits[name].per_minute if name in self._global_limits else None,
+                    "allowed": self.allowed[name],
+                    "rejected": self.rejected[name],
+                    "global_rejected": self.global_rejected[name],
+                }
+                for name, limit in self.limits.items()
+            },
+        }
+
+
+def create_rate_limiter() -> Optional[RateLimiter]:
+    """The configured rate limiter, or None when disabled"""
+    if not RATE_LIMIT_ENABLED:
+        return None
+    return RateLimiter(
+        {
+            CREATE: Limit(RATE_LIMIT_CREATE_PER_MINUTE, RATE_LIMIT_CREATE_BURST),
+            READ: Limit(RATE_LIMIT_READ_PER_MINUTE, RATE_LIMIT_READ_BURST),
+        },
+        {
+            CREATE: Limit(RATE_LIMIT_GLOBAL_CREATE_PER_MINUTE, RATE_LIMIT_GLOBAL_CREATE_BURST),
+            READ: Limit(RATE_LIMIT_GLOBAL_READ_PER_MINUTE, RATE_LIMIT_GLOBAL_READ_BURST),
+        },
+    )
+
+
+def request_class(method: str, path: str) -> Optional[str]:
+    """The rate limit class of a request, or None for requests that aren't limited"""
+    if method == "POST" and path in ("/edit-image/", "/api/jobs"):
+        return CREATE
+    if method in ("GET", "HEAD") and (path.startswith("/api/jobs") or path.startswith("/edit-image/")):
+        return READ
+    return None
+
+
+class RateLimitMiddleware:
+    """
+    Applies the rate limiter before the request body is read, answering 429 with
+    Retry-After when a bucket is empty. Limited responses carry RateLimit-Limit,
+    RateLimit-Remaining, RateLimit-Reset and RateLimit-Policy headers for the
+    caller's bucket. identify maps the Authorization header to a caller identity
+    (e.g. the tenant of a valid API key) or None, in which case the client
+    address is used.
+    """
+
+    def __init__(self, app, limiter: Optional[RateLimiter], identify: Callable[[Optional[str]], Optional[str]]):
+        self.app = app
+        self.limiter = limiter
+        self.identify = identify
+
+    def _caller(self, scope) -> str:
+        headers = dict(scope["headers"])
+        authorization = headers.get(b"authorization")
+        identity = self.identify(authorization.decode("latin-1")) if authorization else None
+        if identity:
+            return f"key:{identity}"
+        if RATE_LIMIT_TRUST_FORWARDED and b"x-forwarded-for" in headers:
+            return "ip:" + headers[b"x-forwarded-for"].decode("latin-1").split(",")[0].strip()
+        client = scope.get("client")
+        return f"ip:{client[0] if client else 'unknown'}"
+
+    async def __call__(self, scope, receive, send):
+        if self.limiter is None or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        name = request_class(scope["method"], scope["path"])
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+
+        decision = self.limiter.check(name, self._caller(scope))
+        if not decision.allowed:
+            await self._send_429(send, decision)
+            return
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": list(message.get("headers", [])) + decision.headers()}
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+    async def _send_429(self, send, decision: Decision):
+        body = b'{"detail":"Too many requests. Please slow down."}'
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+            ] + decision.headers(),
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,65 @@
+import json
+import time
+import base64
+
+# Raw bytes encoded per chunk. A multiple of 3, so the encoded chunks join into one valid base64 string.
+BASE64_CHUNK_SIZE = 3 * 16 * 1024
+
+
+def base64_length(size: int) -> int:
+    return 4 * ((size + 2) // 3)
+
+
+class JSONBody:
+    """A small JSON body with the same interface as ImageJSONBody"""
+
+    def __init__(self, payload: dict):
+        self.content = json.dumps(payload).encode("utf-8")
+        self.content_length = len(self.content)
+        self.encode_seconds = 0.0
+
+    def headers(self) -> dict:
+        return {
+            "Content-Type": "application/json",
+            "Content-Length": str(self.content_length),
+        }
+
+    async def __aiter__(self):
+        yield self.content
+
+
+class ImageJSONBody:
+    """
+    The JSON body {"image_urls": ["data:<type>;base64,<image>"], **fields},
+    produced in chunks while the request is sent. The image is base64-encoded
+    one slice at a time, so the only full copy in memory is the image itself.
+    Can be iterated again for a retry.
+    """
+
+    def __init__(self, image_data, content_type: str, fields: dict, chunk_size: int = BASE64_CHUNK_SIZE):
+        self.data = memoryview(image_data)
+        self.chunk_size = chunk_size - chunk_size % 3 or 3
+        # The data URL prefix as a JSON string without its closing quote
+        data_url_prefix = json.dumps(f"data:{content_type};base64,")[:-1]
+        self.head = ('{"image_urls": [' + data_url_prefix).encode("utf-8")
+        rest = json.dumps(fields)[1:] if fields else "}"
+        self.tail = ('"]' + (", " + rest if fields else rest)).encode("utf-8")
+        self.content_length = len(self.head) + base64_length(len(self.data)) + len(self.tail)
+        # Time spent base64-encoding, summed over every time the body was sent
+        self.encode_seconds = 0.0
+
+    def headers(self) -> dict:
+        # An explicit Content-Length keeps httpx from falling back to chunked transfer encoding
+        return {
+            "Content-Type": "application/json",
+            "Content-Length": str(self.content_length),
+        }
+
+    async def __aiter__(self):
+        yield self.head
+        for start in range(0, len(self.data), self.chunk_size):
+            started_at = time.perf_counter()
+            chunk = base64.b64encode(self.data[start:start + self.chunk_size])
+            self.encode_seconds += time.perf_counter() - started_at
+            yield chunk
+        yield self.tail
@@ -0,0 +1,286 @@
+import math
+import time
+import random
+import asyncio
+import logging
+import httpx
+from collections import deque
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Optional
+from app.metrics import Counter
+
+# Upstream responses worth retrying; any other error status means the request itself is wrong
+RETRYABLE_STATUS_CODES = (408, 425, 429, 500, 502, 503, 504)
+
+# Retries actually made, by what went wrong: "timeout", "connection" or the HTTP status code
+falai_retries = Counter("falai_retries_total", "FalAI request retries by reason", ("reason",))
+
+
+class NonRetryableError(Exception):
+    """An upstream failure that would fail the same way if retried"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class RetryableError(Exception):
+    """An upstream failure that may succeed later; jobs failing with it are marked retryable"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+
+class CircuitOpenError(RetryableError):
+    """Raised without calling upstream while the circuit breaker is open"""
+    pass
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header given as seconds or an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter: attempt n waits uniform(0, min(max_delay, base * 2^n))"""
+
+    def __init__(self, max_attempts: int, base_delay: float, max_delay: float):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        jittered = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after is not None:
+            return max(retry_after, jittered)
+        return jittered
+
+
+class RetryBudget:
+    """
+    Caps retries at a fraction of the requests made over a sliding window, plus
+    a small floor so a quiet process can still retry. Shared by every caller in
+    the process, so a degraded upstream sees at most (1 + ratio) times the load.
+    """
+
+    def __init__(self, ratio: float, window: float, min_retries: int):
+        self.ratio = ratio
+        self.window = window
+        self.min_retries = min_retries
+        self._requests = deque()
+        self._retries = deque()
+        self.exhausted = 0
+
+    def _prune(self, now: float):
+        for events in (self._requests, self._retries):
+            while events and now - events[0] > self.window:
+                events.popleft()
+
+    def record_request(self):
+        now = time.monotonic()
+        self._prune(now)
+        self._requests.append(now)
+
+    def try_retry(self) -> bool:
+        """Take a retry from the budget, or return False if it's spent"""
+        now = time.monotonic()
+        self._prune(now)
+        if len(self._retries) >= self.min_retries + self.ratio * len(self._requests):
+            self.exhausted += 1
+            return False
+        self._retries.append(now)
+        return True
+
+    def stats(self) -> dict:
+        self._prune(time.monotonic())
+        return {
+            "requests": len(self._requests),
+            "retries": len(self._retries),
+            "ratio": self.ratio,
+            "exhausted": self.exhausted,
+        }
+
+
+class CircuitBreaker:
+    """
+    Opens when the failure rate over a sliding window crosses a threshold, so
+    callers fail fast instead of piling onto a degraded upstream. After
+    open_seconds it lets a few half-open probe requests through; the circuit
+    closes once they all succeed and reopens as soon as one fails.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_rate: float, min_requests: int, window: float, open_seconds: float, half_open_probes: int):
+        self.failure_rate = failure_rate
+        self.min_requests = max(1, min_requests)
+        self.window = window
+        self.open_seconds = open_seconds
+        self.half_open_probes = max(1, half_open_probes)
+        self.state = self.CLOSED
+        # (timestamp, failed) of calls made while closed
+        self._outcomes = deque()
+        self._failures = 0
+        self._opened_at = 0.0
+        self._half_opened_at = 0.0
+        self._probes = 0
+        self._probe_successes = 0
+        self.opened = 0
+        self.rejected = 0
+
+    def _prune(self, now: float):
+        while self._outcomes and now - self._outcomes[0][0] > self.window:
+            _, failed = self._outcomes.popleft()
+            self._failures -= failed
+
+    def _open(self, now: float):
+        if self.state != self.OPEN:
+            self.opened += 1
+            logging.warning(f"Circuit breaker opened, failing fast for {self.open_seconds:.0f}s")
+        self.state = self.OPEN
+        self._opened_at = now
+        self._outcomes.clear()
+        self._failures = 0
+
+    def _half_open(self, now: float):
+        self.state = self.HALF_OPEN
+        self._half_opened_at = now
+        self._probes = 0
+        self._probe_successes = 0
+
+    def rejecting(self) -> bool:
+        """True while open and still cooling down, without taking a probe slot"""
+        return self.state == self.OPEN and time.monotonic() - self._opened_at < self.open_seconds
+
+    def allow(self) -> bool:
+        """Whether a call may go upstream now. In half-open state this claims one of the probe slots."""
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            if now - self._opened_at < self.open_seconds:
+                self.rejected += 1
+                return False
+            self._half_open(now)
+        if self.state == self.HALF_OPEN:
+            # Probes that never reported back (e.g. cancelled) mustn't keep the circuit stuck
+            if now - self._half_opened_at > self.open_seconds:
+                self._half_open(now)
+            if self._probes >= self.half_open_probes:
+                self.rejected += 1
+                return False
+            self._probes += 1
+        return True
+
+    def record_success(self):
+        now = time.monotonic()
+        if self.state == self.HALF_OPEN:
+            self._probe_successes += 1
+            if self._probe_successes >= self.half_open_probes:
+                self.state = self.CLOSED
+                logging.info("Circuit breaker closed, upstream recovered")
+            return
+        if self.state == self.CLOSED:
+            self._prune(now)
+            self._outcomes.append((now, False))
+
+    def record_failure(self):
+        now = time.monotonic()
+        if self.state == self.HALF_OPEN:
+            self._open(now)
+            return
+        if self.state == self.OPEN:
+            return
+        self._prune(now)
+        self._outcomes.append((now, True))
+        self._failures += 1
+        if len(self._outcomes) >= self.min_requests and self._failures / len(self._outcomes) >= self.failure_rate:
+            self._open(now)
+
+    def retry_after(self) -> int:
+        """Seconds until the breaker will let probes through again"""
+        remaining = self.open_seconds - (time.monotonic() - self._opened_at)
+        return max(1, math.ceil(remaining))
+
+    def stats(self) -> dict:
+        self._prune(time.monotonic())
+        return {
+            "state": self.state,
+            "window_requests": len(self._outcomes),
+            "window_failures": self._failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+async def call_with_retries(
+    send: Callable[[], Awaitable[httpx.Response]],
+    policy: RetryPolicy,
+    budget: RetryBudget,
+    breaker: CircuitBreaker,
+    description: str
+) -> httpx.Response:
+    """
+    Send a request with backoff, retry budget and circuit breaker applied.
+    Returns the first successful response. Raises NonRetryableError for
+    responses that won't improve on retry, RetryableError when the attempts,
+    the budget or the breaker ran out.
+    """
+    budget.record_request()
+    for attempt in range(policy.max_attempts):
+        if not breaker.allow():
+            raise CircuitOpenError(f"{description}: circuit breaker open", breaker.retry_after())
+        if attempt > 0:
+            logging.info(f"{description}: attempt {attempt + 1}/{policy.max_attempts}")
+
+        retry_after = None
+        try:
+            resp = await send()
+        except httpx.TransportError as e:
+            # Timeouts, refused and dropped connections
+            breaker.record_failure()
+            error = RetryableError(f"{description}: {type(e).__name__}: {e}")
+            error.__cause__ = e
+            reason = "timeout" if isinstance(e, httpx.TimeoutException) else "connection"
+        else:
+            if resp.status_code < 400:
+                breaker.record_success()
+                return resp
+            if resp.status_code not in RETRYABLE_STATUS_CODES:
+                # The upstream is answering; it's this request that's wrong
+                breaker.record_success()
+                raise NonRetryableError(f"{description}: HTTP {resp.status_code}: {resp.text}", resp.status_code)
+            breaker.record_failure()
+            retry_after = parse_retry_after(resp.headers.get("retry-after"))
+            error = RetryableError(f"{description}: HTTP {resp.status_code}: {resp.text}", retry_after, resp.status_code)
+            reason = str(resp.status_code)
+
+        logging.warning(str(error))
+        if attempt == policy.max_attempts - 1:
+            break
+        if retry_after is not None and retry_after > policy.max_delay:
+            logging.warning(f"{description}: Retry-After of {retry_after:.0f}s exceeds the maximum backoff, giving up")
+            break
+        if not budget.try_retry():
+            logging.warning(f"{description}: retry budget exhausted, not retrying")
+            break
+        delay = policy.delay(attempt, retry_after)
+        falai_retries.labels(reason).inc()
+        logging.info(f"{description}: retrying in {delay:.2f}s")
+        await asyncio.sleep(delay)
+    raise error
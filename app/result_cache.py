@@ -0,0 +1,211 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Optional
+from dotenv import load_dotenv
+
+from app.db import get_cached_result, touch_cached_result, put_cached_result, prune_cached_results, parse_timestamp
+
+load_dotenv()
+
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Eviction policy of the in-memory tier: "lru", "ttl" or "lru+ttl"
+RESULT_CACHE_POLICY = os.getenv("RESULT_CACHE_POLICY", "lru+ttl").lower()
+# Maximum number of entries kept in memory
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "1000"))
+# Seconds a cached result stays valid (FalAI result URLs don't live forever), 0 = no expiry
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", "86400"))
+# Persist results in SQLite so they survive restarts
+RESULT_CACHE_PERSISTENT = os.getenv("RESULT_CACHE_PERSISTENT", "true").lower() in ("1", "true", "yes")
+# Maximum number of rows kept in the persistent tier
+RESULT_CACHE_MAX_ROWS = int(os.getenv("RESULT_CACHE_MAX_ROWS", "100000"))
+
+# Prune the persistent tier every this many stores
+PRUNE_INTERVAL = 100
+
+# Cache entry statuses
+COMPLETED = "completed"
+BLOCKED = "blocked"
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapse whitespace so trivially different prompts share a cache entry"""
+    return re.sub(r"\s+", " ", prompt or "").strip()
+
+
+def cache_key(image_digest: str, prompt: str, params: dict, model_url: str, normalization: Optional[dict]) -> str:
+    """
+    Content address of a FalAI request: upload digest + normalized prompt +
+    model parameters + the image normalization settings, which decide what
+    FalAI actually receives for the upload
+    """
+    material = json.dumps(
+        {
+            "image": image_digest,
+            "prompt": normalize_prompt(prompt),
+            "params": params,
+            "model": model_url,
+            "normalization": normalization,
+        },
+        sort_keys=True,
+        separators=(",", ":")
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class CachedResult:
+    def __init__(self, status: str, result_url: Optional[str] = None, stored_at: Optional[float] = None):
+        self.status = status
+        self.result_url = result_url
+        self.stored_at = stored_at if stored_at is not None else time.time()
+
+
+class EvictionPolicy:
+    """Decides which entries of the in-memory tier are stale and how hits reorder entries"""
+
+    def on_hit(self, entries: OrderedDict, key: str):
+        pass
+
+    def is_expired(self, entry: CachedResult, now: float) -> bool:
+        return False
+
+
+class LRUPolicy(EvictionPolicy):
+    """Evict the least recently used entry when the cache is full"""
+
+    def on_hit(self, entries: OrderedDict, key: str):
+        entries.move_to_end(key)
+
+
+class TTLPolicy(EvictionPolicy):
+    """Expire entries ttl seconds after they were stored; evict the oldest when full"""
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+
+    def is_expired(self, entry: CachedResult, now: float) -> bool:
+        return self.ttl > 0 and now - entry.stored_at > self.ttl
+
+
+class LRUTTLPolicy(TTLPolicy):
+    """LRU ordering with a TTL on every entry"""
+
+    def on_hit(self, entries: OrderedDict, key: str):
+        entries.move_to_end(key)
+
+
+def make_policy(name: str, ttl: int) -> EvictionPolicy:
+    if name == "lru":
+        return LRUPolicy()
+    if name == "ttl":
+        return TTLPolicy(ttl)
+    if name == "lru+ttl":
+        return LRUTTLPolicy(ttl)
+    raise ValueError(f"Unknown result cache policy: {name}")
+
+
+class ResultCache:
+    """
+    Two-tier cache of FalAI results: a bounded in-memory tier with a pluggable
+    eviction policy in front of an optional SQLite tier.
+    """
+
+    def __init__(
+        self,
+        policy: EvictionPolicy,
+        max_entries: int = RESULT_CACHE_MAX_ENTRIES,
+        ttl: int = RESULT_CACHE_TTL,
+        persistent: bool = RESULT_CACHE_PERSISTENT,
+        max_rows: int = RESULT_CACHE_MAX_ROWS
+    ):
+        self.policy = policy
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.persistent = persistent
+        self.max_rows = max_rows
+        self._entries = OrderedDict()
+        self._stores_since_prune = 0
+        self.memory_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    async def get(self, key: str) -> Optional[CachedResult]:
+        """Look up a result, promoting persistent hits into memory"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            if self.policy.is_expired(entry, time.time()):
+                del self._entries[key]
+                self.evictions += 1
+            else:
+                self.policy.on_hit(self._entries, key)
+                self.memory_hits += 1
+                return entry
+
+        if self.persistent:
+            try:
+                row = await get_cached_result(key, self.ttl)
+                if row:
+                    await touch_cached_result(key)
+                    # Keep the row's age so the entry still expires ttl seconds after FalAI produced it
+                    entry = CachedResult(row["status"], row["result_url"], parse_timestamp(row["created_at"]).timestamp())
+                    self._store_in_memory(key, entry)
+                    self.persistent_hits += 1
+                    return entry
+            except Exception as e:
+                logging.warning(f"Result cache lookup failed: {e}")
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, status: str, result_url: Optional[str] = None):
+        """Store a completed result or a safety checker rejection"""
+        self._store_in_memory(key, CachedResult(status, result_url))
+        self.stores += 1
+        if not self.persistent:
+            return
+        try:
+            await put_cached_result(key, status, result_url)
+            self._stores_since_prune += 1
+            if self._stores_since_prune >= PRUNE_INTERVAL:
+                self._stores_since_prune = 0
+                await prune_cached_results(self.max_rows, self.ttl)
+        except Exception as e:
+            logging.warning(f"Failed to persist result cache entry: {e}")
+
+    def _store_in_memory(self, key: str, entry: CachedResult):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.persistent_hits
+        lookups = hits + self.misses
+        return {
+            "enabled": True,
+            "policy": type(self.policy).__name__,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "persistent": self.persistent,
+            "memory_hits": self.memory_hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "hit_ratio": round(hits / lookups, 3) if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+        }
+
+
+def create_result_cache() -> Optional[ResultCache]:
+    """Build the result cache from environment settings, or None when disabled"""
+    if not RESULT_CACHE_ENABLED:
+        logging.info("FalAI result cache disabled")
+        return None
+    return ResultCache(make_policy(RESULT_CACHE_POLICY, RESULT_CACHE_TTL))
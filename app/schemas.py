@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, List
 from datetime import datetime
 
 class JobCreateResponse(BaseModel):
@@ -12,4 +12,15 @@ class Job(BaseModel):
     original_path: Optional[str]
     result_url: Optional[str]
     created_at: Optional[datetime] = None
-    updated_at: Optional[datetime] = None
\ No newline at end of file
+    updated_at: Optional[datetime] = None
+    input_bytes: Optional[int] = None
+    processed_bytes: Optional[int] = None
+    upstream_request_id: Optional[str] = None
+    retryable: Optional[bool] = None
+    priority: Optional[str] = None
+    # Phase timeline, only returned with ?include=timeline
+    timeline: Optional[dict] = None
+
+class JobListResponse(BaseModel):
+    jobs: List[Job]
+    next_cursor: Optional[str] = None
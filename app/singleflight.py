@@ -0,0 +1,38 @@
+from typing import List
+
+
+class SingleFlight:
+    """
+    Tracks identical jobs that are in flight at the same time so a single
+    upstream FalAI call can serve all of them. The first job for a key is the
+    leader; later jobs with the same key attach to it until it is released.
+    """
+
+    def __init__(self):
+        self._groups = {}
+        self.coalesced = 0
+
+    def join(self, key: str, job_id: str) -> bool:
+        """Attach job_id to the group for key. Returns True if the job is the leader."""
+        group = self._groups.get(key)
+        if group is None:
+            self._groups[key] = [job_id]
+            return True
+        group.append(job_id)
+        self.coalesced += 1
+        return False
+
+    def members(self, key: str) -> List[str]:
+        """All job IDs currently attached to key, leader first"""
+        return list(self._groups.get(key, []))
+
+    def release(self, key: str) -> List[str]:
+        """Close the group for key and return every job ID that was attached to it"""
+        return self._groups.pop(key, [])
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._groups),
+            "attached_jobs": sum(len(group) - 1 for group in self._groups.values()),
+            "coalesced_total": self.coalesced,
+        }
@@ -0,0 +1,149 @@
+import os
+import asyncio
+import logging
+import aiosqlite
+from typing import Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Performance profile applied to every SQLite connection on startup
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+# Page cache per connection, in KiB
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "16384"))
+# Bytes of the database file to memory map for reads, 0 disables it
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", "0"))
+# Number of read-only connections serving SELECTs
+SQLITE_READER_POOL_SIZE = int(os.getenv("SQLITE_READER_POOL_SIZE", "4"))
+
+SQLITE_URL_PREFIXES = ("sqlite+aiosqlite:///", "sqlite:///")
+
+
+def sqlite_path(url: str) -> Optional[str]:
+    """Database file path of a SQLite URL, or None for other databases and in-memory SQLite"""
+    for prefix in SQLITE_URL_PREFIXES:
+        if url.startswith(prefix):
+            path = url[len(prefix):].split("?", 1)[0]
+            if not path or path == ":memory:":
+                return None
+            return path
+    return None
+
+
+class SQLiteDatabase:
+    """
+    SQLite access with a tuned performance profile: one dedicated writer
+    connection through which every write is serialized, and a small pool of
+    read-only connections for SELECTs, which WAL lets run concurrently with
+    the writer. Offers the subset of the databases.Database API this app uses.
+    """
+
+    def __init__(self, path: str, reader_pool_size: int = SQLITE_READER_POOL_SIZE):
+        self.path = path
+        self.reader_pool_size = max(1, reader_pool_size)
+        self.is_connected = False
+        self._writer = None
+        self._write_lock = asyncio.Lock()
+        self._readers = None
+        self._all_readers = []
+        self.reads = 0
+        self.writes = 0
+        self.read_waits = 0
+
+    async def _open(self, read_only: bool) -> aiosqlite.Connection:
+        connection = await aiosqlite.connect(self.path, isolation_level=None)
+        connection.row_factory = aiosqlite.Row
+        await connection.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+        await connection.execute(f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}")
+        await connection.execute(f"PRAGMA cache_size = {-SQLITE_CACHE_SIZE_KB}")
+        await connection.execute("PRAGMA temp_store = MEMORY")
+        if SQLITE_MMAP_SIZE:
+            await connection.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+        if read_only:
+            await connection.execute("PRAGMA query_only = ON")
+        return connection
+
+    async def connect(self):
+        if self.is_connected:
+            return
+        self._writer = await self._open(read_only=False)
+        # The journal mode is a property of the database file, so setting it once on the writer is enough
+        async with self._writer.execute(f"PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}") as cursor:
+            journal_mode = (await cursor.fetchone())[0]
+        self._readers = asyncio.Queue()
+        for _ in range(self.reader_pool_size):
+            reader = await self._open(read_only=True)
+            self._all_readers.append(reader)
+            self._readers.put_nowait(reader)
+        self.is_connected = True
+        logging.info(
+            f"SQLite connected: {self.path} (journal_mode={journal_mode}, synchronous={SQLITE_SYNCHRONOUS}, "
+            f"busy_timeout={SQLITE_BUSY_TIMEOUT_MS}ms, cache={SQLITE_CACHE_SIZE_KB}KiB, readers={self.reader_pool_size})"
+        )
+
+    async def disconnect(self):
+        if not self.is_connected:
+            return
+        self.is_connected = False
+        for reader in self._all_readers:
+            await reader.close()
+        self._all_readers = []
+        self._readers = None
+        async with self._write_lock:
+            await self._writer.close()
+            self._writer = None
+
+    async def _acquire_reader(self) -> aiosqlite.Connection:
+        if self._readers.empty():
+            self.read_waits += 1
+        return await self._readers.get()
+
+    async def fetch_one(self, query: str, values: dict = None):
+        reader = await self._acquire_reader()
+        try:
+            self.reads += 1
+            async with reader.execute(query, values or {}) as cursor:
+                return await cursor.fetchone()
+        finally:
+            self._readers.put_nowait(reader)
+
+    async def fetch_all(self, query: str, values: dict = None):
+        reader = await self._acquire_reader()
+        try:
+            self.reads += 1
+            async with reader.execute(query, values or {}) as cursor:
+                return await cursor.fetchall()
+        finally:
+            self._readers.put_nowait(reader)
+
+    async def execute(self, query: str, values: dict = None) -> int:
+        """Run a single write on the writer connection. Returns the number of rows affected."""
+        async with self._write_lock:
+            self.writes += 1
+            async with self._writer.execute(query, values or {}) as cursor:
+                return cursor.rowcount
+
+    async def execute_many(self, query: str, values: list):
+        """Run the same write for every set of values in a single transaction"""
+        async with self._write_lock:
+            self.writes += 1
+            await self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                await self._writer.executemany(query, values)
+            except BaseException:
+                await self._writer.execute("ROLLBACK")
+                raise
+            await self._writer.execute("COMMIT")
+
+    def stats(self) -> dict:
+        return {
+            "backend": "sqlite",
+            "readers": self.reader_pool_size,
+            "idle_readers": self._readers.qsize() if self._readers is not None else 0,
+            "reads": self.reads,
+            "writes": self.writes,
+            "read_waits": self.read_waits,
+            "write_lock_held": self._write_lock.locked(),
+        }
@@ -0,0 +1,277 @@
+import os
+import re
+import time
+import asyncio
+import hashlib
+import logging
+import importlib
+import tempfile
+from typing import Optional
+from dotenv import load_dotenv
+
+from app.falai_client import get_http_client
+
+load_dotenv()
+
+# Where images sent to FalAI are kept: "inline" sends them as data URLs in every
+# request, "local" stores them on disk and serves them from this app, "http" PUTs
+# them to an object store; "package.module:ClassName" loads a custom backend
+INPUT_STORAGE = os.getenv("INPUT_STORAGE", "inline")
+INPUT_STORAGE_DIR = os.getenv("INPUT_STORAGE_DIR", "./data/inputs")
+# Hours the local backend keeps an input once no unfinished job needs it
+INPUT_STORAGE_RETENTION_HOURS = float(os.getenv("INPUT_STORAGE_RETENTION_HOURS", "24"))
+# Public base URL of this app, which FalAI fetches local inputs from
+INPUT_STORAGE_BASE_URL = os.getenv("INPUT_STORAGE_BASE_URL", os.getenv("BASE_URL", "")).rstrip("/")
+# Object store bucket URL objects are PUT to, the URL they are read from if
+# different, and an optional "Header-Name: value" sent with uploads
+INPUT_STORAGE_ENDPOINT = os.getenv("INPUT_STORAGE_ENDPOINT", "").rstrip("/")
+INPUT_STORAGE_PUBLIC_URL = os.getenv("INPUT_STORAGE_PUBLIC_URL", "").rstrip("/")
+INPUT_STORAGE_AUTH_HEADER = os.getenv("INPUT_STORAGE_AUTH_HEADER", "")
+
+# Durable copies of the original uploads, used to re-enqueue unfinished jobs after
+# a restart. Point UPLOAD_STORE_DIR at a persistent disk for this to survive deploys.
+UPLOAD_STORE_ENABLED = os.getenv("UPLOAD_STORE_ENABLED", "true").lower() in ("1", "true", "yes")
+UPLOAD_STORE_DIR = os.getenv("UPLOAD_STORE_DIR", "./data/uploads")
+# Hours stored uploads are kept once no unfinished job needs them
+UPLOAD_STORE_RETENTION_HOURS = float(os.getenv("UPLOAD_STORE_RETENTION_HOURS", "24"))
+
+# Path under which the local backend's inputs are served
+INPUTS_ROUTE = "/inputs"
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+EXTENSIONS = {
+    "image/jpeg": "jpg",
+    "image/png": "png",
+    "image/webp": "webp",
+    "image/gif": "gif",
+    "image/heic": "heic",
+    "image/avif": "avif",
+    "image/bmp": "bmp",
+}
+MIME_TYPES = {extension: mime_type for mime_type, extension in EXTENSIONS.items()}
+
+# Object names are the SHA-256 of the content plus an extension
+OBJECT_NAME_RE = re.compile(r"^[0-9a-f]{64}\.[a-z]+$")
+
+
+def object_name(digest: str, content_type: str) -> str:
+    return f"{digest}.{EXTENSIONS.get(content_type, 'bin')}"
+
+
+def content_type_of(name: str) -> str:
+    return MIME_TYPES.get(name.rsplit(".", 1)[-1], "application/octet-stream")
+
+
+class ContentStore:
+    """
+    Content-addressed files on disk, sharded into two levels of directories by
+    the leading hex digits of their name so no directory grows too large.
+    Writes go to a temporary file that is renamed into place, so a crash never
+    leaves a partial file under a valid name.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, name: str) -> str:
+        if not OBJECT_NAME_RE.match(name):
+            raise ValueError(f"Invalid object name: {name}")
+        return os.path.join(self.root, name[:2], name[2:4], name)
+
+    def exists(self, name: str) -> bool:
+        return os.path.exists(self.path(name))
+
+    def write(self, name: str, data) -> bool:
+        """Store data under name unless it's already there. Returns whether a file was written."""
+        path = self.path(name)
+        if os.path.exists(path):
+            # Refresh the age of the existing copy so a sweep doesn't delete it from under a new job
+            try:
+                os.utime(path)
+                return False
+            except FileNotFoundError:
+                pass
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        return True
+
+    def read(self, name: str) -> bytes:
+        with open(self.path(name), "rb") as f:
+            return f.read()
+
+    def delete(self, name: str):
+        try:
+            os.unlink(self.path(name))
+        except FileNotFoundError:
+            pass
+
+    def sweep(self, max_age_seconds: float, keep=frozenset()) -> int:
+        """Delete files older than max_age_seconds, except the names in keep. Returns how many were deleted."""
+        if not os.path.isdir(self.root):
+            return 0
+        cutoff = time.time() - max_age_seconds
+        deleted = 0
+        for first in os.scandir(self.root):
+            if not first.is_dir():
+                continue
+            for second in os.scandir(first.path):
+                if not second.is_dir():
+                    continue
+                for entry in os.scandir(second.path):
+                    # Leftover temporary files of interrupted writes are swept too
+                    if entry.name in keep or entry.stat().st_mtime >= cutoff:
+                        continue
+                    try:
+                        os.unlink(entry.path)
+                        deleted += 1
+                    except FileNotFoundError:
+                        pass
+        return deleted
+
+
+class InputStorage:
+    """
+    Where images are uploaded once so FalAI can be given a URL instead of the
+    image itself. Implementations store the content under name and return the
+    URL FalAI should fetch it from; storing the same name again is a no-op.
+    """
+
+    backend = "custom"
+
+    def __init__(self):
+        self.uploads = 0
+        self.reused = 0
+        self.bytes_uploaded = 0
+
+    async def put(self, data, content_type: str) -> str:
+        digest = await asyncio.to_thread(lambda: hashlib.sha256(data).hexdigest())
+        name = object_name(digest, content_type)
+        if await self.store(name, data, content_type):
+            self.uploads += 1
+            self.bytes_uploaded += len(data)
+        else:
+            self.reused += 1
+        return self.url(name)
+
+    async def store(self, name: str, data, content_type: str) -> bool:
+        """Store data under name. Returns False if it was already stored."""
+        raise NotImplementedError
+
+    def url(self, name: str) -> str:
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend,
+            "uploads": self.uploads,
+            "reused": self.reused,
+            "bytes_uploaded": self.bytes_uploaded,
+        }
+
+
+class LocalInputStorage(InputStorage):
+    """Inputs stored on local disk and served by this app under /inputs"""
+
+    backend = "local"
+
+    def __init__(self, directory: str = INPUT_STORAGE_DIR, base_url: str = INPUT_STORAGE_BASE_URL):
+        super().__init__()
+        if not base_url:
+            raise ValueError("INPUT_STORAGE=local needs BASE_URL (or INPUT_STORAGE_BASE_URL) so FalAI can fetch the inputs")
+        self.content = ContentStore(directory)
+        self.base_url = base_url
+
+    async def store(self, name: str, data, content_type: str) -> bool:
+        return await asyncio.to_thread(self.content.write, name, data)
+
+    def url(self, name: str) -> str:
+        return f"{self.base_url}{INPUTS_ROUTE}/{name}"
+
+    def name_of(self, url: Optional[str]) -> Optional[str]:
+        """The object name behind a URL returned by url(), or None for other URLs"""
+        prefix = f"{self.base_url}{INPUTS_ROUTE}/"
+        if url and url.startswith(prefix):
+            return url[len(prefix):]
+        return None
+
+
+class HTTPObjectStorage(InputStorage):
+    """
+    Inputs PUT to an object store bucket over plain HTTP, e.g. a bucket with
+    a write token or mock_object_storage.py. Objects already in the bucket
+    (found with a HEAD request) aren't uploaded again.
+    """
+
+    backend = "http"
+
+    def __init__(
+        self,
+        endpoint: str = INPUT_STORAGE_ENDPOINT,
+        public_url: str = INPUT_STORAGE_PUBLIC_URL,
+        auth_header: str = INPUT_STORAGE_AUTH_HEADER
+    ):
+        super().__init__()
+        if not endpoint:
+            raise ValueError("INPUT_STORAGE=http needs INPUT_STORAGE_ENDPOINT")
+        self.endpoint = endpoint
+        self.public_url = public_url or endpoint
+        self.headers = {}
+        if auth_header:
+            header_name, _, value = auth_header.partition(":")
+            self.headers[header_name.strip()] = value.strip()
+
+    async def store(self, name: str, data, content_type: str) -> bool:
+        client = await get_http_client()
+        target = f"{self.endpoint}/{name}"
+        resp = await client.head(target, headers=self.headers)
+        if resp.status_code == 200:
+            return False
+
+        view = memoryview(data)
+
+        async def chunks():
+            for start in range(0, len(view), UPLOAD_CHUNK_SIZE):
+                yield bytes(view[start:start + UPLOAD_CHUNK_SIZE])
+
+        headers = {**self.headers, "Content-Type": content_type, "Content-Length": str(len(view))}
+        resp = await client.put(target, headers=headers, content=chunks())
+        resp.raise_for_status()
+        return True
+
+    def url(self, name: str) -> str:
+        return f"{self.public_url}/{name}"
+
+
+# Store of original uploads, or None when disabled
+upload_store = ContentStore(UPLOAD_STORE_DIR) if UPLOAD_STORE_ENABLED else None
+
+
+def create_input_storage() -> Optional[InputStorage]:
+    """The configured input storage backend, or None when images are sent inline"""
+    backend = INPUT_STORAGE.strip()
+    if backend.lower() == "inline":
+        return None
+    if backend.lower() == "local":
+        storage = LocalInputStorage()
+    elif backend.lower() == "http":
+        storage = HTTPObjectStorage()
+    elif ":" in backend:
+        module_name, _, class_name = backend.partition(":")
+        storage = getattr(importlib.import_module(module_name), class_name)()
+    else:
+        raise ValueError(f"Unsupported INPUT_STORAGE: {INPUT_STORAGE}")
+    logging.info(f"Input storage: {storage.backend}")
+    return storage
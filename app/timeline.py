@@ -0,0 +1,184 @@
+import os
+import json
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Optional
+from dotenv import load_dotenv
+
+from app.stats import percentile
+
+load_dotenv()
+
+# Record where each job's time goes and store it with the job (GET /api/jobs/{job_id}?include=timeline)
+JOB_TIMELINE_ENABLED = os.getenv("JOB_TIMELINE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Most timelines of unfinished jobs kept in memory; the oldest are dropped first
+TIMELINE_MAX_ACTIVE = 10000
+
+# Phases of a job, roughly in the order they happen
+UPLOAD = "upload"          # request received until the upload is buffered, memory budget wait included
+STORE = "store"            # writing the upload to the upload store or the input storage
+DB = "db"                  # job row writes
+QUEUE = "queue"            # waiting for a worker
+NORMALIZE = "normalize"    # resizing and re-encoding the image
+ENCODE = "encode"          # base64 encoding of the request body, done while it's sent to FalAI
+SUBMIT = "submit"          # FalAI queue submission (FALAI_MODE=queue)
+INFERENCE = "inference"    # the FalAI call that produced the result, or the wait on FalAI's queue
+RETRIES = "retries"        # failed FalAI attempts and the backoff between them
+
+
+class JobTimeline:
+    """
+    Monotonic timestamps of the phases of one job, as offsets from the moment
+    the request arrived. Phases may repeat (e.g. several DB writes) and may
+    overlap (encoding happens while the request is sent).
+    """
+
+    def __init__(self, origin: Optional[float] = None):
+        self.origin = time.monotonic() if origin is None else origin
+        self.started_at = datetime.now(timezone.utc).timestamp() - (time.monotonic() - self.origin)
+        # [phase, start offset, duration] in seconds
+        self.phases = []
+        self._open = {}
+
+    def record(self, phase: str, started_at: float, ended_at: Optional[float] = None):
+        """Record a phase between two time.monotonic() readings, ending now by default"""
+        ended_at = time.monotonic() if ended_at is None else ended_at
+        self.phases.append([phase, started_at - self.origin, max(0.0, ended_at - started_at)])
+
+    def add(self, phase: str, started_at: float, duration: float):
+        """Record a phase known only by its total duration, e.g. work spread over many chunks"""
+        self.phases.append([phase, started_at - self.origin, duration])
+
+    def start(self, phase: str):
+        """Open a phase that ends in another function, with finish()"""
+        self._open[phase] = time.monotonic()
+
+    def finish(self, phase: str):
+        started_at = self._open.pop(phase, None)
+        if started_at is not None:
+            self.record(phase, started_at)
+
+    def to_dict(self) -> dict:
+        return {
+            "started_at": datetime.fromtimestamp(self.started_at, timezone.utc).isoformat(),
+            "phases": [
+                {"phase": phase, "start_ms": round(start * 1000, 1), "duration_ms": round(duration * 1000, 1)}
+                for phase, start, duration in self.phases
+            ],
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, value: Optional[str]) -> "JobTimeline":
+        """
+        Continue a stored timeline, e.g. one started by the API process and
+        picked up by a worker. Monotonic clocks differ between processes, so the
+        offset of the new phases is carried over through the wall clock.
+        """
+        if not value:
+            return cls()
+        data = json.loads(value)
+        started_at = datetime.fromisoformat(data["started_at"]).timestamp()
+        timeline = cls(time.monotonic() - (datetime.now(timezone.utc).timestamp() - started_at))
+        timeline.started_at = started_at
+        timeline.phases = [
+            [phase["phase"], phase["start_ms"] / 1000, phase["duration_ms"] / 1000] for phase in data["phases"]
+        ]
+        return timeline
+
+
+@contextmanager
+def phase(timeline: Optional[JobTimeline], name: str):
+    """Record the with block as a phase of timeline, if there is one"""
+    if timeline is None:
+        yield
+        return
+    started_at = time.monotonic()
+    try:
+        yield
+    finally:
+        timeline.record(name, started_at)
+
+
+def new_timeline(origin: Optional[float] = None) -> Optional[JobTimeline]:
+    """A timeline starting at origin, or None when timelines are disabled"""
+    return JobTimeline(origin) if JOB_TIMELINE_ENABLED else None
+
+
+def resume_timeline(value: Optional[str]) -> Optional[JobTimeline]:
+    """Carry on a job's stored timeline, starting a new one if it has none or it can't be read"""
+    if not JOB_TIMELINE_ENABLED:
+        return None
+    try:
+        return JobTimeline.from_json(value)
+    except (ValueError, KeyError, TypeError):
+        return JobTimeline()
+
+
+class ActiveTimelines:
+    """Timelines of the unfinished jobs of this process, until they are stored with the job"""
+
+    def __init__(self, max_entries: int = TIMELINE_MAX_ACTIVE):
+        self.max_entries = max_entries
+        self._timelines = OrderedDict()
+
+    def put(self, job_id: str, timeline: Optional[JobTimeline]):
+        if timeline is None:
+            return
+        self._timelines[job_id] = timeline
+        while len(self._timelines) > self.max_entries:
+            self._timelines.popitem(last=False)
+
+    def get(self, job_id: str) -> Optional[JobTimeline]:
+        return self._timelines.get(job_id)
+
+    def pop(self, job_id: str) -> Optional[JobTimeline]:
+        return self._timelines.pop(job_id, None)
+
+    def start(self, job_id: str, phase: str):
+        timeline = self._timelines.get(job_id)
+        if timeline is not None:
+            timeline.start(phase)
+
+    def finish(self, job_id: str, phase: str):
+        timeline = self._timelines.get(job_id)
+        if timeline is not None:
+            timeline.finish(phase)
+
+    def __len__(self) -> int:
+        return len(self._timelines)
+
+
+active_timelines = ActiveTimelines()
+
+
+def phase_percentiles(timelines: Iterable[dict]) -> Dict[str, dict]:
+    """
+    p50/p95/p99 of the time jobs spent in each phase, adding up repeated
+    phases within a job. "total" is the time from request to the last phase.
+    """
+    durations = {}
+    for timeline in timelines:
+        totals = {}
+        end = 0.0
+        for entry in timeline["phases"]:
+            totals[entry["phase"]] = totals.get(entry["phase"], 0.0) + entry["duration_ms"]
+            end = max(end, entry["start_ms"] + entry["duration_ms"])
+        totals["total"] = end
+        for name, value in totals.items():
+            durations.setdefault(name, []).append(value)
+    stats = {}
+    for name, values in durations.items():
+        values.sort()
+        stats[name] = {
+            "jobs": len(values),
+            "avg_ms": round(sum(values) / len(values), 1),
+            "p50_ms": round(percentile(values, 0.50), 1),
+            "p95_ms": round(percentile(values, 0.95), 1),
+            "p99_ms": round(percentile(values, 0.99), 1),
+        }
+    return stats
@@ -0,0 +1,160 @@
+"""
+Standalone job worker for JOB_DISPATCH=external. Claims pending jobs from the
+jobs table under a lease, runs them through the same pipeline as the API
+process and keeps the leases alive with heartbeats. Jobs of a worker that
+dies are reclaimed by the others once their leases expire.
+
+In local mode each API process runs a Worker too: the jobs it accepts start
+out leased to it, and it claims only jobs whose lease ran out, i.e. those of
+a crashed or stopped instance.
+
+Run as many as needed, on one machine or several sharing the database and
+the upload store:
+
+    JOB_DISPATCH=external python -m app.worker
+"""
+import os
+import uuid
+import signal
+import socket
+import asyncio
+import logging
+from dotenv import load_dotenv
+
+from app.falai_client import FALAI_MODE, start_http_client, close_http_client
+from app.db import db, init_db, update_job_status, claim_jobs, renew_leases, release_leases, get_exhausted_jobs, flush_job_status_writes
+from app.image_processing import start_image_executor, shutdown_image_executor
+from app.storage import upload_store
+from app.job_queue import JOB_PRIORITY_WEIGHTS, INTERACTIVE, BATCH
+from app.jobs import JOB_DISPATCH, job_queue, falai_poller, restart_job
+
+load_dotenv()
+
+# Seconds a claim is valid without a heartbeat. A crashed worker's jobs are reclaimed after this.
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+# Seconds between lease renewals, well inside the lease so one slow heartbeat doesn't lose it
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", str(JOB_LEASE_SECONDS / 3)))
+# Claims of a job before it is failed as retryable instead of being handed out again
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Seconds between claim attempts while there is nothing to claim
+JOB_CLAIM_INTERVAL = float(os.getenv("JOB_CLAIM_INTERVAL", "1.0"))
+
+# Interactive jobs claimed per batch job when both are waiting
+INTERACTIVE_CLAIM_WEIGHT = JOB_PRIORITY_WEIGHTS[INTERACTIVE] / max(JOB_PRIORITY_WEIGHTS[BATCH], 0.001)
+
+
+class Worker:
+    """
+    Claims jobs while the local worker pool has free slots and hands them to
+    it. A job's lease is held until the job completes or fails, including
+    while its FalAI queue request is tracked by the poller.
+    """
+
+    def __init__(
+        self,
+        owner: str = None,
+        lease_seconds: float = JOB_LEASE_SECONDS,
+        heartbeat_seconds: float = JOB_HEARTBEAT_SECONDS,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+        claim_interval: float = JOB_CLAIM_INTERVAL
+    ):
+        self.owner = owner or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.max_attempts = max_attempts
+        self.claim_interval = claim_interval
+        self.claimed = 0
+        self.exhausted = 0
+
+    async def run(self, stopping: asyncio.Event = None):
+        """Claim jobs until stopping is set or the task is cancelled"""
+        stopping = stopping or asyncio.Event()
+        heartbeat = asyncio.create_task(self._heartbeat())
+        try:
+            while not stopping.is_set():
+                claimed = await self._claim()
+                if not claimed:
+                    try:
+                        await asyncio.wait_for(stopping.wait(), self.claim_interval)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            heartbeat.cancel()
+            await asyncio.gather(heartbeat, return_exceptions=True)
+
+    async def _claim(self) -> int:
+        free = job_queue.free_slots()
+        if not free:
+            return 0
+        try:
+            rows = await claim_jobs(self.owner, free, self.lease_seconds, self.max_attempts, INTERACTIVE_CLAIM_WEIGHT)
+        except Exception as e:
+            logging.error(f"Claiming jobs failed: {e}")
+            return 0
+        for row in rows:
+            self.claimed += 1
+            logging.info(f"Claimed job {row['id']} (attempt {row['attempts']})")
+            try:
+                await restart_job(row)
+            except Exception as e:
+                logging.error(f"Starting claimed job {row['id']} failed: {e}", exc_info=True)
+        return len(rows)
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            try:
+                await renew_leases(self.owner, self.lease_seconds)
+                await self._fail_exhausted()
+            except Exception as e:
+                logging.error(f"Renewing job leases failed: {e}")
+
+    async def _fail_exhausted(self):
+        for row in await get_exhausted_jobs(self.max_attempts):
+            self.exhausted += 1
+            logging.error(f"Job {row['id']} failed after {self.max_attempts} claims")
+            await update_job_status(row["id"], "failed", retryable=True)
+
+
+async def run_worker():
+    if JOB_DISPATCH != "external":
+        raise SystemExit("app.worker only runs with JOB_DISPATCH=external; in local mode the API process runs the jobs")
+    if upload_store is None:
+        raise SystemExit("app.worker needs UPLOAD_STORE_ENABLED to read the uploads of the jobs it claims")
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    await db.connect()
+    await init_db()
+    await start_http_client()
+    start_image_executor()
+    await job_queue.start()
+    if FALAI_MODE == "queue":
+        await falai_poller.start()
+
+    worker = Worker()
+    logging.info(f"Worker {worker.owner} started ({job_queue.workers} slots, {worker.lease_seconds:.0f}s leases)")
+    try:
+        await worker.run(stopping)
+    finally:
+        logging.info(f"Worker {worker.owner} stopping after {worker.claimed} claims")
+        await job_queue.stop()
+        await falai_poller.stop()
+        await flush_job_status_writes()
+        # Hand unfinished jobs straight back instead of making others wait out the lease
+        await release_leases(worker.owner)
+        shutdown_image_executor()
+        await close_http_client()
+        await db.disconnect()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_worker())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+from typing import Optional
+
+# Delay before retrying a flush that failed
+RETRY_DELAY_SECONDS = 1.0
+
+
+class WriteBehindBuffer:
+    """
+    Collects writes of a single parameterized statement for a few milliseconds
+    and flushes them as one transaction with execute_many. Writes are keyed
+    (e.g. by job ID) so a later write for the same key replaces an unflushed
+    earlier one.
+    """
+
+    def __init__(self, database, query: str, flush_interval: float, max_batch: int):
+        self.database = database
+        self.query = query
+        self.flush_interval = flush_interval
+        self.max_batch = max(1, max_batch)
+        self._pending = {}
+        # Batch currently being written; still invisible to database readers
+        self._flushing = {}
+        self._lock = asyncio.Lock()
+        self._timer: Optional[asyncio.Task] = None
+        self._tasks = set()
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.errors = 0
+
+    def add(self, key: str, values: dict):
+        self._pending[key] = values
+        if len(self._pending) >= self.max_batch:
+            self._spawn(self.flush())
+        elif self._timer is None:
+            self._timer = self._spawn(self._flush_later(self.flush_interval))
+
+    def pending(self, key: str) -> Optional[dict]:
+        """Values written for key that haven't reached the database yet"""
+        values = self._pending.get(key)
+        if values is None:
+            values = self._flushing.get(key)
+        return values
+
+    def _spawn(self, coro) -> asyncio.Task:
+        # Keep a reference so the task isn't garbage collected mid-flight
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _flush_later(self, delay: float):
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            self._timer = None
+        await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            if not self._pending:
+                return
+            batch = self._pending
+            self._pending = {}
+            self._flushing = batch
+            try:
+                await self.database.execute_many(self.query, list(batch.values()))
+            except Exception as e:
+                self.errors += 1
+                logging.error(f"Write-behind flush of {len(batch)} rows failed, will retry: {e}")
+                # Put the batch back without overwriting anything written since
+                for key, values in batch.items():
+                    self._pending.setdefault(key, values)
+                if self._timer is None:
+                    self._timer = self._spawn(self._flush_later(RETRY_DELAY_SECONDS))
+                return
+            finally:
+                self._flushing = {}
+            self.flushes += 1
+            self.rows_flushed += len(batch)
+
+    async def close(self):
+        """Flush everything still buffered. Called on shutdown before the database disconnects."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.flush()
+        if self._pending:
+            logging.error(f"Write-behind buffer closed with {len(self._pending)} unflushed rows")
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "flushes": self.flushes,
+            "rows_flushed": self.rows_flushed,
+            "avg_batch_size": round(self.rows_flushed / self.flushes, 1) if self.flushes else 0.0,
+            "errors": self.errors,
+        }
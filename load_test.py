@@ -0,0 +1,424 @@
+"""
+Load test of the backend against the local mock FalAI server.
+
+Starts mock_falai_server.py and the app (plus `app.worker` processes with
+--dispatch external) as subprocesses on a fresh database, then runs
+--concurrency clients that each create a job, poll it until it finishes and
+start the next one, until --jobs jobs are done. Reports throughput, latency
+percentiles, database contention and memory per job, and writes everything
+to a JSON file so runs can be compared across commits:
+
+    python load_test.py --jobs 200 --concurrency 20
+    python load_test.py --falai-mode queue --latency-dist lognormal --error-rate 0.05 --nsfw-rate 0.02
+    python load_test.py --dispatch external --worker-processes 2 --output results/external.json
+"""
+import io
+import os
+import re
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+
+import httpx
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+TERMINAL_STATUSES = ("completed", "failed")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=100, help="jobs to create (default 100)")
+    parser.add_argument("--concurrency", type=int, default=10, help="clients creating and polling jobs at once (default 10)")
+    parser.add_argument("--poll-interval", type=float, default=0.25, help="seconds between status polls (default 0.25)")
+    parser.add_argument("--long-poll", type=float, default=0, help="poll with ?wait= this many seconds instead of sleeping")
+    parser.add_argument("--job-timeout", type=float, default=120, help="seconds before a client gives up on a job")
+    parser.add_argument("--image-size", type=int, default=1024, help="width and height of the uploaded JPEG (default 1024)")
+    parser.add_argument("--falai-mode", choices=("sync", "queue"), default="sync")
+    parser.add_argument("--dispatch", choices=("local", "external"), default="local")
+    parser.add_argument("--worker-processes", type=int, default=1, help="app.worker processes with --dispatch external")
+    parser.add_argument("--job-workers", type=int, default=4, help="JOB_WORKERS of the app (default 4)")
+    parser.add_argument("--latency", type=float, default=1.0, help="mock FalAI latency in seconds (mean or median)")
+    parser.add_argument("--latency-dist", choices=("fixed", "uniform", "exponential", "lognormal"), default="fixed")
+    parser.add_argument("--queue-delay", type=float, default=0.2, help="mock FalAI queue wait in seconds (queue mode)")
+    parser.add_argument("--error-rate", type=float, default=0, help="share of mock FalAI calls answered with 503")
+    parser.add_argument("--nsfw-rate", type=float, default=0, help="share of mock FalAI results flagged as NSFW")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--port", type=int, default=0, help="port of the app (default: a free one)")
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE", help="extra environment for the app")
+    parser.add_argument("--output", default=None, help="JSON results file (default load_test_results/<time>-<commit>.json)")
+    return parser.parse_args()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def percentiles(values) -> dict:
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(len(values) * q))]
+    return {
+        "count": len(values),
+        "avg_ms": round(sum(values) / len(values) * 1000, 1),
+        "p50_ms": round(pick(0.50) * 1000, 1),
+        "p95_ms": round(pick(0.95) * 1000, 1),
+        "p99_ms": round(pick(0.99) * 1000, 1),
+        "max_ms": round(values[-1] * 1000, 1),
+    }
+
+
+def rss_bytes(pid: int):
+    """Resident memory of a process, from /proc (None where that isn't available)"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def make_image(size: int, seed: int) -> bytes:
+    rng = random.Random(seed)
+    image = Image.new("RGB", (size, size))
+    # Coarse noise, so the JPEG has a realistic size without taking long to generate
+    block = max(1, size // 64)
+    for x in range(0, size, block):
+        for y in range(0, size, block):
+            image.paste((rng.randrange(256), rng.randrange(256), rng.randrange(256)), (x, y, x + block, y + block))
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=90)
+    return out.getvalue()
+
+
+def parse_db_metrics(text: str) -> dict:
+    """statement -> (count, sum of seconds) of db_query_duration_seconds"""
+    metrics = {}
+    for name, statement, value in re.findall(r'^db_query_duration_seconds_(count|sum)\{statement="([^"]+)"\} (\S+)$', text, re.M):
+        count, total = metrics.get(statement, (0, 0.0))
+        metrics[statement] = (float(value), total) if name == "count" else (count, float(value))
+    return metrics
+
+
+class Services:
+    """The mock FalAI server, the app and any external workers, as subprocesses"""
+
+    def __init__(self, args, workdir: str):
+        self.args = args
+        self.mock_port = free_port()
+        self.port = args.port or free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.log = open(os.path.join(workdir, "services.log"), "w")
+        self.mock_env = {
+            **os.environ,
+            "MOCK_FALAI_PORT": str(self.mock_port),
+            "MOCK_FALAI_LATENCY": str(args.latency),
+            "MOCK_FALAI_LATENCY_DIST": args.latency_dist,
+            "MOCK_FALAI_QUEUE_DELAY": str(args.queue_delay),
+            "MOCK_FALAI_ERROR_RATE": str(args.error_rate),
+            "MOCK_FALAI_NSFW_RATE": str(args.nsfw_rate),
+            "MOCK_FALAI_SEED": str(args.seed),
+            "MOCK_FALAI_FETCH_INPUTS": "false",
+        }
+        self.app_env = {
+            **os.environ,
+            "DATABASE_URL": f"sqlite+aiosqlite:///{os.path.join(workdir, 'jobs.db')}",
+            "UPLOAD_STORE_DIR": os.path.join(workdir, "uploads"),
+            "INPUT_STORAGE": "inline",
+            "FALAI_API_KEY": "mock-falai-key",
+            "FALAI_MODE": args.falai_mode,
+            "FALAI_URL": f"http://127.0.0.1:{self.mock_port}/sync/fal-ai/qwen-image-edit-plus-lora",
+            "FALAI_QUEUE_URL": f"http://127.0.0.1:{self.mock_port}/queue/fal-ai/qwen-image-edit-plus-lora",
+            "FALAI_POLL_INTERVAL": "0.2",
+            "JOB_DISPATCH": args.dispatch,
+            "JOB_WORKERS": str(args.job_workers),
+            # Room for every client's jobs; rejections would measure the limits, not the backend
+            "JOB_QUEUE_MAX_SIZE": str(max(100, args.concurrency * 2)),
+            "RATE_LIMIT_ENABLED": "false",
+            "API_KEY": "",
+            "API_KEYS": "",
+        }
+        for entry in args.env:
+            name, _, value = entry.partition("=")
+            self.app_env[name] = value
+        self.mock = None
+        self.app = None
+        self.workers = []
+
+    def _spawn(self, command, env):
+        return subprocess.Popen(command, cwd=ROOT, env=env, stdout=self.log, stderr=subprocess.STDOUT)
+
+    def start(self):
+        self.mock = self._spawn([sys.executable, "mock_falai_server.py"], self.mock_env)
+        self._wait_ready(f"http://127.0.0.1:{self.mock_port}/stats")
+        self.app = self._spawn(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(self.port), "--log-level", "warning"],
+            self.app_env
+        )
+        self._wait_ready(f"{self.base_url}/health")
+        if self.args.dispatch == "external":
+            self.workers = [
+                self._spawn([sys.executable, "-m", "app.worker"], self.app_env)
+                for _ in range(self.args.worker_processes)
+            ]
+
+    def _wait_ready(self, url: str, timeout: float = 30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                if httpx.get(url, timeout=1).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.1)
+        raise RuntimeError(f"{url} didn't come up within {timeout:.0f}s, see services.log")
+
+    def stop(self):
+        for process in self.workers + [self.app, self.mock]:
+            if process is not None and process.poll() is None:
+                process.terminate()
+        for process in self.workers + [self.app, self.mock]:
+            if process is not None:
+                try:
+                    process.wait(10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+        self.log.close()
+
+    def pids(self):
+        return [process.pid for process in [self.app] + self.workers]
+
+
+class LoadTest:
+    def __init__(self, args, services: Services, image: bytes):
+        self.args = args
+        self.services = services
+        self.image = image
+        self.next_job = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.create_latencies = []
+        self.poll_latencies = []
+        self.job_latencies = []
+        self.outcomes = {}
+        self.create_errors = {}
+        self.polls = 0
+        self.peak_rss = {}
+
+    async def run(self) -> float:
+        limits = httpx.Limits(max_connections=self.args.concurrency * 2)
+        async with httpx.AsyncClient(base_url=self.services.base_url, timeout=self.args.job_timeout, limits=limits) as client:
+            sampler = asyncio.create_task(self._sample_memory())
+            started_at = time.monotonic()
+            await asyncio.gather(*(self._client(client) for _ in range(self.args.concurrency)))
+            elapsed = time.monotonic() - started_at
+            sampler.cancel()
+        return elapsed
+
+    async def _sample_memory(self):
+        while True:
+            for pid in self.services.pids():
+                rss = rss_bytes(pid)
+                if rss is not None:
+                    self.peak_rss[pid] = max(self.peak_rss.get(pid, 0), rss)
+            await asyncio.sleep(0.1)
+
+    async def _client(self, client: httpx.AsyncClient):
+        while self.next_job < self.args.jobs:
+            index = self.next_job
+            self.next_job += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            try:
+                await self._job(client, index)
+            finally:
+                self.in_flight -= 1
+
+    def _count(self, counts: dict, key: str):
+        counts[key] = counts.get(key, 0) + 1
+
+    async def _job(self, client: httpx.AsyncClient, index: int):
+        started_at = time.monotonic()
+        try:
+            resp = await client.post(
+                "/api/jobs",
+                # A distinct prompt per job, so the result cache and coalescing don't skip the work
+                data={"prompt": f"load test {index}"},
+                files={"image": ("load.jpg", self.image, "image/jpeg")},
+            )
+        except httpx.HTTPError as e:
+            self._count(self.create_errors, type(e).__name__)
+            return
+        self.create_latencies.append(time.monotonic() - started_at)
+        if resp.status_code != 200:
+            self._count(self.create_errors, str(resp.status_code))
+            return
+        job_id = resp.json()["job_id"]
+
+        deadline = started_at + self.args.job_timeout
+        params = {"wait": self.args.long_poll} if self.args.long_poll else {}
+        while time.monotonic() < deadline:
+            if not self.args.long_poll:
+                await asyncio.sleep(self.args.poll_interval)
+            poll_started_at = time.monotonic()
+            try:
+                resp = await client.get(f"/api/jobs/{job_id}", params=params)
+            except httpx.HTTPError as e:
+                self._count(self.outcomes, f"poll_error_{type(e).__name__}")
+                return
+            self.polls += 1
+            if not self.args.long_poll:
+                self.poll_latencies.append(time.monotonic() - poll_started_at)
+            job = resp.json() if resp.status_code == 200 else {}
+            if job.get("status") in TERMINAL_STATUSES:
+                self.job_latencies.append(time.monotonic() - started_at)
+                self._count(self.outcomes, job["status"] + ("_retryable" if job.get("retryable") else ""))
+                return
+        self._count(self.outcomes, "timed_out")
+
+
+def database_contention(before: dict, after: dict, metrics_before: dict, metrics_after: dict) -> dict:
+    database_before, database_after = before.get("database", {}), after.get("database", {})
+    contention = {
+        "backend": database_after.get("backend"),
+        "reads": database_after.get("reads", 0) - database_before.get("reads", 0),
+        "writes": database_after.get("writes", 0) - database_before.get("writes", 0),
+        # Reads that found every reader connection busy
+        "read_waits": database_after.get("read_waits", 0) - database_before.get("read_waits", 0),
+        "statements": {},
+    }
+    for statement, (count, total) in metrics_after.items():
+        previous_count, previous_total = metrics_before.get(statement, (0, 0.0))
+        if count > previous_count:
+            contention["statements"][statement] = {
+                "count": int(count - previous_count),
+                "avg_ms": round((total - previous_total) / (count - previous_count) * 1000, 2),
+            }
+    return contention
+
+
+async def snapshot(base_url: str):
+    async with httpx.AsyncClient(base_url=base_url, timeout=30) as client:
+        stats = (await client.get("/api/stats")).json()
+        metrics = parse_db_metrics((await client.get("/metrics")).text)
+    return stats, metrics
+
+
+async def run(args) -> dict:
+    image = make_image(args.image_size, args.seed)
+    with tempfile.TemporaryDirectory(prefix="haybi-load-") as workdir:
+        services = Services(args, workdir)
+        try:
+            services.start()
+            baseline_rss = {pid: rss_bytes(pid) for pid in services.pids()}
+            stats_before, metrics_before = await snapshot(services.base_url)
+            test = LoadTest(args, services, image)
+            print(f"Running {args.jobs} jobs with {args.concurrency} clients against {services.base_url}...")
+            elapsed = await test.run()
+            stats_after, metrics_after = await snapshot(services.base_url)
+            async with httpx.AsyncClient(timeout=30) as client:
+                timeline = (await client.get(f"{services.base_url}/api/stats/timeline", params={"limit": args.jobs})).json()
+                mock_stats = (await client.get(f"http://127.0.0.1:{services.mock_port}/stats")).json()
+        except Exception:
+            print(f"Services log: {os.path.join(workdir, 'services.log')}")
+            with open(os.path.join(workdir, "services.log")) as f:
+                print(f.read()[-4000:])
+            raise
+        finally:
+            services.stop()
+
+    finished = len(test.job_latencies)
+    memory = {}
+    for pid, peak in test.peak_rss.items():
+        role = "app" if pid == services.app.pid else f"worker-{pid}"
+        baseline = baseline_rss.get(pid) or 0
+        memory[role] = {
+            "baseline_rss_bytes": baseline,
+            "peak_rss_bytes": peak,
+            # Growth over idle, spread over the most jobs in flight at once
+            "rss_per_in_flight_job_bytes": int((peak - baseline) / max(1, test.peak_in_flight)),
+        }
+    memory["budget_high_water_bytes"] = stats_after.get("memory_budget", {}).get("high_water_bytes")
+
+    return {
+        "commit": git_commit(),
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "config": {**vars(args), "image_bytes": len(image)},
+        "results": {
+            "elapsed_seconds": round(elapsed, 3),
+            "throughput_jobs_per_second": round(finished / elapsed, 3) if elapsed else 0.0,
+            "create_requests_per_second": round(len(test.create_latencies) / elapsed, 3) if elapsed else 0.0,
+            "status_requests_per_second": round(test.polls / elapsed, 3) if elapsed else 0.0,
+            "jobs_finished": finished,
+            "outcomes": test.outcomes,
+            "create_errors": test.create_errors,
+            "peak_in_flight": test.peak_in_flight,
+            "latency": {
+                "create": percentiles(test.create_latencies),
+                "status_poll": percentiles(test.poll_latencies),
+                "job": percentiles(test.job_latencies),
+            },
+            "database": database_contention(stats_before, stats_after, metrics_before, metrics_after),
+            "memory": memory,
+            "phases": timeline.get("phases", {}),
+            "queue": stats_after.get("queue"),
+            "mock_falai": mock_stats,
+        },
+    }
+
+
+def print_summary(report: dict):
+    results = report["results"]
+    latency = results["latency"]
+    print(f"Commit {report['commit']}: {results['jobs_finished']} jobs in {results['elapsed_seconds']}s, "
+          f"{results['throughput_jobs_per_second']} jobs/s")
+    print(f"Outcomes: {results['outcomes']}, create errors: {results['create_errors']}")
+    for name in ("create", "status_poll", "job"):
+        stats = latency[name]
+        if stats["count"]:
+            print(f"  {name:12} p50 {stats['p50_ms']}ms  p95 {stats['p95_ms']}ms  p99 {stats['p99_ms']}ms  max {stats['max_ms']}ms")
+    database = results["database"]
+    print(f"Database: {database['reads']} reads, {database['writes']} writes, {database['read_waits']} reads waited for a connection")
+    slowest = sorted(database["statements"].items(), key=lambda item: item[1]["avg_ms"], reverse=True)[:5]
+    for statement, stats in slowest:
+        print(f"  {statement:28} {stats['count']:6} queries  avg {stats['avg_ms']}ms")
+    for role, stats in results["memory"].items():
+        if isinstance(stats, dict):
+            print(f"Memory {role}: peak {stats['peak_rss_bytes'] / 2**20:.1f} MiB, "
+                  f"{stats['rss_per_in_flight_job_bytes'] / 2**10:.0f} KiB per in-flight job")
+
+
+def main():
+    args = parse_args()
+    report = asyncio.run(run(args))
+    output = args.output or os.path.join(
+        ROOT, "load_test_results", f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{report['commit']}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print_summary(report)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Local stand-in for the FalAI API, for testing without a FalAI account.
+
+Serves the synchronous endpoint and the queue protocol (submit, status,
+result) for any model path:
+
+    POST /sync/<model>                                  -> result
+    POST /queue/<model>                                 -> {"request_id", "status_url", "response_url"}
+    GET  /queue/<model>/requests/<request_id>/status    -> {"status": "IN_QUEUE" | "IN_PROGRESS" | "COMPLETED"}
+    GET  /queue/<model>/requests/<request_id>           -> result
+
+Run it with:
+
+    python mock_falai_server.py
+
+and point the backend at it:
+
+    FALAI_URL=http://127.0.0.1:8001/sync/fal-ai/qwen-image-edit-plus-lora
+    FALAI_QUEUE_URL=http://127.0.0.1:8001/queue/fal-ai/qwen-image-edit-plus-lora
+
+Latency follows MOCK_FALAI_LATENCY_DIST, and MOCK_FALAI_ERROR_RATE and
+MOCK_FALAI_NSFW_RATE make a share of requests fail or get blocked, e.g. for
+load_test.py. GET /stats reports what was served.
+"""
+import os
+import time
+import uuid
+import random
+import asyncio
+import httpx
+from fastapi import FastAPI, Request, HTTPException
+
+# Seconds a request spends waiting in the queue and then running
+MOCK_FALAI_QUEUE_DELAY = float(os.getenv("MOCK_FALAI_QUEUE_DELAY", "0.5"))
+MOCK_FALAI_LATENCY = float(os.getenv("MOCK_FALAI_LATENCY", "2.0"))
+# How the running time varies: "fixed" (MOCK_FALAI_LATENCY), "uniform" (MOCK_FALAI_LATENCY
+# +/- MOCK_FALAI_LATENCY_JITTER), "exponential" (mean MOCK_FALAI_LATENCY) or "lognormal"
+# (median MOCK_FALAI_LATENCY, shape MOCK_FALAI_LATENCY_SIGMA, i.e. a long tail)
+MOCK_FALAI_LATENCY_DIST = os.getenv("MOCK_FALAI_LATENCY_DIST", "fixed").lower()
+MOCK_FALAI_LATENCY_JITTER = float(os.getenv("MOCK_FALAI_LATENCY_JITTER", "0.5"))
+MOCK_FALAI_LATENCY_SIGMA = float(os.getenv("MOCK_FALAI_LATENCY_SIGMA", "0.5"))
+# Share of sync calls and queue submissions answered with MOCK_FALAI_ERROR_STATUS
+MOCK_FALAI_ERROR_RATE = float(os.getenv("MOCK_FALAI_ERROR_RATE", "0"))
+MOCK_FALAI_ERROR_STATUS = int(os.getenv("MOCK_FALAI_ERROR_STATUS", "503"))
+# Share of results flagged by the safety checker
+MOCK_FALAI_NSFW_RATE = float(os.getenv("MOCK_FALAI_NSFW_RATE", "0"))
+# Seed for reproducible runs (random when empty)
+MOCK_FALAI_SEED = os.getenv("MOCK_FALAI_SEED", "")
+MOCK_FALAI_HOST = os.getenv("MOCK_FALAI_HOST", "127.0.0.1")
+MOCK_FALAI_PORT = int(os.getenv("MOCK_FALAI_PORT", "8001"))
+# Authentication accepted: "key", "bearer" or "x-api-key", and the key required (any when empty)
+MOCK_FALAI_AUTH_SCHEME = os.getenv("MOCK_FALAI_AUTH_SCHEME", "key").lower()
+MOCK_FALAI_API_KEY = os.getenv("MOCK_FALAI_API_KEY", "")
+# Download http(s) image URLs like FalAI does, rejecting requests whose inputs can't be fetched
+MOCK_FALAI_FETCH_INPUTS = os.getenv("MOCK_FALAI_FETCH_INPUTS", "true").lower() in ("1", "true", "yes")
+
+app = FastAPI(title="Mock FalAI")
+
+# request_id -> submitted request
+requests = {}
+
+rng = random.Random(int(MOCK_FALAI_SEED) if MOCK_FALAI_SEED else None)
+stats = {"sync": 0, "submitted": 0, "errors": 0, "nsfw": 0, "status_checks": 0, "results": 0}
+
+
+def sample_latency() -> float:
+    if MOCK_FALAI_LATENCY_DIST == "uniform":
+        return max(0.0, rng.uniform(MOCK_FALAI_LATENCY - MOCK_FALAI_LATENCY_JITTER, MOCK_FALAI_LATENCY + MOCK_FALAI_LATENCY_JITTER))
+    if MOCK_FALAI_LATENCY_DIST == "exponential":
+        return rng.expovariate(1 / MOCK_FALAI_LATENCY) if MOCK_FALAI_LATENCY > 0 else 0.0
+    if MOCK_FALAI_LATENCY_DIST == "lognormal":
+        return rng.lognormvariate(0, MOCK_FALAI_LATENCY_SIGMA) * MOCK_FALAI_LATENCY
+    return MOCK_FALAI_LATENCY
+
+
+def inject_error():
+    """Fail a share of requests like an overloaded FalAI would"""
+    if MOCK_FALAI_ERROR_RATE and rng.random() < MOCK_FALAI_ERROR_RATE:
+        stats["errors"] += 1
+        raise HTTPException(status_code=MOCK_FALAI_ERROR_STATUS, detail="Mock FalAI error")
+
+
+def check_auth(request: Request):
+    if MOCK_FALAI_AUTH_SCHEME == "x-api-key":
+        api_key = request.headers.get("x-api-key", "")
+    else:
+        prefix = "Bearer " if MOCK_FALAI_AUTH_SCHEME == "bearer" else "Key "
+        authorization = request.headers.get("authorization", "")
+        api_key = authorization[len(prefix):] if authorization.startswith(prefix) else ""
+    if not api_key or (MOCK_FALAI_API_KEY and api_key != MOCK_FALAI_API_KEY):
+        raise HTTPException(status_code=401, detail="Authentication is required to access this application.")
+
+
+async def fetch_inputs(body: dict):
+    """Fetch every http(s) input like FalAI would; data URLs are taken as they are"""
+    if not MOCK_FALAI_FETCH_INPUTS:
+        return
+    urls = [url for url in body.get("image_urls", []) if url.startswith(("http://", "https://"))]
+    if not urls:
+        return
+    async with httpx.AsyncClient(timeout=10) as client:
+        for url in urls:
+            try:
+                resp = await client.get(url)
+            except httpx.HTTPError as e:
+                raise HTTPException(status_code=422, detail=f"Failed to download image {url}: {e}")
+            if resp.status_code != 200:
+                raise HTTPException(status_code=422, detail=f"Failed to download image {url}: HTTP {resp.status_code}")
+
+
+def make_result(request_id: str, body: dict, nsfw: bool = False) -> dict:
+    if nsfw:
+        stats["nsfw"] += 1
+    return {
+        "images": [{
+            "url": f"http://{MOCK_FALAI_HOST}:{MOCK_FALAI_PORT}/files/{request_id}.png",
+            "width": 1024,
+            "height": 1024,
+            "content_type": "image/png",
+        }],
+        "prompt": body.get("prompt"),
+        "seed": 42,
+        "has_nsfw_concepts": [nsfw],
+    }
+
+
+def queue_status(entry: dict) -> str:
+    elapsed = time.monotonic() - entry["submitted_at"]
+    if elapsed < MOCK_FALAI_QUEUE_DELAY:
+        return "IN_QUEUE"
+    if elapsed < MOCK_FALAI_QUEUE_DELAY + entry["latency"]:
+        return "IN_PROGRESS"
+    return "COMPLETED"
+
+
+def get_entry(request_id: str) -> dict:
+    entry = requests.get(request_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Request not found")
+    return entry
+
+
+@app.post("/sync/{model:path}")
+async def run_sync(model: str, request: Request):
+    check_auth(request)
+    stats["sync"] += 1
+    inject_error()
+    body = await request.json()
+    await fetch_inputs(body)
+    await asyncio.sleep(sample_latency())
+    return make_result(uuid.uuid4().hex, body, rng.random() < MOCK_FALAI_NSFW_RATE)
+
+
+@app.post("/queue/{model:path}")
+async def submit(model: str, request: Request):
+    check_auth(request)
+    stats["submitted"] += 1
+    inject_error()
+    body = await request.json()
+    await fetch_inputs(body)
+    request_id = uuid.uuid4().hex
+    requests[request_id] = {
+        "body": body,
+        "submitted_at": time.monotonic(),
+        "latency": sample_latency(),
+        "nsfw": rng.random() < MOCK_FALAI_NSFW_RATE,
+    }
+    base = f"{request.base_url}queue/{model}/requests/{request_id}"
+    return {
+        "request_id": request_id,
+        "status_url": f"{base}/status",
+        "response_url": base,
+    }
+
+
+@app.get("/queue/{model:path}/requests/{request_id}/status")
+async def status(model: str, request_id: str, request: Request):
+    check_auth(request)
+    stats["status_checks"] += 1
+    entry = get_entry(request_id)
+    return {"status": queue_status(entry), "request_id": request_id}
+
+
+@app.get("/queue/{model:path}/requests/{request_id}")
+async def result(model: str, request_id: str, request: Request):
+    check_auth(request)
+    entry = get_entry(request_id)
+    if queue_status(entry) != "COMPLETED":
+        raise HTTPException(status_code=400, detail="Request is still in progress")
+    stats["results"] += 1
+    return make_result(request_id, entry["body"], entry["nsfw"])
+
+
+@app.get("/stats")
+async def get_stats():
+    return {**stats, "queued": len(requests)}
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host=MOCK_FALAI_HOST, port=MOCK_FALAI_PORT)
@@ -0,0 +1,47 @@
+"""
+Local stand-in for an object storage bucket, for testing INPUT_STORAGE=http.
+Objects are kept in memory:
+
+    PUT  /<name>   store the request body
+    HEAD /<name>   200 if stored, 404 otherwise
+    GET  /<name>   the stored object
+
+Run it with:
+
+    python mock_object_storage.py
+
+and point the backend at it:
+
+    INPUT_STORAGE=http
+    INPUT_STORAGE_ENDPOINT=http://127.0.0.1:8002
+"""
+import os
+from fastapi import FastAPI, Request, Response, HTTPException
+
+MOCK_STORAGE_HOST = os.getenv("MOCK_STORAGE_HOST", "127.0.0.1")
+MOCK_STORAGE_PORT = int(os.getenv("MOCK_STORAGE_PORT", "8002"))
+
+app = FastAPI(title="Mock object storage")
+
+# name -> (content type, body)
+objects = {}
+
+
+@app.put("/{name:path}")
+async def put_object(name: str, request: Request):
+    objects[name] = (request.headers.get("content-type", "application/octet-stream"), await request.body())
+    return Response(status_code=200)
+
+
+@app.head("/{name:path}")
+@app.get("/{name:path}")
+async def get_object(name: str):
+    if name not in objects:
+        raise HTTPException(status_code=404, detail="Not found")
+    content_type, body = objects[name]
+    return Response(content=body, media_type=content_type)
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host=MOCK_STORAGE_HOST, port=MOCK_STORAGE_PORT)
@@ -0,0 +1,80 @@
+"""
+End-to-end check of FALAI_MODE=queue against the local mock FalAI server.
+Starts mock_falai_server.py in the background, submits a few jobs to the
+backend and waits for them to complete through the queue pollers.
+
+    python test_falai_queue.py
+"""
+import io
+import os
+import sys
+import time
+import threading
+
+MOCK_PORT = int(os.getenv("MOCK_FALAI_PORT", "8001"))
+os.environ.setdefault("MOCK_FALAI_LATENCY", "1.0")
+os.environ["FALAI_MODE"] = "queue"
+os.environ["FALAI_QUEUE_URL"] = f"http://127.0.0.1:{MOCK_PORT}/queue/fal-ai/qwen-image-edit-plus-lora"
+os.environ["FALAI_URL"] = f"http://127.0.0.1:{MOCK_PORT}/sync/fal-ai/qwen-image-edit-plus-lora"
+os.environ["FALAI_POLL_INTERVAL"] = "0.2"
+os.environ.setdefault("FALAI_API_KEY", "mock-falai-key")
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///./test_falai_queue.db")
+os.environ.setdefault("API_KEY", "")
+
+import uvicorn
+from PIL import Image
+from fastapi.testclient import TestClient
+
+import mock_falai_server
+from app.main import app
+
+JOBS = 5
+
+
+def start_mock_server():
+    server = uvicorn.Server(uvicorn.Config(mock_falai_server.app, host="127.0.0.1", port=MOCK_PORT, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def make_image(color) -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", (256, 256), color=color).save(out, "PNG")
+    return out.getvalue()
+
+
+def main():
+    server = start_mock_server()
+    print(f"Mock FalAI server running on port {MOCK_PORT}")
+    ok = True
+    try:
+        with TestClient(app) as client:
+            job_ids = []
+            for i in range(JOBS):
+                resp = client.post(
+                    "/api/jobs",
+                    data={"prompt": f"Queue mode test {i}"},
+                    files={"image": (f"test{i}.png", make_image((i * 40, 0, 0)), "image/png")},
+                )
+                print(f"Submit {i}: {resp.status_code} {resp.json()}")
+                job_ids.append(resp.json()["job_id"])
+
+            for job_id in job_ids:
+                job = client.get(f"/api/jobs/{job_id}").json()
+                while job["status"] not in ("completed", "failed"):
+                    job = client.get(f"/api/jobs/{job_id}", params={"wait": 10, "since": job["status"]}).json()
+                print(f"Job {job_id}: {job['status']} upstream={job['upstream_request_id']} result={job['result_url']}")
+                ok = ok and job["status"] == "completed"
+
+            print(f"Queue poller stats: {client.get('/api/stats').json()['falai_queue']}")
+    finally:
+        server.should_exit = True
+
+    print("✅ All jobs completed through the FalAI queue" if ok else "❌ Some jobs did not complete")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())